@@ -4,30 +4,183 @@ import os
 
 # local modules
 import execute
+import governor
 
-def create_archive(members):
-    """Create a local archive file with the files in `members` and return a path to the file.
+def archive_cache_directory():
+    """Return the local directory in which package digests, compressed archives and the locks shared by jobs on this host are kept.
+
+    The IRODS_TEST_ARCHIVE_CACHE environment variable overrides the default.
+    """
+    return os.environ.get('IRODS_TEST_ARCHIVE_CACHE',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'irods_test', 'archives'))
+
+
+def archive_cache_size():
+    """Return the number of bytes of compressed archives to keep in the cache.
+
+    The IRODS_TEST_ARCHIVE_CACHE_SIZE environment variable overrides the default (8 GiB).
+    """
+    return int(os.environ.get('IRODS_TEST_ARCHIVE_CACHE_SIZE', 8 * 1024 ** 3))
+
+
+class cache_lock(object):
+    """Exclusive lock on a file, shared between threads and processes.
+
+    Lock files are never removed: a process which opened the file before it was unlinked and
+    one which creates it afresh would each hold a lock on a different file.
+    """
+    def __init__(self, path):
+        """Construct a cache_lock.
+
+        Arguments:
+        path -- local path to the lock file (created if it does not exist)
+        """
+        self.path = path
+        self.lock_file = None
+
+    def __enter__(self):
+        import fcntl
+
+        self.lock_file = open(self.path, 'a')
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        import fcntl
+
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
+
+
+def file_digest(path):
+    """Return the sha256 hex digest of the contents of the local file at `path`.
 
     Arguments:
-    members -- local files to be placed in the archive
+    path -- local path to the file to hash
     """
-    import tarfile
+    import hashlib
+
+    h = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def archive_key(members, cache_directory):
+    """Return a key which identifies a set of files (e.g. packages) by their paths and contents.
+
+    Hashing every package on every run is slow for large builds, so the digest of each member
+    is remembered in `cache_directory` along with its size and modification time and is only
+    recomputed when either of them changes.
+
+    Arguments:
+    members -- local files identified by the key
+    cache_directory -- local directory in which the digests are remembered
+    """
+    import hashlib
+    import json
     import tempfile
 
-    # TODO: allow for path to be specified
-    # TODO: allow for type of archive to be specified
-    # Create a tarfile with the packages
-    tarfile_name = 'packages.tar'
-    tarfile_path = os.path.join(tempfile.mkdtemp(), tarfile_name)
+    os.makedirs(cache_directory, exist_ok=True)
+
+    index_path = os.path.join(cache_directory, 'digests.json')
 
-    logging.debug('creating tarfile [{}]'.format(tarfile_path))
+    with cache_lock(os.path.join(cache_directory, 'digests.lock')):
+        try:
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            index = dict()
 
-    with tarfile.open(tarfile_path, 'w') as f:
+        digests = list()
         for m in members:
-            logging.debug('adding member [{0}] to tarfile'.format(m))
-            f.add(m)
+            path = os.path.abspath(m)
+            st = os.stat(path)
+
+            entry = index.get(path)
+            if not entry or entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns:
+                logging.debug('hashing member [{}]'.format(path))
+                entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'digest': file_digest(path)}
+                index[path] = entry
+
+            digests.append([path, entry['digest']])
+
+        # Forget about files which no longer exist so that the index does not grow forever
+        index = {p: e for p, e in index.items() if os.path.exists(p)}
+
+        fd, tmp = tempfile.mkstemp(dir=cache_directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, index_path)
+
+    return hashlib.sha256(json.dumps(sorted(digests)).encode('utf-8')).hexdigest()
+
+
+def cached_archive_path(members, compression, flatten, cache_directory):
+    """Return the local path at which the compressed archive of `members` is cached.
+
+    Arguments:
+    members -- local files to be placed in the archive
+    compression -- one of 'gz', 'bz2', or 'xz'
+    flatten -- if True, members are stored under their base names instead of their full paths
+    cache_directory -- local directory in which the archives are cached
+    """
+    key = archive_key(members, cache_directory)
+
+    return os.path.join(cache_directory, '{0}{1}.tar.{2}'.format(key, '-flat' if flatten else '', compression))
+
+
+def evict_archives(cache_directory, max_cache_size, keep=None, min_age=3600):
+    """Remove the least recently used archives until the cache fits in `max_cache_size` bytes.
+
+    Archives used within the last `min_age` seconds are never removed because another job may
+    be about to copy them. Leftover temporary files of the same age (e.g. from a job which was
+    killed while building an archive) are removed as well.
+
+    Arguments:
+    cache_directory -- local directory in which the archives are cached
+    max_cache_size -- number of bytes of archives to keep in the cache
+    keep -- local paths of archives which must not be removed
+    min_age -- number of seconds since an archive was last used before it can be removed
+    """
+    import time
+
+    keep = keep or list()
+    now = time.time()
+
+    with cache_lock(os.path.join(cache_directory, 'cache.lock')):
+        archives = list()
+        for name in os.listdir(cache_directory):
+            path = os.path.join(cache_directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
 
-    return tarfile_path
+            if name.endswith('.tmp') and now - st.st_mtime > min_age:
+                logging.debug('removing stale temporary file [{}]'.format(path))
+                os.remove(path)
+
+            elif '.tar.' in name:
+                archives.append((st.st_mtime, st.st_size, path))
+
+        total_size = sum(size for _, size, _ in archives)
+
+        for mtime, size, path in sorted(archives):
+            if total_size <= max_cache_size:
+                break
+
+            if path in keep or now - mtime < min_age:
+                continue
+
+            logging.info('evicting archive from cache [{}]'.format(path))
+
+            os.remove(path)
+            total_size -= size
 
 
 def path_to_archive_in_container(archive_file_path_on_host, extension='.tar'):
@@ -54,3 +207,324 @@ def copy_archive_to_container(container, archive_file_path_on_host, extension='.
 
     return dir_path
 
+
+def read_file_from_container(container, path):
+    """Return the contents of the file at `path` in the container as bytes.
+
+    Arguments:
+    container -- the docker container from which the file is being read
+    path -- absolute path inside the container of the file to read
+    """
+    import io
+    import tarfile
+
+    logging.debug('reading file [{0}] from container [{1}]'.format(path, container.name))
+
+    bits, _ = container.get_archive(path)
+
+    with tarfile.open(fileobj=io.BytesIO(b''.join(bits))) as tf:
+        member = tf.getmembers()[0]
+        f = tf.extractfile(member)
+        if not f:
+            raise RuntimeError('path is not a regular file [{0}] [{1}]'.format(path, container.name))
+
+        return f.read()
+
+
+def single_file_archive(name, contents, mode=0o600):
+    """Return the bytes of an uncompressed tar archive holding one file called `name`.
+
+    Arguments:
+    name -- name of the file in the archive
+    contents -- bytes to put in the file
+    mode -- permissions of the file
+    """
+    import io
+    import tarfile
+    import time
+
+    buf = io.BytesIO()
+
+    with tarfile.open(fileobj=buf, mode='w') as tf:
+        info = tarfile.TarInfo(name)
+        info.size = len(contents)
+        info.mode = mode
+        info.mtime = time.time()
+        tf.addfile(info, io.BytesIO(contents))
+
+    return buf.getvalue()
+
+
+def write_file_to_container(container, path, contents, mode=0o600):
+    """Write `contents` to the file at `path` in the container.
+
+    Arguments:
+    container -- the docker container in which the file is being written
+    path -- absolute path inside the container of the file to write
+    contents -- bytes to write to the file
+    mode -- permissions of the file
+    """
+    logging.debug('writing file [{0}] in container [{1}]'.format(path, container.name))
+
+    data = single_file_archive(os.path.basename(path), contents, mode)
+
+    if not container.put_archive(os.path.dirname(path), data):
+        raise RuntimeError('failed to write file [{0}] [{1}]'.format(path, container.name))
+
+
+class fan_out_writer(object):
+    """File-like object which hands everything written to it to several consumers in chunks.
+
+    Each consumer has its own bounded queue, so the writer blocks (rather than buffering the
+    whole archive in memory) until the slowest consumer has caught up. Consumers which fail are
+    dropped so that they cannot stall the others.
+    """
+    def __init__(self, consumer_count, chunk_size=1024 * 1024, queue_depth=8):
+        """Construct a fan_out_writer.
+
+        Arguments:
+        consumer_count -- number of consumers which will read what is written
+        chunk_size -- number of bytes collected before a chunk is handed to the consumers
+        queue_depth -- number of chunks each consumer can fall behind before the writer blocks
+        """
+        import queue
+        import threading
+
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.queues = [queue.Queue(maxsize=queue_depth) for _ in range(consumer_count)]
+        self.dropped = [threading.Event() for _ in range(consumer_count)]
+
+    def put(self, item):
+        """Hand `item` to every consumer which has not been dropped.
+
+        Arguments:
+        item -- bytes, None for the end of the stream, or an exception to raise in the consumers
+        """
+        import queue
+
+        for q, dropped in zip(self.queues, self.dropped):
+            while not dropped.is_set():
+                try:
+                    q.put(item, timeout=1)
+                    break
+                except queue.Full:
+                    pass
+
+    def write(self, data):
+        self.buffer.extend(data)
+
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer = bytearray()
+
+    def close(self, exception=None):
+        """Flush what is left and tell the consumers that the stream has ended.
+
+        Arguments:
+        exception -- if provided, the consumers raise this instead of ending normally
+        """
+        if exception is None:
+            self.flush()
+
+        self.put(exception)
+
+    def drop(self, index):
+        """Stop handing chunks to the consumer at `index`.
+
+        Arguments:
+        index -- index of the consumer which is no longer reading
+        """
+        self.dropped[index].set()
+
+    def chunks(self, index):
+        """Generate the chunks for the consumer at `index` until the end of the stream.
+
+        Arguments:
+        index -- index of the consumer which is reading
+        """
+        while True:
+            item = self.queues[index].get()
+
+            if item is None:
+                return
+
+            if isinstance(item, Exception):
+                raise item
+
+            yield item
+
+
+class tee_writer(object):
+    """File-like object which writes everything written to it to two other file-like objects."""
+    def __init__(self, first, second):
+        """Construct a tee_writer.
+
+        Arguments:
+        first -- file-like object to which everything is written first
+        second -- file-like object to which everything is written next
+        """
+        self.first = first
+        self.second = second
+
+    def write(self, data):
+        self.first.write(data)
+        self.second.write(data)
+
+        return len(data)
+
+
+def write_archive(fileobj, members, compression=None, flatten=False):
+    """Write a tar archive of the files in `members` to `fileobj` as a stream.
+
+    Arguments:
+    fileobj -- file-like object to which the archive is written
+    members -- local files to be placed in the archive
+    compression -- one of 'gz', 'bz2', or 'xz' (default: no compression)
+    flatten -- if True, members are stored under their base names instead of their full paths
+    """
+    import tarfile
+
+    with tarfile.open(fileobj=fileobj, mode='w|{}'.format(compression or '')) as f:
+        for m in members:
+            logging.debug('adding member [{0}] to streamed tarfile'.format(m))
+            f.add(m, arcname=os.path.basename(m) if flatten else None)
+
+
+def write_cached_archive(fileobj, members, compression, flatten=False, cache_directory=None, max_cache_size=None):
+    """Write a compressed tar archive of the files in `members` to `fileobj`, reusing it if it is cached.
+
+    Compressing the packages takes far longer than reading them, so compressed archives are kept
+    in a persistent cache keyed by the paths and contents of their members and repeated runs
+    against the same packages copy the archive built by the first run as it is. Otherwise, the
+    archive is written to `fileobj` and to the cache at the same time and moved into place once
+    it is complete, so nobody ever sees a partially written archive. The least recently used
+    archives are evicted once the cache grows past `max_cache_size` bytes.
+
+    Arguments:
+    fileobj -- file-like object to which the archive is written
+    members -- local files to be placed in the archive
+    compression -- one of 'gz', 'bz2', or 'xz'
+    flatten -- if True, members are stored under their base names instead of their full paths
+    cache_directory -- local directory in which archives are cached (default: archive_cache_directory())
+    max_cache_size -- number of bytes of archives to keep in the cache (default: archive_cache_size())
+    """
+    import shutil
+    import tempfile
+
+    if not cache_directory:
+        cache_directory = archive_cache_directory()
+
+    if max_cache_size is None:
+        max_cache_size = archive_cache_size()
+
+    archive_path = cached_archive_path(members, compression, flatten, cache_directory)
+
+    try:
+        with open(archive_path, 'rb') as f:
+            # The modification time is the "last used" time for eviction
+            os.utime(archive_path)
+
+            logging.info('using cached archive [{}]'.format(archive_path))
+            shutil.copyfileobj(f, fileobj, 1024 * 1024)
+
+        return
+
+    except FileNotFoundError:
+        pass
+
+    logging.debug('creating cached archive [{}]'.format(archive_path))
+
+    fd, tmp = tempfile.mkstemp(dir=cache_directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_archive(tee_writer(fileobj, f), members, compression=compression, flatten=flatten)
+
+        os.replace(tmp, archive_path)
+
+    except Exception:
+        os.remove(tmp)
+        raise
+
+    evict_archives(cache_directory, max_cache_size, keep=[archive_path])
+
+
+def put_archive_in_containers(containers, members, path='/', compression=None, flatten=False, chunk_size=1024 * 1024):
+    """Stream a tar archive of the files in `members` into every container at the same time.
+
+    The archive is built on the fly while it is being uploaded, so each member file is read once
+    no matter how many containers it goes to. A compressed archive is also kept in the archive
+    cache and reused by later runs with the same members (see write_cached_archive). Members are
+    extracted at `path` in each container under their absolute paths on the host (or just
+    their base names if `flatten` is True).
+
+    Arguments:
+    containers -- docker containers into which the archive is extracted
+    members -- local files to be placed in the archive
+    path -- path inside the containers at which the archive is extracted
+    compression -- one of 'gz', 'bz2', or 'xz' (default: no compression)
+    flatten -- if True, members are extracted directly into `path`
+    chunk_size -- number of bytes sent to the docker daemon at a time
+    """
+    import concurrent.futures
+
+    if not containers:
+        return
+
+    writer = fan_out_writer(len(containers), chunk_size=chunk_size)
+
+    # The uploads are fed from one stream, so they only finish together: the whole group takes
+    # one archive slot, and the uploads themselves must not wait for slots of their own
+    call_governor = governor.shared_governor()
+
+    def put_archive(index):
+        container = containers[index]
+        try:
+            with call_governor.exempt():
+                ok = container.put_archive(path, writer.chunks(index))
+
+            if not ok:
+                raise RuntimeError('failed to put archive in container [{}]'.format(container.name))
+        finally:
+            writer.drop(index)
+
+    logging.debug('streaming archive of [{0}] members into containers [{1}]'.format(
+        len(members), [c.name for c in containers]))
+
+    rc = 0
+
+    with call_governor.slot('archive'), concurrent.futures.ThreadPoolExecutor(max_workers=len(containers)) as executor:
+        futures_to_containers = {executor.submit(put_archive, i): c for i, c in enumerate(containers)}
+
+        try:
+            if compression:
+                write_cached_archive(writer, members, compression, flatten=flatten)
+            else:
+                write_archive(writer, members, flatten=flatten)
+
+            writer.close()
+
+        except Exception as e:
+            logging.error('exception raised while building archive')
+            logging.error(e)
+            writer.close(exception=e)
+            rc = 1
+
+        for f in concurrent.futures.as_completed(futures_to_containers):
+            container = futures_to_containers[f]
+            try:
+                f.result()
+
+            except Exception as e:
+                logging.error('exception raised while putting archive in container [{}]'.format(container.name))
+                logging.error(e)
+                rc = 1
+
+    if rc != 0:
+        raise RuntimeError('failed to put archive in containers [{}]'.format([c.name for c in containers]))
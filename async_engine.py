@@ -0,0 +1,1081 @@
+# grown-up modules
+import asyncio
+import contextlib
+import gzip
+import json
+import logging
+import os
+import random
+import shlex
+import time
+import urllib.parse
+
+# local modules
+import archive
+import context
+import database_setup
+import execute
+import governor
+import irods_setup
+import odbc_setup
+import readiness
+
+def socket_path():
+    """Return the local path to the docker daemon's unix socket.
+
+    A DOCKER_HOST of the form unix:///path/to/docker.sock overrides the default.
+    """
+    host = os.environ.get('DOCKER_HOST', '')
+    if host.startswith('unix://'):
+        return host[len('unix://'):]
+
+    return os.path.join('/var', 'run', 'docker.sock')
+
+
+def container_name(container):
+    """Return the name of `container`, which may be a name or an object with a name.
+
+    Arguments:
+    container -- name of a docker container, or a docker container
+    """
+    return container if isinstance(container, str) else container.name
+
+
+class docker_error(RuntimeError):
+    """The docker daemon answered a request with an error status."""
+    def __init__(self, status, method, path, message):
+        super(docker_error, self).__init__('docker API call failed [status=[{0}], call=[{1} {2}], message=[{3}]]'
+                                           .format(status, method, path, message))
+        self.status = status
+
+
+class response(object):
+    """The status, headers and body of a response from the docker daemon.
+
+    The body is read from the connection as it is consumed, so large archives and streamed
+    command output never have to be held in memory at once.
+    """
+    def __init__(self, method, path, reader, writer):
+        self.method = method
+        self.path = path
+        self.reader = reader
+        self.writer = writer
+        self.status = None
+        self.headers = dict()
+
+    async def read_head(self):
+        """Read the status line and headers."""
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise RuntimeError('docker daemon closed the connection [{0} {1}]'.format(self.method, self.path))
+
+        self.status = int(status_line.split()[1])
+
+        while True:
+            line = (await self.reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+
+            name, _, value = line.partition(':')
+            self.headers[name.strip().lower()] = value.strip()
+
+    async def chunks(self, chunk_size=64 * 1024):
+        """Yield the body in chunks of bytes as it arrives."""
+        if self.method == 'HEAD' or self.status in (204, 304):
+            return
+
+        if 'chunked' in self.headers.get('transfer-encoding', ''):
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # Skip any trailers up to the blank line which ends the body
+                    while (await self.reader.readline()).strip():
+                        pass
+
+                    return
+
+                yield await self.reader.readexactly(size)
+                await self.reader.readline()
+
+        elif 'content-length' in self.headers:
+            remaining = int(self.headers['content-length'])
+            while remaining > 0:
+                data = await self.reader.read(min(remaining, chunk_size))
+                if not data:
+                    raise RuntimeError('docker daemon closed the connection early [{0} {1}]'
+                                       .format(self.method, self.path))
+
+                remaining -= len(data)
+                yield data
+
+        else:
+            # Streams which the daemon hijacks (e.g. exec output) simply end when it closes them
+            while True:
+                data = await self.reader.read(chunk_size)
+                if not data:
+                    return
+
+                yield data
+
+    async def read(self):
+        """Return the whole body as bytes."""
+        return b''.join([chunk async for chunk in self.chunks()])
+
+    async def json(self):
+        """Return the body decoded from JSON."""
+        return json.loads((await self.read()).decode('utf-8'))
+
+    async def raise_for_status(self):
+        """Raise docker_error (after reading the daemon's message) if the status is an error."""
+        if self.status < 400:
+            return
+
+        body = await self.read()
+
+        try:
+            message = json.loads(body.decode('utf-8')).get('message', '')
+        except ValueError:
+            message = body.decode('utf-8', 'replace')
+
+        self.close()
+
+        raise docker_error(self.status, self.method, self.path, message)
+
+    def close(self):
+        """Close the connection on which the response arrived."""
+        self.writer.close()
+
+
+class docker_engine(object):
+    """Talks to the docker daemon over its unix socket from an asyncio event loop.
+
+    This is the asynchronous counterpart of docker.APIClient for the handful of calls which
+    setting up and inspecting zones needs. Each call opens its own connection, so any number of
+    coroutines can use the same engine at once without threads. Calls are limited per kind as
+    they are by governor.call_governor, and a slot is held until the response headers arrive,
+    so streamed output does not hold one for the life of the command.
+
+    An engine must be constructed inside the event loop which uses it.
+    """
+    def __init__(self, path=None, limits=None, api_version=None, max_connecting=64):
+        """Construct a docker_engine.
+
+        Arguments:
+        path -- local path to the docker daemon's unix socket (default: socket_path())
+        limits -- dict of call kinds to the number of calls in flight at once (default:
+                  governor.default_limits())
+        api_version -- docker Engine API version to request, e.g. 1.41 (default: the daemon's)
+        max_connecting -- number of requests of any kind which may be waiting for their response
+                          headers at once; connecting to a unix socket whose backlog is full
+                          fails rather than waits, so bursts of calls must be smoothed out
+        """
+        self.path = path or socket_path()
+        self.prefix = '/v{}'.format(api_version) if api_version else ''
+        self.connecting = asyncio.Semaphore(max_connecting)
+        self.semaphores = dict()
+        self.call_stats = dict()
+
+        for kind, limit in (limits or governor.default_limits()).items():
+            self.semaphores[kind] = asyncio.Semaphore(limit)
+            self.call_stats[kind] = governor.call_stats(limit)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, kind):
+        """Wait for a slot for a call of kind `kind` and hold it in the body of the `async with`.
+
+        Arguments:
+        kind -- exec, archive, lifecycle, or None for calls which are not limited
+        """
+        if kind not in self.semaphores:
+            yield 0.0
+            return
+
+        semaphore = self.semaphores[kind]
+        stats = self.call_stats[kind]
+
+        start_time = time.time()
+        queued = semaphore.locked()
+
+        async with semaphore:
+            waited = time.time() - start_time
+
+            stats.calls += 1
+            stats.queued += 1 if queued else 0
+            stats.wait += waited
+            stats.max_wait = max(stats.max_wait, waited)
+            stats.in_flight += 1
+            stats.peak = max(stats.peak, stats.in_flight)
+
+            try:
+                yield waited
+
+            finally:
+                stats.in_flight -= 1
+
+    def stats(self):
+        """Return a dict of call kinds to dicts describing how their calls fared (see governor.call_stats)."""
+        return {kind: s.as_dict() for kind, s in self.call_stats.items()}
+
+    async def request(self, method, path, query=None, body=None, content_type='application/json', kind=None):
+        """Send a request to the docker daemon and return the response once its headers arrive.
+
+        The caller reads the body from the response and closes it.
+
+        Arguments:
+        method -- HTTP method
+        path -- path of the API endpoint (without the version prefix)
+        query -- dict of query parameters
+        body -- bytes, an object to send as JSON, or an async iterable of bytes to send chunked
+        content_type -- content type of `body`
+        kind -- kind of call (see governor.call_kind) or None if it is not limited
+        """
+        target = self.prefix + path
+        if query:
+            target += '?' + urllib.parse.urlencode(query)
+
+        if body is not None and not isinstance(body, bytes) and not hasattr(body, '__aiter__'):
+            body = json.dumps(body).encode('utf-8')
+
+        headers = ['{0} {1} HTTP/1.1'.format(method, target), 'Host: docker', 'Connection: close']
+
+        if isinstance(body, bytes):
+            headers += ['Content-Type: {}'.format(content_type), 'Content-Length: {}'.format(len(body))]
+        elif body is not None:
+            headers += ['Content-Type: {}'.format(content_type), 'Transfer-Encoding: chunked']
+
+        async with self.slot(kind), self.connecting:
+            reader, writer = await asyncio.open_unix_connection(self.path, limit=1024 * 1024)
+
+            try:
+                writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1'))
+
+                if isinstance(body, bytes):
+                    writer.write(body)
+
+                elif body is not None:
+                    async for chunk in body:
+                        if chunk:
+                            writer.write('{:x}\r\n'.format(len(chunk)).encode('latin-1') + chunk + b'\r\n')
+                            await writer.drain()
+
+                    writer.write(b'0\r\n\r\n')
+
+                await writer.drain()
+
+                r = response(method, path, reader, writer)
+                await r.read_head()
+
+            except BaseException:
+                writer.close()
+                raise
+
+        await r.raise_for_status()
+
+        return r
+
+    async def call(self, method, path, query=None, body=None, kind=None):
+        """Make a request and return its body decoded from JSON (or None if it has no body).
+
+        Arguments:
+        method -- HTTP method
+        path -- path of the API endpoint (without the version prefix)
+        query -- dict of query parameters
+        body -- object to send as JSON
+        kind -- kind of call (see governor.call_kind) or None if it is not limited
+        """
+        r = await self.request(method, path, query=query, body=body, kind=kind)
+
+        try:
+            data = await r.read()
+
+        finally:
+            r.close()
+
+        return json.loads(data.decode('utf-8')) if data.strip() else None
+
+    async def inspect_container(self, container):
+        """Return the description of `container` as docker inspect shows it.
+
+        Arguments:
+        container -- name of a docker container, or a docker container
+        """
+        return await self.call('GET', '/containers/{}/json'.format(container_name(container)))
+
+    async def containers(self, project_name):
+        """Return the names of the containers in the docker-compose project called `project_name`.
+
+        Arguments:
+        project_name -- name of the docker-compose project
+        """
+        filters = json.dumps({'label': ['com.docker.compose.project={}'.format(context.sanitize(project_name))]})
+
+        described = await self.call('GET', '/containers/json', query={'filters': filters})
+
+        return sorted(d['Names'][0].lstrip('/') for d in described)
+
+    async def exec_create(self, container, command, user='', workdir=None):
+        """Create an exec instance running `command` in `container` and return its ID.
+
+        Arguments:
+        container -- name of a docker container, or a docker container
+        command -- the command to execute, as a string or a list of arguments
+        user -- user as which the command is executed (default: the container's user)
+        workdir -- working directory in which the command is executed
+        """
+        body = {
+            'AttachStdin': False,
+            'AttachStdout': True,
+            'AttachStderr': True,
+            'Tty': False,
+            'Cmd': shlex.split(command) if isinstance(command, str) else list(command),
+            'User': user
+        }
+
+        if workdir:
+            body['WorkingDir'] = workdir
+
+        described = await self.call('POST', '/containers/{}/exec'.format(container_name(container)),
+                                    body=body, kind='exec')
+
+        return described['Id']
+
+    async def exec_start(self, exec_id):
+        """Start the exec instance `exec_id` and yield (stream name, bytes) pairs of its output.
+
+        The daemon sends stdout and stderr over one connection in frames, each with an 8-byte
+        header holding the stream (1 for stdout, 2 for stderr) and the length of the frame.
+
+        Arguments:
+        exec_id -- ID returned by exec_create
+        """
+        r = await self.request('POST', '/exec/{}/start'.format(exec_id),
+                               body={'Detach': False, 'Tty': False}, kind='exec')
+
+        stream_names = {1: 'stdout', 2: 'stderr'}
+
+        try:
+            buf = b''
+
+            async for chunk in r.chunks():
+                buf += chunk
+
+                while len(buf) >= 8:
+                    size = int.from_bytes(buf[4:8], 'big')
+                    if len(buf) < 8 + size:
+                        break
+
+                    stream_name = stream_names.get(buf[0])
+                    if stream_name:
+                        yield stream_name, buf[8:8 + size]
+
+                    buf = buf[8 + size:]
+
+        finally:
+            r.close()
+
+    async def exec_inspect(self, exec_id):
+        """Return the description of the exec instance `exec_id`, including its ExitCode.
+
+        Arguments:
+        exec_id -- ID returned by exec_create
+        """
+        return await self.call('GET', '/exec/{}/json'.format(exec_id), kind='exec')
+
+    async def put_archive(self, container, path, data):
+        """Extract the tar archive `data` into `path` in `container`.
+
+        Arguments:
+        container -- name of a docker container, or a docker container
+        path -- directory inside the container into which the archive is extracted
+        data -- bytes of the archive, or an async iterable of them
+        """
+        r = await self.request('PUT', '/containers/{}/archive'.format(container_name(container)),
+                               query={'path': path}, body=data, content_type='application/x-tar', kind='archive')
+        r.close()
+
+    async def get_archive(self, container, path):
+        """Return the response whose body is a tar archive of `path` in `container`.
+
+        The caller reads the body with its chunks method and closes it.
+
+        Arguments:
+        container -- name of a docker container, or a docker container
+        path -- path inside the container to copy
+        """
+        return await self.request('GET', '/containers/{}/archive'.format(container_name(container)),
+                                  query={'path': path}, kind='archive')
+
+
+async def run_command(engine, container, command, user='', workdir=None, stream_output=False, capture=False, output=None):
+    """Execute `command` on `container` and return an execute.command_result.
+
+    Output is logged and saved just as execute.run_command does. With `capture`, the stdout of
+    the command is also kept in the `stdout` attribute of the result as bytes.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    container -- name of a docker container, or a docker container
+    command -- the command to execute, as a string or a list of arguments
+    user -- user as which the command is executed (default: the container's user)
+    workdir -- working directory in which the command is executed
+    stream_output -- if True, log the output at INFO as it is produced
+    capture -- if True, keep the stdout of the command in the result
+    output -- execute.output_configuration saying where the output is saved (default: the one
+              set by execute.configure_output)
+    """
+    name = container_name(container)
+
+    logging.debug('executing on [{0}] [{1}]'.format(name, command))
+
+    result = execute.command_result(name, command)
+    result.stdout = b''
+
+    recorder = execute.output_recorder(result, stream_output=stream_output, configuration=output)
+
+    start_time = time.time()
+
+    try:
+        exec_id = await engine.exec_create(name, command, user=user, workdir=workdir)
+
+        async for stream_name, data in engine.exec_start(exec_id):
+            recorder.feed(stream_name, data)
+
+            if capture and stream_name == 'stdout':
+                result.stdout += data
+
+        recorder.flush()
+
+        result.ec = (await engine.exec_inspect(exec_id))['ExitCode']
+
+    finally:
+        result.duration = time.time() - start_time
+
+        recorder.close()
+
+    logging.debug('command finished [ec=[{0}], duration=[{1:.1f}s], stdout=[{2}], stderr=[{3}]] [{4}]'
+                  .format(result.ec, result.duration, result.stdout_bytes, result.stderr_bytes, name))
+
+    return result
+
+
+async def execute_command(engine, container, command, user='', workdir=None, stream_output=False, output=None):
+    """Execute `command` on `container` and return its exit code (see run_command).
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    container -- name of a docker container, or a docker container
+    command -- the command to execute, as a string or a list of arguments
+    user -- user as which the command is executed (default: the container's user)
+    workdir -- working directory in which the command is executed
+    stream_output -- if True, log the output at INFO as it is produced
+    output -- execute.output_configuration saying where the output is saved (default: the one
+              set by execute.configure_output)
+    """
+    return (await run_command(engine, container, command, user=user, workdir=workdir,
+                              stream_output=stream_output, output=output)).ec
+
+
+async def read_local_file(path, chunk_size=1024 * 1024):
+    """Yield the contents of the local file at `path` in chunks, reading it off the event loop.
+
+    Arguments:
+    path -- local path to the file
+    chunk_size -- number of bytes in each chunk
+    """
+    loop = asyncio.get_running_loop()
+
+    f = await loop.run_in_executor(None, open, path, 'rb')
+
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, f.read, chunk_size)
+            if not chunk:
+                return
+
+            yield chunk
+
+    finally:
+        f.close()
+
+
+async def copy_archive_to_container(engine, container, archive_file_path_on_host, extension='.tar'):
+    """Copy local archive file into the specified container in extracted form.
+
+    Returns the absolute path inside the container where the archive file was extracted.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    container -- name of a docker container, or a docker container
+    archive_file_path_on_host -- local path to the archive being copied
+    extension -- file extension of the archive
+    """
+    dir_path = archive.path_to_archive_in_container(archive_file_path_on_host, extension)
+
+    logging.debug('putting archive [{0}] in container [{1}] at [{2}]'.format(
+        archive_file_path_on_host, container_name(container), dir_path))
+
+    await engine.put_archive(container, '/', read_local_file(archive_file_path_on_host))
+
+    return dir_path
+
+
+async def write_file_to_container(engine, container, path, contents, mode=0o600):
+    """Write `contents` to the file at `path` in the container.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    container -- name of a docker container, or a docker container
+    path -- absolute path inside the container of the file to write
+    contents -- bytes to write to the file
+    mode -- permissions of the file
+    """
+    logging.debug('writing file [{0}] in container [{1}]'.format(path, container_name(container)))
+
+    await engine.put_archive(container, os.path.dirname(path),
+                             archive.single_file_archive(os.path.basename(path), contents, mode))
+
+
+async def collect_log_archive(engine, container, output_path, logfile_path):
+    """Stream the directory holding the log files out of the container into a gzipped tar file.
+
+    Compression happens off the event loop so that many containers can be copied from at once.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    container -- name of a docker container, or a docker container
+    output_path -- local path to the gzipped tar file
+    logfile_path -- path inside the container to the directory holding the log files
+    """
+    loop = asyncio.get_running_loop()
+
+    r = await engine.get_archive(container, logfile_path)
+
+    try:
+        with gzip.open(output_path, 'wb', compresslevel=6) as f:
+            async for chunk in r.chunks():
+                await loop.run_in_executor(None, f.write, chunk)
+
+    finally:
+        r.close()
+
+
+async def collect_logs(engine, containers, output_directory, logfile_path=None, max_concurrent=None):
+    """Copy the iRODS server logs out of every iRODS container at the same time.
+
+    The log directory of each container is streamed into `<container>.tar.gz` under
+    `output_directory`/logs, as logs.collect_logs does by default. Returns the number of
+    containers whose logs could not be collected; failures are logged rather than raised so
+    that one container cannot hide the logs of the others.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    containers -- names of the containers (or containers) from which logs are collected
+                  (database containers are skipped)
+    output_directory -- local directory under which the logs are saved
+    logfile_path -- path inside the containers to the directory holding the log files
+    max_concurrent -- maximum number of containers to copy from at the same time (default: all)
+    """
+    od = os.path.join(output_directory, 'logs')
+    if not os.path.exists(od):
+        os.makedirs(od, exist_ok=True)
+
+    if not logfile_path:
+        logfile_path = os.path.join(context.irods_home(), 'log')
+
+    names = [container_name(c) for c in containers]
+    names = [n for n in names if context.service_name(n) != context.irods_catalog_database_service()]
+    if not names:
+        return 0
+
+    semaphore = asyncio.Semaphore(max_concurrent or len(names))
+
+    async def collect(name):
+        async with semaphore:
+            log_archive_path = os.path.join(od, name + '.tar.gz')
+
+            logging.info('saving log [{}]'.format(log_archive_path))
+
+            try:
+                await collect_log_archive(engine, name, log_archive_path, logfile_path)
+                return 0
+
+            except Exception as e:
+                logging.error('failed to collect log [{}]'.format(name))
+                logging.error(e)
+                return 1
+
+    return sum(await asyncio.gather(*[collect(n) for n in names]))
+
+
+async def container_hostname(engine, container):
+    """Return the hostname of `container`.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    container -- name of a docker container, or a docker container
+    """
+    return (await engine.inspect_container(container))['Config']['Hostname']
+
+
+async def wait_until(probe, description, deadline, initial_interval=0.1, max_interval=5.0):
+    """Await `probe()` until it returns True, backing off between attempts, or raise at the deadline.
+
+    This is readiness.wait_until for coroutines: waiting does not hold a thread.
+
+    Arguments:
+    probe -- coroutine function taking no arguments which returns True when the thing is ready
+    description -- what is being waited for, for messages (e.g. database [project_db_1])
+    deadline -- seconds after which to give up
+    initial_interval -- seconds to wait after the first failed attempt
+    max_interval -- most seconds to wait between attempts
+    """
+    start_time = time.time()
+    interval = initial_interval
+    attempts = 0
+
+    while True:
+        attempts += 1
+
+        try:
+            if await probe():
+                elapsed = time.time() - start_time
+                logging.info('ready after [{0:.1f}s] [{1}]'.format(elapsed, description))
+                return elapsed
+
+        except Exception as e:
+            logging.debug('readiness probe raised [{0}] [{1}]'.format(e, description))
+
+        remaining = start_time + deadline - time.time()
+        if remaining <= 0:
+            raise RuntimeError('timed out waiting for {0} [attempts=[{1}], deadline=[{2}s]]'
+                               .format(description, attempts, deadline))
+
+        logging.debug('waiting for {0} [attempt=[{1}]]'.format(description, attempts))
+
+        await asyncio.sleep(min(remaining, interval * random.uniform(0.8, 1.2)))
+        interval = min(interval * 2, max_interval)
+
+
+async def port_is_open(engine, container, host, port):
+    """Return True if a TCP connection to `host`:`port` can be made from inside `container`.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    container -- name of a docker container, or a docker container
+    host -- hostname or address to connect to
+    port -- TCP port to connect to
+    """
+    return await execute_command(engine, container, readiness.port_probe_command(host, port)) == 0
+
+
+async def wait_for_port(engine, container, host, port, phase):
+    """Wait until `host`:`port` accepts connections from inside `container`.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    container -- name of a docker container, or a docker container
+    host -- hostname or address to connect to
+    port -- TCP port to connect to
+    phase -- readiness phase whose deadline applies: database, provider or consumer
+    """
+    return await wait_until(lambda: port_is_open(engine, container, host, port),
+                            'port [{0}:{1}] from [{2}]'.format(host, port, container_name(container)),
+                            readiness.deadlines[phase])
+
+
+async def wait_for_irods_server(engine, container, server_config, phase='provider'):
+    """Wait until the iRODS server in `container` is serving its zone port and control plane.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    container -- name of a docker container, or a docker container
+    server_config -- server configuration with which the server was set up (see
+                     setup_irods_server)
+    phase -- readiness phase whose deadline applies: provider or consumer
+    """
+    await wait_for_port(engine, container, 'localhost', server_config['zone_port'], phase)
+
+    port = server_config.get('server_control_plane_port')
+    if port:
+        await wait_for_port(engine, container, 'localhost', port, phase)
+
+
+async def setup_catalog(engine,
+                        project_name,
+                        database_image,
+                        database_port=None,
+                        service_instance=1,
+                        database_name='ICAT',
+                        database_user='irods',
+                        database_password='testpassword',
+                        root_password=None):
+    """Set up the iRODS catalog on the specified database service (see database_setup.setup_catalog).
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    project_name -- name of the docker-compose project
+    database_image -- repo:tag for the docker image of the database server
+    database_port -- the port on which the database service is listening
+    service_instance -- service instance number for the database service being targeted
+    database_name -- name of the iRODS database (for testing, this should be 'ICAT')
+    database_user -- name of the iRODS database user (for testing, this should be 'irods')
+    database_password -- password for the iRODS database user (for testing this should be
+                         'testpassword')
+    root_password -- password for the root database user
+    """
+    db_container = context.irods_catalog_database_container(project_name, service_instance)
+
+    logging.warning('setting up catalog [{}]'.format(db_container))
+
+    strat = database_setup.make_strategy(database_image, None, database_port, root_password)
+
+    async def is_ready():
+        cmd, user = strat.ready_command()
+        return await execute_command(engine, db_container, cmd, user=user) == 0
+
+    # The container is up long before the server in it accepts connections
+    await wait_until(is_ready, 'database [{}]'.format(db_container), readiness.deadlines['database'])
+
+    steps = [
+        (strat.create_database_sql(database_name), 'failed to create database [{}]'.format(database_name)),
+        (strat.create_user_sql(database_user, database_password), 'failed to create user [{}]'.format(database_user)),
+        (strat.grant_privileges_sql(database_name, database_user),
+         'failed to grant privileges to user [{0}] on database [{1}]'.format(database_user, database_name))
+    ]
+
+    for sql, message in steps:
+        cmd, user = strat.sql_command(sql)
+        if await execute_command(engine, db_container, cmd, user=user) != 0:
+            raise RuntimeError(message)
+
+
+async def server_config_template(engine, container):
+    """Return the server_config.json template shipped with the iRODS server in `container`, or None.
+
+    See irods_setup.server_config_template.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    container -- name of a docker container, or a docker container
+    """
+    result = await run_command(engine, container, ['cat', irods_setup.server_config_template_path()], capture=True)
+
+    return irods_setup.parse_server_config_template(result.ec, result.stdout, container_name(container))
+
+
+async def configured_zone_port(engine, container):
+    """Return the port on which the iRODS server in `container` was set up to listen.
+
+    See irods_setup.configured_zone_port.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    container -- name of a docker container, or a docker container
+    """
+    result = await run_command(engine, container, ['cat', irods_setup.server_config_path()], capture=True)
+
+    return irods_setup.parse_zone_port(result.ec, result.stdout, container_name(container))
+
+
+async def setup_irods_server(engine, container, setup_input):
+    """Set up iRODS server on the given container with the provided setup input.
+
+    See irods_setup.setup_irods_server. Returns the server configuration with which the server
+    was set up; for servers set up by answering prompts, only the ports are known.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    container -- name of a docker container, or a docker container
+    setup_input -- irods_setup.setup_input_builder holding the values with which the server is
+                   set up
+    """
+    name = container_name(container)
+
+    template = await server_config_template(engine, name)
+    if template is None:
+        await setup_irods_server_from_prompts(engine, name, setup_input.build())
+        return {'zone_port': setup_input.zone_port, 'server_control_plane_port': setup_input.control_plane_port}
+
+    configuration = setup_input.build_unattended_configuration(template)
+
+    logging.debug('unattended configuration [{}]'.format(configuration))
+
+    path = irods_setup.unattended_configuration_path()
+
+    await write_file_to_container(engine, name, path,
+                                  json.dumps(configuration, indent=4, sort_keys=True).encode('utf-8'))
+
+    path_to_setup_script = os.path.join(context.irods_home(), 'scripts', 'setup_irods.py')
+    ec = await execute_command(engine, name, ['python', path_to_setup_script, '--json_configuration_file={}'.format(path)])
+    if ec != 0:
+        raise RuntimeError('failed to set up iRODS server [ec=[{0}], container=[{1}]]'.format(ec, name))
+
+    server_config = configuration['server_config']
+
+    if await port_is_open(engine, name, 'localhost', server_config['zone_port']):
+        return server_config
+
+    irodsctl = os.path.join(context.irods_home(), 'irodsctl')
+    ec = await execute_command(engine, name, '{} start'.format(irodsctl), user='irods')
+    if ec != 0:
+        raise RuntimeError('failed to start iRODS server after setup [ec=[{0}], container=[{1}]]'
+                           .format(ec, name))
+
+    return server_config
+
+
+async def setup_irods_server_from_prompts(engine, container, setup_input):
+    """Set up iRODS server on the given container by answering the prompts of the setup script.
+
+    See irods_setup.setup_irods_server_from_prompts.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    container -- name of a docker container, or a docker container
+    setup_input -- string which will be provided as input to the iRODS setup script
+    """
+    name = container_name(container)
+
+    logging.debug('input to setup script [{}]'.format(setup_input))
+
+    await write_file_to_container(engine, name, '/input', (setup_input + '\n').encode('utf-8'))
+
+    path_to_setup_script = os.path.join(context.irods_home(), 'scripts', 'setup_irods.py')
+    ec = await execute_command(engine, name, ['bash', '-c', 'python {0} < /input'.format(path_to_setup_script)])
+    if ec != 0:
+        raise RuntimeError('failed to set up iRODS server [ec=[{0}], container=[{1}]]'.format(ec, name))
+
+    irodsctl = os.path.join(context.irods_home(), 'irodsctl')
+    ec = await execute_command(engine, name, '{} restart'.format(irodsctl), user='irods')
+    if ec != 0:
+        raise RuntimeError('failed to start iRODS server after setup [ec=[{0}], container=[{1}]]'
+                           .format(ec, name))
+
+
+async def configure_odbc_driver(engine, platform_image, database_image, csp_container, odbc_driver=None):
+    """Make the ODBC driver for the database available in the catalog service provider container.
+
+    Only drivers supplied as archives (mysql) need anything done; the driver is fetched as
+    odbc_setup.fetch_odbc_driver does, extracted into the container, and registered in
+    /etc/odbcinst.ini.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    platform_image -- repo:tag for the docker image of the platform running the iRODS servers
+    database_image -- repo:tag for the docker image of the database server
+    csp_container -- name of the container on which the iRODS catalog service provider runs
+    odbc_driver -- if specified, the ODBC driver will be sought here
+    """
+    loop = asyncio.get_running_loop()
+
+    path = await loop.run_in_executor(None, odbc_setup.fetch_odbc_driver, platform_image, database_image, odbc_driver)
+    if not path:
+        logging.debug('no ODBC driver setup required [{0}] [{1}]'.format(database_image, container_name(csp_container)))
+        return
+
+    if not os.path.exists(path):
+        raise RuntimeError('indicated ODBC driver does not exist [{}]'.format(path))
+
+    container_odbc_driver_dir = await copy_archive_to_container(engine, csp_container, path, extension='.tar.gz')
+
+    contents = odbc_setup.mysql_odbcinst_ini_contents(container_odbc_driver_dir) + '\n'
+    await write_file_to_container(engine, csp_container, odbc_setup.odbcinst_ini_path(), contents.encode('utf-8'), mode=0o644)
+
+
+async def registered_odbc_driver(engine, csp_container, database_image):
+    """Return the name of the first ODBC driver registered for the database in `csp_container`.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    csp_container -- name of the container on which the iRODS catalog service provider runs
+    database_image -- repo:tag for the docker image of the database server
+    """
+    result = await run_command(engine, csp_container, ['odbcinst', '-q', '-d'], capture=True)
+    if result.ec != 0:
+        raise RuntimeError('failed to list ODBC drivers [ec=[{0}], container=[{1}]]'
+                           .format(result.ec, container_name(csp_container)))
+
+    name = odbc_setup.odbc_driver_for_database(result.stdout.decode('utf-8'), database_image)
+    if not name:
+        raise RuntimeError('no ODBC driver registered for database [{0}] [{1}]'
+                           .format(database_image, container_name(csp_container)))
+
+    return name
+
+
+async def setup_irods_catalog_provider(engine,
+                                       project_name,
+                                       platform_image,
+                                       database_image,
+                                       database_service_instance=1,
+                                       provider_service_instance=1,
+                                       odbc_driver=None):
+    """Set up iRODS catalog service provider in a docker-compose project.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    project_name -- name of the docker-compose project
+    platform_image -- repo:tag for the docker image of the platform running the iRODS servers
+    database_image -- repo:tag for the docker image of the database server
+    database_service_instance -- the service instance number of the container running the
+                                 database server
+    provider_service_instance -- the service instance number of the container being targeted
+                                 to run the iRODS catalog service provider
+    odbc_driver -- path to the local archive file containing the ODBC driver
+    """
+    csp_container = context.irods_catalog_provider_container(project_name, provider_service_instance)
+    db_container = context.irods_catalog_database_container(project_name, database_service_instance)
+
+    await configure_odbc_driver(engine, platform_image, database_image, csp_container, odbc_driver)
+
+    setup_input = (irods_setup.setup_input_builder()
+        .service_account(catalog_service_role='provider')
+        .database_connection(
+            database_type=context.image_repo(database_image),
+            odbc_driver=await registered_odbc_driver(engine, csp_container, database_image),
+            database_server_hostname=await container_hostname(engine, db_container),
+            database_server_port=database_setup.database_server_port(database_image)
+        )
+        .server_options(server_hostname=await container_hostname(engine, csp_container))
+    )
+
+    logging.warning('setting up iRODS catalog provider [{}]'.format(csp_container))
+
+    server_config = await setup_irods_server(engine, csp_container, setup_input)
+
+    await wait_for_irods_server(engine, csp_container, server_config, phase='provider')
+
+
+async def setup_irods_catalog_consumer(engine, project_name, provider_service_instance=1, consumer_service_instance=1):
+    """Set up iRODS catalog service consumer in a docker-compose project.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    project_name -- name of the docker-compose project
+    provider_service_instance -- the service instance number of the container running the iRODS
+                                 catalog service provider
+    consumer_service_instance -- the service instance number of the container being targeted
+                                 to run the iRODS catalog service consumer
+    """
+    csp_container = context.irods_catalog_provider_container(project_name, provider_service_instance)
+    csc_container = context.irods_catalog_consumer_container(project_name, consumer_service_instance)
+
+    csp_hostname = await container_hostname(engine, csp_container)
+
+    # The consumer joins the zone on the port the provider was set up with
+    zone_port = await configured_zone_port(engine, csp_container)
+
+    setup_input = (irods_setup.setup_input_builder()
+        .service_account(catalog_service_role='consumer')
+        .server_options(catalog_service_provider_host=csp_hostname,
+                        zone_port=zone_port,
+                        server_hostname=await container_hostname(engine, csc_container))
+    )
+
+    # Setting up a consumer fails unless it can reach the provider
+    await wait_for_port(engine, csc_container, csp_hostname, zone_port, 'consumer')
+
+    logging.warning('setting up iRODS catalog consumer [{}]'.format(csc_container))
+
+    server_config = await setup_irods_server(engine, csc_container, setup_input)
+
+    await wait_for_irods_server(engine, csc_container, server_config, phase='consumer')
+
+
+async def setup_irods_catalog_consumers(engine,
+                                        project_name,
+                                        provider_service_instance=1,
+                                        consumer_service_instances=None,
+                                        max_concurrent=None):
+    """Set up all iRODS catalog service consumers in a docker-compose project at the same time.
+
+    Returns 0 if every consumer was set up, or 1 if any failed; failures are logged.
+
+    Arguments:
+    engine -- docker_engine through which the daemon is reached
+    project_name -- name of the docker-compose project
+    provider_service_instance -- the service instance for the iRODS catalog service provider
+    consumer_service_instances -- the service instance numbers of the consumers to set up (if
+                                  None, every consumer container in the project is set up)
+    max_concurrent -- maximum number of consumers to set up at the same time (default: all)
+    """
+    if not consumer_service_instances:
+        consumer_service_instances = [context.service_instance(n) for n in await engine.containers(project_name)
+                                      if context.service_name(n) == context.irods_catalog_consumer_service()]
+
+    if not consumer_service_instances:
+        return 0
+
+    semaphore = asyncio.Semaphore(max_concurrent or len(consumer_service_instances))
+
+    async def setup(instance):
+        async with semaphore:
+            try:
+                await setup_irods_catalog_consumer(engine, project_name, provider_service_instance, instance)
+                return 0
+
+            except Exception as e:
+                logging.error('failed to set up iRODS catalog consumer [{}]'
+                              .format(context.irods_catalog_consumer_container(project_name, instance)))
+                logging.error(e)
+                return 1
+
+    return max(await asyncio.gather(*[setup(i) for i in consumer_service_instances]))
+
+
+async def setup_zone(project_name,
+                     platform_image,
+                     database_image,
+                     catalog_service_instance=1,
+                     provider_service_instance=1,
+                     consumer_service_instances=None,
+                     odbc_driver=None,
+                     setup_catalog_database=True,
+                     setup_provider=True,
+                     setup_consumers=True,
+                     max_concurrent_consumers=None,
+                     engine=None):
+    """Set up the catalog, catalog service provider, and catalog service consumers of a zone.
+
+    The steps run in the same order as setup.py runs them, with the consumers set up at the
+    same time. Raises RuntimeError if any consumer failed.
+
+    Arguments:
+    project_name -- name of the docker-compose project
+    platform_image -- repo:tag for the docker image of the platform running the iRODS servers
+    database_image -- repo:tag for the docker image of the database server
+    catalog_service_instance -- service instance number of the database server
+    provider_service_instance -- service instance number of the iRODS catalog service provider
+    consumer_service_instances -- service instance numbers of the consumers (default: all)
+    odbc_driver -- path to the local archive file containing the ODBC driver
+    setup_catalog_database -- if False, skip setting up the catalog in the database
+    setup_provider -- if False, skip setting up the catalog service provider
+    setup_consumers -- if False, skip setting up the catalog service consumers
+    max_concurrent_consumers -- maximum number of consumers to set up at the same time
+    engine -- docker_engine through which the daemon is reached (default: a new one)
+    """
+    engine = engine or docker_engine()
+
+    if setup_catalog_database:
+        await setup_catalog(engine, project_name, database_image, service_instance=catalog_service_instance)
+
+    if setup_provider:
+        await setup_irods_catalog_provider(engine, project_name, platform_image, database_image,
+                                           catalog_service_instance, provider_service_instance, odbc_driver)
+
+    if setup_consumers:
+        rc = await setup_irods_catalog_consumers(engine, project_name, provider_service_instance,
+                                                 consumer_service_instances, max_concurrent_consumers)
+        if rc != 0:
+            raise RuntimeError('failed to set up iRODS catalog consumers [{}]'.format(project_name))
+
+
+def run(coroutine):
+    """Run `coroutine` to completion in a new event loop and return its result.
+
+    This is how the synchronous scripts call into this module.
+
+    Arguments:
+    coroutine -- coroutine to run, e.g. setup_zone(...)
+    """
+    return asyncio.run(coroutine)
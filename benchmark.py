@@ -0,0 +1,280 @@
+# grown-up modules
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+# local modules
+import client_cache
+import context
+import fake_docker
+import governor
+import install
+import run_tests_in_zone
+import tracing
+
+def make_packages(directory, platform, database, package_size):
+    """Write a placeholder file of `package_size` bytes for each iRODS package and return `directory`.
+
+    Arguments:
+    directory -- local directory in which the packages are written
+    platform -- repo:tag for the docker image of the platform running the iRODS servers
+    database -- repo:tag for the docker image of the database server
+    package_size -- number of bytes in each package
+    """
+    extension = install.package_filename_extension(context.image_repo(platform))
+
+    for name in install.irods_package_names(context.image_repo(database)):
+        with open(os.path.join(directory, '{0}_4.3.0.{1}'.format(name, extension)), 'wb') as f:
+            f.write(os.urandom(package_size))
+
+    return directory
+
+
+def bring_up_once(consumer_count,
+                  platform,
+                  database,
+                  package_directory=None,
+                  latencies=None,
+                  responses=None,
+                  max_concurrent_calls=None,
+                  cache_containers=True,
+                  concurrency=None):
+    """Bring up and tear down a zone on a fake docker client and return how it went.
+
+    Returns a dict with the number of seconds the bring-up and teardown took, the number of
+    calls made to the simulated docker daemon, and the total number of seconds calls spent
+    waiting for the governor (see governor.py) during the bring-up and teardown.
+
+    Arguments:
+    consumer_count -- number of iRODS catalog service consumers in the zone
+    platform -- repo:tag for the docker image of the platform running the iRODS servers
+    database -- repo:tag for the docker image of the database server
+    package_directory -- if provided, local directory of packages to install (else official packages)
+    latencies -- dict overriding entries of fake_docker.default_latencies()
+    responses -- list of fake_docker.canned_responses (default: fake_docker.default_responses())
+    max_concurrent_calls -- number of calls the simulated daemon serves at the same time
+    cache_containers -- if True, containers and their inspect data are cached (see client_cache)
+    concurrency -- dict of phase names to the number of containers worked on at the same time
+                   (see run_tests_in_zone.concurrency_limits)
+    """
+    fake_client = fake_docker.fake_client(latencies=latencies,
+                                          responses=responses,
+                                          max_concurrent_calls=max_concurrent_calls)
+
+    docker_client = client_cache.caching_client(fake_client) if cache_containers else fake_client
+
+    compose_project = fake_docker.fake_compose_project(fake_client,
+                                                       'benchmark-{0}-{1}'.format(platform, database)
+                                                       .replace(':', '-'),
+                                                       platform=platform,
+                                                       database=database)
+
+    docker_calls = governor.shared_governor()
+    docker_calls.reset_stats()
+
+    start_time = time.time()
+
+    run_tests_in_zone.bring_up_zone(docker_client,
+                                    compose_project,
+                                    platform,
+                                    database,
+                                    package_directory=package_directory,
+                                    consumer_count=consumer_count,
+                                    concurrency=concurrency)
+
+    up_time = time.time()
+
+    with tracing.span('down'):
+        compose_project.down(include_volumes=True, remove_image_type=False)
+
+    return {
+        'bring_up': up_time - start_time,
+        'down': time.time() - up_time,
+        'calls': fake_client.call_count(),
+        'execs': fake_client.calls.get('exec_start', 0),
+        'queue_wait': sum(s['wait'] for s in docker_calls.stats().values()) if cache_containers else 0.0
+    }
+
+
+def run_benchmarks(consumer_counts,
+                   repeat,
+                   platform,
+                   database,
+                   package_directory=None,
+                   latencies=None,
+                   responses=None,
+                   max_concurrent_calls=None,
+                   cache_containers=True,
+                   concurrency=None,
+                   trace_directory=None):
+    """Time the bring-up of a zone `repeat` times for each consumer count and return the results.
+
+    Returns a list with one dict per consumer count holding the minimum, median and maximum
+    bring-up times along with the number of calls made to the simulated docker daemon.
+
+    Arguments:
+    consumer_counts -- list of numbers of iRODS catalog service consumers to benchmark
+    repeat -- number of times to bring up each zone
+    platform -- repo:tag for the docker image of the platform running the iRODS servers
+    database -- repo:tag for the docker image of the database server
+    package_directory -- if provided, local directory of packages to install (else official packages)
+    latencies -- dict overriding entries of fake_docker.default_latencies()
+    responses -- list of fake_docker.canned_responses (default: fake_docker.default_responses())
+    max_concurrent_calls -- number of calls the simulated daemon serves at the same time
+    cache_containers -- if True, containers and their inspect data are cached (see client_cache)
+    concurrency -- dict of phase names to the number of containers worked on at the same time
+                   (see run_tests_in_zone.concurrency_limits)
+    trace_directory -- if provided, the trace of the last run for each consumer count is saved here
+    """
+    results = list()
+
+    for consumer_count in consumer_counts:
+        runs = list()
+
+        for i in range(repeat):
+            tracing.reset()
+
+            runs.append(bring_up_once(consumer_count,
+                                      platform,
+                                      database,
+                                      package_directory=package_directory,
+                                      latencies=latencies,
+                                      responses=responses,
+                                      max_concurrent_calls=max_concurrent_calls,
+                                      cache_containers=cache_containers,
+                                      concurrency=concurrency))
+
+            logging.info('brought up zone [consumers=[{0}], run=[{1}], duration=[{2:.3f}s]]'
+                         .format(consumer_count, i + 1, runs[-1]['bring_up']))
+
+        if trace_directory:
+            directory = os.path.join(trace_directory, 'consumers-{}'.format(consumer_count))
+            os.makedirs(directory, exist_ok=True)
+            tracing.write_reports(directory)
+
+        durations = [r['bring_up'] for r in runs]
+
+        results.append({
+            'consumers': consumer_count,
+            'runs': runs,
+            'min': min(durations),
+            'median': statistics.median(durations),
+            'max': max(durations),
+            'down': statistics.median(r['down'] for r in runs),
+            'calls': runs[-1]['calls'],
+            'execs': runs[-1]['execs'],
+            'queue_wait': statistics.median(r['queue_wait'] for r in runs)
+        })
+
+    return results
+
+
+def format_results(results):
+    """Return the benchmark results as a text table.
+
+    Arguments:
+    results -- list of dicts returned by run_benchmarks
+    """
+    lines = ['{0:>9}  {1:>9}  {2:>9}  {3:>9}  {4:>9}  {5:>7}  {6:>7}  {7:>10}'
+             .format('consumers', 'min', 'median', 'max', 'down', 'calls', 'execs', 'queue wait')]
+
+    for r in results:
+        lines.append('{0:>9}  {1:>8.3f}s  {2:>8.3f}s  {3:>8.3f}s  {4:>8.3f}s  {5:>7}  {6:>7}  {7:>9.3f}s'
+                     .format(r['consumers'], r['min'], r['median'], r['max'], r['down'], r['calls'], r['execs'],
+                             r['queue_wait']))
+
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == "__main__":
+    import argparse
+    import logs
+
+    parser = argparse.ArgumentParser(description='Time the orchestration of bringing up a zone against a simulated docker daemon.')
+    parser.add_argument('--consumer-counts', '-n', metavar='COUNT', dest='consumer_counts', type=int, nargs='+', default=[1, 3, 8],
+                        help='Numbers of iRODS catalog service consumers with which to bring up the zone. (Default: %(default)s)')
+    parser.add_argument('--repeat', '-r', metavar='TIMES', dest='repeat', type=int, default=3,
+                        help='Number of times to bring up the zone for each consumer count. (Default: %(default)s)')
+    parser.add_argument('--os-platform-image', '-p', metavar='OS_PLATFORM_IMAGE_REPO_AND_TAG', dest='platform', type=str, default='ubuntu:18.04',
+                        help='The repo:tag of the OS platform image to simulate. (Default: %(default)s)')
+    parser.add_argument('--database-image', '-d', metavar='DATABASE_IMAGE_REPO_AND_TAG', dest='database', type=str, default='postgres:10.12',
+                        help='The repo:tag of the database image to simulate. (Default: %(default)s)')
+    parser.add_argument('--package-size', metavar='BYTES', dest='package_size', type=int, default=0,
+                        help='If non-zero, install local placeholder packages of this size instead of official packages.')
+    parser.add_argument('--api-latency', metavar='SECONDS', dest='api_latency', type=float, default=0.002,
+                        help='Round trip time of every call to the simulated docker daemon. (Default: %(default)s)')
+    parser.add_argument('--exec-latency', metavar='SECONDS', dest='exec_latency', type=float, default=0.01,
+                        help='Run time of commands without a canned response. (Default: %(default)s)')
+    parser.add_argument('--up-latency', metavar='SECONDS', dest='up_latency', type=float, default=0.05,
+                        help='Time to create and start each container. (Default: %(default)s)')
+    parser.add_argument('--install-duration', metavar='SECONDS', dest='install_duration', type=float, default=1.0,
+                        help='Run time of each package manager command. (Default: %(default)s)')
+    parser.add_argument('--setup-duration', metavar='SECONDS', dest='setup_duration', type=float, default=0.5,
+                        help='Run time of each iRODS or catalog setup command. (Default: %(default)s)')
+    parser.add_argument('--archive-bandwidth', metavar='BYTES_PER_SECOND', dest='archive_bandwidth', type=float,
+                        help='Rate at which archives are copied in and out of containers. (Default: no limit)')
+    parser.add_argument('--max-concurrent-calls', metavar='CALLS', dest='max_concurrent_calls', type=int,
+                        help='Number of calls the simulated docker daemon serves at the same time. (Default: no limit)')
+    parser.add_argument('--no-client-cache', dest='cache_containers', action='store_false',
+                        help='If indicated, look up containers and their inspect data on every use instead of caching them.')
+    parser.add_argument('--max-concurrency', metavar='PHASE=COUNT', dest='concurrency', type=run_tests_in_zone.parse_concurrency_limit, action='append', default=[],
+                        help='Number of containers worked on at the same time in the install, setup or configure phase. May be repeated. (Default: sized for the consumer count)')
+    parser.add_argument('--docker-call-limit', metavar='KIND=COUNT', dest='docker_call_limits', action='append', default=[],
+                        help='Number of exec, archive or lifecycle calls in flight at the same time (see governor.py). May be repeated.')
+    parser.add_argument('--trace-directory', metavar='PATH', dest='trace_directory', type=str,
+                        help='If provided, save trace.json and trace_summary.txt for each consumer count here.')
+    parser.add_argument('--output-file', metavar='PATH', dest='output_file', type=str,
+                        help='If provided, save the results as JSON to this file.')
+    parser.add_argument('--verbose', '-v', dest='verbosity', action='count', default=1,
+                        help='Increase the level of output to stdout. CRITICAL and ERROR messages will always be printed.')
+
+    args = parser.parse_args()
+
+    logs.configure(args.verbosity)
+
+    if args.trace_directory:
+        tracing.enable()
+
+    try:
+        governor.shared_governor().configure({k: int(v) for k, _, v in (l.partition('=') for l in args.docker_call_limits)})
+
+    except (KeyError, ValueError) as e:
+        print('invalid --docker-call-limit [{}]'.format(e))
+        exit(1)
+
+    latencies = {
+        'api': args.api_latency,
+        'exec': args.exec_latency,
+        'up': args.up_latency,
+        'archive_bandwidth': args.archive_bandwidth
+    }
+
+    try:
+        with tempfile.TemporaryDirectory() as package_directory:
+            if args.package_size:
+                make_packages(package_directory, args.platform, args.database, args.package_size)
+
+            results = run_benchmarks(args.consumer_counts,
+                                     args.repeat,
+                                     args.platform,
+                                     args.database,
+                                     package_directory=package_directory if args.package_size else None,
+                                     latencies=latencies,
+                                     responses=fake_docker.default_responses(args.install_duration, args.setup_duration),
+                                     max_concurrent_calls=args.max_concurrent_calls,
+                                     cache_containers=args.cache_containers,
+                                     concurrency=dict(args.concurrency),
+                                     trace_directory=args.trace_directory)
+
+        print(format_results(results), end='')
+
+        if args.output_file:
+            with open(args.output_file, 'w') as f:
+                json.dump(results, f, indent=4)
+
+    except Exception as e:
+        logging.critical(e)
+        exit(1)
@@ -0,0 +1,145 @@
+# grown-up modules
+import json
+import logging
+import os
+import statistics
+import time
+
+# local modules
+import archive
+
+def history_path():
+    """Return the local path to the history of how long zones took to bring up.
+
+    The IRODS_TEST_BRING_UP_TIMES environment variable overrides the default.
+    """
+    return os.environ.get('IRODS_TEST_BRING_UP_TIMES',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'irods_test', 'bring_up_times.json'))
+
+
+def history_key(platform, database):
+    """Return the key under which the bring-up times for a platform and database are kept.
+
+    Arguments:
+    platform -- repo:tag for the docker image of the platform running the iRODS servers
+    database -- repo:tag for the docker image of the database server
+    """
+    return '/'.join([platform, database])
+
+
+def load_history(path=None):
+    """Return the history as a dict of history keys to dicts of consumer counts to lists of runs.
+
+    Arguments:
+    path -- local path to the history (default: history_path())
+    """
+    try:
+        with open(path or history_path(), 'r') as f:
+            return json.load(f)
+
+    except (OSError, ValueError):
+        return dict()
+
+
+def record_bring_up(platform, database, consumer_count, seconds, path=None, max_runs=20):
+    """Add how long a zone took to bring up to the history.
+
+    Only the latest `max_runs` runs are kept for each platform, database and consumer count.
+    Jobs running at the same time take turns updating the history.
+
+    Arguments:
+    platform -- repo:tag for the docker image of the platform running the iRODS servers
+    database -- repo:tag for the docker image of the database server
+    consumer_count -- number of iRODS catalog service consumers in the zone
+    seconds -- number of seconds bringing up the zone took
+    path -- local path to the history (default: history_path())
+    max_runs -- number of runs to keep for each consumer count
+    """
+    if not path:
+        path = history_path()
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    with archive.cache_lock(path + '.lock'):
+        history = load_history(path)
+
+        runs = history.setdefault(history_key(platform, database), dict()).setdefault(str(consumer_count), list())
+        runs.append({'seconds': seconds, 'time': int(time.time())})
+        del runs[:-max_runs]
+
+        partial = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(partial, 'w') as f:
+            json.dump(history, f, indent=1, sort_keys=True)
+
+        os.replace(partial, path)
+
+    logging.info('brought up zone with [{0}] consumers in [{1:.1f}s] [{2}]'
+                 .format(consumer_count, seconds, history_key(platform, database)))
+
+
+def report(history):
+    """Return a list of dicts summarizing the bring-up times for each key and consumer count.
+
+    Each dict holds the key, the consumer count, the number of runs, the minimum, median and
+    maximum times, and the median time per iRODS server (provider and consumers).
+
+    Arguments:
+    history -- dict returned by load_history
+    """
+    rows = list()
+
+    for key in sorted(history):
+        for consumer_count in sorted(history[key], key=int):
+            seconds = [r['seconds'] for r in history[key][consumer_count]]
+            if not seconds:
+                continue
+
+            rows.append({
+                'key': key,
+                'consumers': int(consumer_count),
+                'runs': len(seconds),
+                'min': min(seconds),
+                'median': statistics.median(seconds),
+                'max': max(seconds),
+                'per_server': statistics.median(seconds) / (int(consumer_count) + 1)
+            })
+
+    return rows
+
+
+def format_report(rows):
+    """Return the rows of a bring-up time report as a text table.
+
+    Arguments:
+    rows -- list of dicts returned by report
+    """
+    lines = ['{0:<40}  {1:>9}  {2:>5}  {3:>9}  {4:>9}  {5:>9}  {6:>10}'
+             .format('platform/database', 'consumers', 'runs', 'min', 'median', 'max', 'per server')]
+
+    for r in rows:
+        lines.append('{0:<40}  {1:>9}  {2:>5}  {3:>8.1f}s  {4:>8.1f}s  {5:>8.1f}s  {6:>9.1f}s'
+                     .format(r['key'], r['consumers'], r['runs'], r['min'], r['median'], r['max'], r['per_server']))
+
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == "__main__":
+    import argparse
+    import logs
+
+    parser = argparse.ArgumentParser(description='Report how long zones took to bring up against their numbers of consumers.')
+    parser.add_argument('--history', metavar='PATH', dest='history_path', type=str,
+                        help='Path to the history of bring-up times. (Default: {})'.format(history_path()))
+    parser.add_argument('--verbose', '-v', dest='verbosity', action='count', default=1,
+                        help='Increase the level of output to stdout. CRITICAL and ERROR messages will always be printed.')
+
+    args = parser.parse_args()
+
+    logs.configure(args.verbosity)
+
+    rows = report(load_history(args.history_path))
+    if not rows:
+        print('no bring-up times recorded [{}]'.format(args.history_path or history_path()))
+        exit(0)
+
+    print(format_report(rows), end='')
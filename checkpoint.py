@@ -0,0 +1,59 @@
+# grown-up modules
+import logging
+import os
+
+# local modules
+import execute
+
+def checkpoint_directory():
+    """Return the directory inside each container in which its completed setup phases are recorded.
+
+    The record lives in the container itself, so it goes away with the container: a zone which
+    is recreated is set up from scratch.
+    """
+    return os.path.join('/var', 'lib', 'irods_test', 'checkpoints')
+
+
+def completed_phases(container):
+    """Return the set of setup phases recorded as completed in `container`.
+
+    Arguments:
+    container -- docker container in the zone
+    """
+    result = container.exec_run(['bash', '-c', 'ls -1 "$1" 2>/dev/null; true', 'bash', checkpoint_directory()])
+    if result.exit_code != 0:
+        raise RuntimeError('failed to read checkpoints [ec=[{0}], container=[{1}]]'
+                           .format(result.exit_code, container.name))
+
+    return set(result.output.decode('utf-8').split())
+
+
+def mark_phase_completed(container, phase):
+    """Record in `container` that the setup phase `phase` completed.
+
+    Arguments:
+    container -- docker container in the zone
+    phase -- name of the setup phase (e.g. install)
+    """
+    ec = execute.execute_command(container, ['bash', '-c', 'mkdir -p "$1" && touch "$1/$2"',
+                                             'bash', checkpoint_directory(), phase])
+    if ec != 0:
+        raise RuntimeError('failed to record checkpoint [ec=[{0}], phase=[{1}], container=[{2}]]'
+                           .format(ec, phase, container.name))
+
+    logging.debug('recorded checkpoint [{0}] [{1}]'.format(phase, container.name))
+
+
+def zone_checkpoints(containers):
+    """Return a dict of container names to the sets of setup phases completed in each of them.
+
+    Arguments:
+    containers -- docker containers in the zone
+    """
+    import concurrent.futures
+
+    if not containers:
+        return dict()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(containers)) as executor:
+        return dict(zip([c.name for c in containers], executor.map(completed_phases, containers)))
@@ -0,0 +1,293 @@
+# grown-up modules
+import docker
+import logging
+import os
+import threading
+
+# local modules
+import governor
+
+def max_pool_size():
+    """Return the number of connections to the docker daemon kept open by the shared client.
+
+    Bringing up a large zone runs a command in every container at the same time, and the
+    docker client's default pool of 10 connections makes every thread past the tenth open and
+    throw away its own connection. The IRODS_TEST_DOCKER_POOL_SIZE environment variable
+    overrides the default.
+    """
+    return int(os.environ.get('IRODS_TEST_DOCKER_POOL_SIZE', 64))
+
+
+def lifecycle_actions():
+    """Return the docker event actions after which cached containers and inspect data are stale."""
+    return {'create', 'start', 'restart', 'die', 'kill', 'stop', 'destroy', 'rename',
+            'pause', 'unpause', 'update', 'connect', 'disconnect'}
+
+
+def governed_attribute(call_governor, obj, name):
+    """Return the attribute `name` of `obj`, wrapped by `call_governor` if it makes a limited docker call.
+
+    Arguments:
+    call_governor -- governor.call_governor which limits the calls
+    obj -- object (e.g. docker.APIClient) which makes docker calls
+    name -- name of the attribute
+    """
+    attribute = getattr(obj, name)
+
+    kind = governor.call_kind(name)
+    if kind is None or not callable(attribute):
+        return attribute
+
+    return call_governor.governed(kind, attribute)
+
+
+class cached_container_collection(object):
+    """Answers docker_client.containers.get from the cache of a caching_client."""
+    def __init__(self, cache, containers):
+        self.cache = cache
+        self.containers = containers
+
+    def get(self, container_id):
+        return self.cache.container(container_id)
+
+    def __getattr__(self, name):
+        return governed_attribute(self.cache.governor, self.containers, name)
+
+
+class cached_api(object):
+    """Answers docker_client.api.inspect_container from the cache of a caching_client.
+
+    Every other call which is limited by the caching_client's governor waits for a slot, and
+    lifecycle calls (start, stop, ...) forget what is cached about their container once they
+    return, without waiting for docker to report the event.
+    """
+    def __init__(self, cache, api):
+        self.cache = cache
+        self.api = api
+
+    def inspect_container(self, container):
+        return self.cache.inspect(container)
+
+    def __getattr__(self, name):
+        attribute = governed_attribute(self.cache.governor, self.api, name)
+
+        if governor.call_kind(name) != 'lifecycle' or not callable(attribute):
+            return attribute
+
+        def invalidating(*args, **kwargs):
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                container = args[0] if args else kwargs.get('container')
+                if isinstance(container, str):
+                    self.cache.invalidate(container)
+
+        return invalidating
+
+
+class caching_client(object):
+    """Wraps a docker client so that containers and their inspect data are only fetched once.
+
+    Every phase of bringing up a zone looks up the same containers by name and asks for their
+    hostnames, which costs a round trip to the docker daemon each time. Containers returned by
+    containers.get are remembered (and use this client, so inspect_container on them is cached
+    too) until docker reports a lifecycle event for them (see watch), a lifecycle call is made
+    through this client, or invalidate is called. reload() on those containers always fetches
+    fresh attrs.
+    Anything else is passed through to the wrapped client, and exec, archive and lifecycle
+    calls made through it (and through the containers it returns) wait for a slot from the
+    process-wide governor (see governor.py).
+    """
+    def __init__(self, docker_client, call_governor=None):
+        """Construct a caching_client.
+
+        Arguments:
+        docker_client -- the docker client which talks to the docker daemon
+        call_governor -- governor.call_governor limiting the calls (default: the shared governor)
+        """
+        self.client = docker_client
+        self.governor = call_governor or governor.shared_governor()
+        self.lock = threading.Lock()
+        self.container_cache = dict()
+        self.inspect_cache = dict()
+        self.fetch_locks = dict()
+        self.event_stream = None
+        self.enabled = True
+
+        self.containers = cached_container_collection(self, docker_client.containers)
+        self.api = cached_api(self, docker_client.api)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def cached(self, cache, key, fetch):
+        """Return `cache[key]`, calling `fetch` to fill it in if it is missing.
+
+        Threads asking for the same key at the same time wait for one of them to fetch it.
+
+        Arguments:
+        cache -- dict holding the cached values
+        key -- key of the value in `cache`
+        fetch -- callable taking no arguments which returns the value
+        """
+        with self.lock:
+            if key in cache:
+                return cache[key]
+
+            key_lock = self.fetch_locks.setdefault((id(cache), key), threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                if key in cache:
+                    return cache[key]
+
+            try:
+                value = fetch()
+
+                with self.lock:
+                    cache[key] = value
+
+            finally:
+                # Threads which arrive from now on find the value (or fetch it again)
+                with self.lock:
+                    self.fetch_locks.pop((id(cache), key), None)
+
+            return value
+
+    def container(self, container_id):
+        """Return the container with the name or id `container_id`, fetching it only once.
+
+        Arguments:
+        container_id -- name or id of the container
+        """
+        if not self.enabled:
+            return self.client.containers.get(container_id)
+
+        def fetch():
+            container = self.client.containers.get(container_id)
+            container.client = self
+            container.reload = self.fresh_reload(container)
+            return container
+
+        return self.cached(self.container_cache, container_id, fetch)
+
+    def fresh_reload(self, container):
+        """Return a reload for `container` which forgets what is cached about it before reloading.
+
+        Callers reload a container precisely to see its current state, so the reload must not
+        be answered from the cache.
+
+        Arguments:
+        container -- container returned by the wrapped client, whose reload is replaced
+        """
+        reload = container.reload
+
+        def fresh():
+            self.invalidate(container.id)
+            return reload()
+
+        return fresh
+
+    def inspect(self, container_id):
+        """Return the inspect data of the container with the name or id `container_id`, fetching it only once.
+
+        Arguments:
+        container_id -- name or id of the container
+        """
+        if not self.enabled:
+            return self.client.api.inspect_container(container_id)
+
+        return self.cached(self.inspect_cache, container_id, lambda: self.client.api.inspect_container(container_id))
+
+    def invalidate(self, container_id=None):
+        """Forget what is cached about the container with the name or id `container_id`.
+
+        Arguments:
+        container_id -- name or id of the container (if None, everything is forgotten)
+        """
+        with self.lock:
+            if container_id is None:
+                self.container_cache.clear()
+                self.inspect_cache.clear()
+                return
+
+            for key, c in list(self.container_cache.items()):
+                if container_id in (key, c.id, c.name):
+                    del self.container_cache[key]
+
+            for key, data in list(self.inspect_cache.items()):
+                if container_id in (key, data.get('Id'), data.get('Name', '').lstrip('/')):
+                    del self.inspect_cache[key]
+
+    def watch(self):
+        """Start forgetting cached containers as soon as docker reports a lifecycle event for them."""
+        if self.event_stream:
+            return
+
+        self.event_stream = self.client.events(decode=True, filters={'type': ['container', 'network']})
+
+        threading.Thread(target=self.follow_events, name='docker-events', daemon=True).start()
+
+    def follow_events(self):
+        try:
+            for event in self.event_stream:
+                if event.get('Action') not in lifecycle_actions():
+                    continue
+
+                actor = event.get('Actor', dict())
+                attributes = actor.get('Attributes', dict())
+
+                # Network events name the container in their attributes
+                if event.get('Type') == 'network':
+                    self.invalidate(attributes.get('container'))
+                else:
+                    self.invalidate(actor.get('ID'))
+                    self.invalidate(attributes.get('name'))
+
+        except Exception as e:
+            if self.event_stream:
+                logging.warning(e)
+
+        # Without events, nothing tells us when a cached container goes stale
+        if self.event_stream:
+            logging.warning('stopped following docker events; no longer caching containers')
+
+            self.event_stream = None
+            self.enabled = False
+            self.invalidate()
+
+    def close(self):
+        """Stop following docker events."""
+        event_stream, self.event_stream = self.event_stream, None
+        if event_stream:
+            event_stream.close()
+
+
+def invalidate(docker_client, container_id=None):
+    """Forget what `docker_client` has cached about a container, if it is a caching_client.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker-compose project
+    container_id -- name or id of the container (if None, everything is forgotten)
+    """
+    if isinstance(docker_client, caching_client):
+        docker_client.invalidate(container_id)
+
+
+# The client shared by every thread in this process (see shared_client)
+shared = {'client': None}
+shared_lock = threading.Lock()
+
+
+def shared_client():
+    """Return the docker client shared by everything in this process, creating it on first use.
+
+    The client has a connection pool sized for the number of threads which talk to the docker
+    daemon at the same time and caches containers and their inspect data (see caching_client).
+    """
+    with shared_lock:
+        if not shared['client']:
+            shared['client'] = caching_client(docker.from_env(max_pool_size=max_pool_size()))
+            shared['client'].watch()
+
+        return shared['client']
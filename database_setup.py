@@ -1,10 +1,13 @@
 # grown-up modules
 import docker
 import logging
+import os
 
 # local modules
 import context
 import execute
+import readiness
+import tracing
 
 def database_server_port(database_image):
     """Return the default port for the database server indicated by `database_image`.
@@ -27,6 +30,60 @@ class database_setup_strategy(object):
 
     This class should not be instantiated directly.
     """
+    def ready_command(self):
+        """Return the (command, user) pair which succeeds once the database server accepts connections.
+
+        This method must be overridden.
+        """
+        raise NotImplementedError('method not implemented for database strategy')
+
+    def sql_command(self, sql):
+        """Return the (command, user) pair which runs `sql` as the database root user.
+
+        This method must be overridden.
+
+        Arguments:
+        sql -- SQL statement to run
+        """
+        raise NotImplementedError('method not implemented for database strategy')
+
+    def create_database_sql(self, name):
+        """Return the SQL statement which creates a database called `name`.
+
+        This method must be overridden.
+
+        Arguments:
+        name -- name of the database to create
+        """
+        raise NotImplementedError('method not implemented for database strategy')
+
+    def create_user_sql(self, username, password):
+        """Return the SQL statement which creates a user for the database.
+
+        This method must be overridden.
+
+        Arguments:
+        username -- name of the user to create
+        password -- password for the new user
+        """
+        raise NotImplementedError('method not implemented for database strategy')
+
+    def grant_privileges_sql(self, database, username):
+        """Return the SQL statement which grants all privileges on database to user called `username`.
+
+        This method must be overridden.
+
+        Arguments:
+        database -- name of the database on which privileges are being granted
+        username -- name of the user for whom privileges are being granted
+        """
+        raise NotImplementedError('method not implemented for database strategy')
+
+    def is_ready(self):
+        """Return True if the database server accepts connections on its port."""
+        cmd, user = self.ready_command()
+        return execute.execute_command(self.container, cmd, user=user) == 0
+
     def create_database(self, name):
         """Create a database.
 
@@ -86,6 +143,48 @@ class database_setup_strategy(object):
         """
         raise NotImplementedError('method not implemented for database strategy')
 
+    def dump_catalog(self, database, username, password, path):
+        """Write a SQL script to `path` which recreates `database` and the user which owns it.
+
+        The script is written inside the database container and is suitable for placing in
+        /docker-entrypoint-initdb.d so that a fresh database server loads it on first start.
+
+        This method must be overridden.
+
+        Arguments:
+        database -- name of the database to dump
+        username -- name of the database user to recreate
+        password -- password for the database user
+        path -- path inside the database container for the SQL script
+        """
+        raise NotImplementedError('method not implemented for database strategy')
+
+    def save_baseline(self, database, baseline):
+        """Save the current contents of `database` as a baseline called `baseline`.
+
+        No other sessions may be connected to `database` while the baseline is saved.
+
+        This method must be overridden.
+
+        Arguments:
+        database -- name of the database to save
+        baseline -- name of the baseline
+        """
+        raise NotImplementedError('method not implemented for database strategy')
+
+    def restore_baseline(self, database, baseline):
+        """Replace the contents of `database` with the baseline called `baseline`.
+
+        No other sessions may be connected to `database` while the baseline is restored.
+
+        This method must be overridden.
+
+        Arguments:
+        database -- name of the database to restore
+        baseline -- name of the baseline saved with save_baseline
+        """
+        raise NotImplementedError('method not implemented for database strategy')
+
 
 class postgres_database_setup_strategy(database_setup_strategy):
     """Database setup strategy for postgres"""
@@ -101,14 +200,56 @@ class postgres_database_setup_strategy(database_setup_strategy):
         self.root_password = root_password if root_password else 'testpassword'
         self.port = port if port else 5432
 
+    def ready_command(self):
+        """Return the (command, user) pair which succeeds once the postgres server accepts connections.
+
+        The official image runs a temporary server which only listens on a unix socket while it
+        initializes the data directory, so the check is made over TCP.
+        """
+        return 'pg_isready --quiet --host localhost --port {}'.format(self.port), 'postgres'
+
+    def sql_command(self, sql):
+        """Return the (command, user) pair which runs `sql` with psql as the postgres user.
+
+        Arguments:
+        sql -- command to be passed to psql via --command
+        """
+        return 'psql --port {0} --command \"{1}\"'.format(self.port, sql), 'postgres'
+
     def execute_psql_command(self, psql_cmd):
         """Execute a psql command as the postgres user.
 
         Arguments:
         psql_cmd -- command to be passed to psql via --command
         """
-        cmd = 'psql --port {0} --command \"{1}\"'.format(self.port, psql_cmd)
-        return execute.execute_command(self.container, cmd, user='postgres')
+        cmd, user = self.sql_command(psql_cmd)
+        return execute.execute_command(self.container, cmd, user=user)
+
+    def create_database_sql(self, name):
+        """Return the SQL statement which creates a database called `name`.
+
+        Arguments:
+        name -- name of the database to create
+        """
+        return 'create database \\\"{}\\\";'.format(name)
+
+    def create_user_sql(self, username, password):
+        """Return the SQL statement which creates a user for the database.
+
+        Arguments:
+        username -- name of the user to create
+        password -- password for the new user
+        """
+        return 'create user {0} with password \'{1}\';'.format(username, password)
+
+    def grant_privileges_sql(self, database, username):
+        """Return the SQL statement which grants all privileges on database to user called `username`.
+
+        Arguments:
+        database -- name of the database on which privileges are being granted
+        username -- name of the user for whom privileges are being granted
+        """
+        return 'grant all privileges on database \\\"{0}\\\" to {1};'.format(database, username)
 
     def create_database(self, name):
         """Create a database.
@@ -116,7 +257,7 @@ class postgres_database_setup_strategy(database_setup_strategy):
         Arguments:
         name -- name of the database to create
         """
-        return self.execute_psql_command('create database \\\"{}\\\";'.format(name))
+        return self.execute_psql_command(self.create_database_sql(name))
 
     def create_user(self, username, password):
         """Create a user for the database.
@@ -125,8 +266,7 @@ class postgres_database_setup_strategy(database_setup_strategy):
         username -- name of the user to create
         password -- password for the new user
         """
-        return self.execute_psql_command('create user {0} with password \'{1}\';'
-            .format(username, password))
+        return self.execute_psql_command(self.create_user_sql(username, password))
 
     def grant_privileges(self, database, username):
         """Grant all privileges on database to user called `username`.
@@ -135,8 +275,7 @@ class postgres_database_setup_strategy(database_setup_strategy):
         database -- name of the database on which privileges are being granted
         username -- name of the user for whom privileges are being granted
         """
-        return self.execute_psql_command('grant all privileges on database \\\"{0}\\\" to {1};'
-            .format(database, username))
+        return self.execute_psql_command(self.grant_privileges_sql(database, username))
 
     def drop_database(self, name):
         """Drop a database called `name`.
@@ -158,6 +297,60 @@ class postgres_database_setup_strategy(database_setup_strategy):
         """List databases."""
         return self.execute_psql_command('\l')
 
+    def dump_catalog(self, database, username, password, path):
+        """Write a SQL script to `path` which recreates `database` and the user which owns it.
+
+        Arguments:
+        database -- name of the database to dump
+        username -- name of the database user to recreate
+        password -- password for the database user
+        path -- path inside the database container for the SQL script
+        """
+        create_user = 'create user {0} with password \'{1}\';'.format(username, password)
+        grant = 'grant all privileges on database "{0}" to {1};'.format(database, username)
+
+        # pg_dump runs as postgres, which cannot write to root-owned directories like
+        # /docker-entrypoint-initdb.d, so the script is written to /tmp and moved as root
+        partial = os.path.join('/tmp', os.path.basename(path))
+
+        # The SQL statements and paths are passed as positional parameters to avoid quoting them
+        script = ('set -o pipefail; '
+                  '{ printf "%s\\n" "$1"; pg_dump --port "$3" --create "$4"; printf "%s\\n" "$2"; } > "$5"')
+        cmd = ['bash', '-c', script, 'bash', create_user, grant, str(self.port), database, partial]
+        ec = execute.execute_command(self.container, cmd, user='postgres')
+        if ec != 0:
+            return ec
+
+        return execute.execute_command(self.container, ['mv', partial, path], user='root')
+
+    def save_baseline(self, database, baseline):
+        """Save the current contents of `database` as a template database called `baseline`.
+
+        Arguments:
+        database -- name of the database to save
+        baseline -- name of the template database
+        """
+        ec = self.execute_psql_command('drop database if exists \\\"{}\\\";'.format(baseline))
+        if ec != 0:
+            return ec
+
+        return self.execute_psql_command('create database \\\"{0}\\\" template \\\"{1}\\\";'
+            .format(baseline, database))
+
+    def restore_baseline(self, database, baseline):
+        """Recreate `database` from the template database called `baseline`.
+
+        Arguments:
+        database -- name of the database to restore
+        baseline -- name of the template database saved with save_baseline
+        """
+        ec = self.drop_database(database)
+        if ec != 0:
+            return ec
+
+        return self.execute_psql_command('create database \\\"{0}\\\" template \\\"{1}\\\";'
+            .format(database, baseline))
+
 
 class mysql_database_setup_strategy(database_setup_strategy):
     """Database setup strategy for mysql"""
@@ -173,23 +366,68 @@ class mysql_database_setup_strategy(database_setup_strategy):
         self.root_password = root_password if root_password else 'testpassword'
         self.port = port if port else 3306
 
-    def execute_mysql_command(self, mysql_cmd, user='root', password='testpassword'):
-        """Execute a mysql command as the postgres user.
+    def ready_command(self):
+        """Return the (command, user) pair which succeeds once the mysql server accepts connections.
+
+        The official image runs a temporary server with networking disabled while it initializes
+        the data directory, so the check is made over TCP (mysql treats 'localhost' as the socket).
+        """
+        return ['mysqladmin', 'ping', '--silent', '--host', '127.0.0.1', '--port', str(self.port),
+                '--user', 'root', '--password={}'.format(self.root_password)], ''
+
+    def sql_command(self, sql):
+        """Return the (command, user) pair which runs `sql` with mysql as the database root user.
+
+        Arguments:
+        sql -- the command to be passed to mysql via --execute
+        """
+        return ('mysql --port {0} --user root --password={1} --execute \"{2}\"'
+            .format(self.port, self.root_password, sql)), ''
+
+    def execute_mysql_command(self, mysql_cmd):
+        """Execute a mysql command as the database root user.
 
         Arguments:
         mysql_cmd -- the command to be passed to mysql via --execute
         """
-        cmd = ('mysql --port {0} --user {1} --password={2} --execute \"{3}\"'
-            .format(self.port, user, password, mysql_cmd))
+        cmd, _ = self.sql_command(mysql_cmd)
         return execute.execute_command(self.container, cmd)
 
+    def create_database_sql(self, name):
+        """Return the SQL statement which creates a database called `name`.
+
+        Arguments:
+        name -- name of the database to create
+        """
+        return 'CREATE DATABASE {};'.format(name)
+
+    def create_user_sql(self, username, password):
+        """Return the SQL statement which creates a user for the database.
+
+        Arguments:
+        username -- name of the user to create
+        password -- password for the new user
+        """
+        return 'CREATE USER \'{0}\'@\'{1}\' IDENTIFIED BY \'{2}\';'.format(username, 'localhost', password)
+
+    def grant_privileges_sql(self, database, username):
+        """Return the SQL statement which grants all privileges on database to user called `username`.
+
+        Arguments:
+        database -- name of the database on which privileges are being granted
+        username -- name of the user for whom privileges are being granted
+        """
+        # TODO: 'irods'@'%' is generated by the docker entrypoint for mysql container...
+        # should be 'irods'@'localhost', but that doesn't work right now
+        return 'GRANT ALL ON {0}.* to \'{1}\'@\'{2}\';'.format(database, username, '%')
+
     def create_database(self, name):
         """Create a database.
 
         Arguments:
         name -- name of the database to create
         """
-        return self.execute_mysql_command('CREATE DATABASE {};'.format(name))
+        return self.execute_mysql_command(self.create_database_sql(name))
 
     def create_user(self, username, password):
         """Create a user for the database.
@@ -198,8 +436,7 @@ class mysql_database_setup_strategy(database_setup_strategy):
         username -- name of the user to create
         password -- password for the new user
         """
-        return self.execute_mysql_command('CREATE USER \'{0}\'@\'{1}\' IDENTIFIED BY \'{2}\';'
-            .format(username, 'localhost', password))
+        return self.execute_mysql_command(self.create_user_sql(username, password))
 
     def grant_privileges(self, database, username):
         """Grant all privileges on database to user called `username`.
@@ -208,10 +445,7 @@ class mysql_database_setup_strategy(database_setup_strategy):
         database -- name of the database on which privileges are being granted
         username -- name of the user for whom privileges are being granted
         """
-        # TODO: 'irods'@'%' is generated by the docker entrypoint for mysql container...
-        # should be 'irods'@'localhost', but that doesn't work right now
-        return self.execute_mysql_command('GRANT ALL ON {0}.* to \'{1}\'@\'{2}\';'
-            .format(database, username, '%'))
+        return self.execute_mysql_command(self.grant_privileges_sql(database, username))
 
     def drop_database(self, name):
         """Drop a database called `name`.
@@ -233,6 +467,59 @@ class mysql_database_setup_strategy(database_setup_strategy):
         """List databases."""
         return self.execute_mysql_command('SHOW DATABASES;')
 
+    def dump_catalog(self, database, username, password, path):
+        """Write a SQL script to `path` which recreates `database` and the user which owns it.
+
+        Arguments:
+        database -- name of the database to dump
+        username -- name of the database user to recreate
+        password -- password for the database user
+        path -- path inside the database container for the SQL script
+        """
+        create_user = 'CREATE USER \'{0}\'@\'{1}\' IDENTIFIED BY \'{2}\';'.format(username, 'localhost', password)
+        grant = 'GRANT ALL ON {0}.* to \'{1}\'@\'{2}\';'.format(database, username, '%')
+
+        # The SQL statements and paths are passed as positional parameters to avoid quoting them
+        script = ('set -o pipefail; '
+                  '{ printf "%s\\n%s\\n" "$1" "$2"; '
+                  'mysqldump --port "$3" --user root --password="$4" --databases "$5"; } > "$6"')
+        cmd = ['bash', '-c', script, 'bash', create_user, grant, str(self.port), self.root_password, database, path]
+        return execute.execute_command(self.container, cmd)
+
+    def baseline_path(self, baseline):
+        """Return the path in the database container of the dump file for `baseline`.
+
+        Arguments:
+        baseline -- name of the baseline
+        """
+        return os.path.join('/var', 'tmp', '{}.sql'.format(baseline))
+
+    def save_baseline(self, database, baseline):
+        """Dump the current contents of `database` to a file in the container named for `baseline`.
+
+        Arguments:
+        database -- name of the database to save
+        baseline -- name of the baseline
+        """
+        script = 'mysqldump --port "$1" --user root --password="$2" --databases "$3" > "$4"'
+        cmd = ['bash', '-c', script, 'bash', str(self.port), self.root_password, database, self.baseline_path(baseline)]
+        return execute.execute_command(self.container, cmd)
+
+    def restore_baseline(self, database, baseline):
+        """Recreate `database` by loading the dump file saved for `baseline`.
+
+        Arguments:
+        database -- name of the database to restore
+        baseline -- name of the baseline saved with save_baseline
+        """
+        ec = self.drop_database(database)
+        if ec != 0:
+            return ec
+
+        script = 'mysql --port "$1" --user root --password="$2" < "$3"'
+        cmd = ['bash', '-c', script, 'bash', str(self.port), self.root_password, self.baseline_path(baseline)]
+        return execute.execute_command(self.container, cmd)
+
 
 def make_strategy(database_image, container=None, database_port=None, root_password=None):
     """Make a database setup strategy for the given database type.
@@ -245,8 +532,9 @@ def make_strategy(database_image, container=None, database_port=None, root_passw
     """
     strat_name = context.image_repo(database_image) + '_database_setup_strategy'
 
-    return eval(strat_name)(container, database_port, root_password)
+    return eval(strat_name)(container, root_password=root_password, port=database_port)
 
+@tracing.traced()
 def setup_catalog(docker_client,
                   compose_project,
                   database_image,
@@ -277,6 +565,9 @@ def setup_catalog(docker_client,
 
     strat = make_strategy(database_image, db_container, database_port, root_password)
 
+    # The container is up long before the server in it accepts connections
+    readiness.wait_for_database(strat)
+
     ec = strat.create_database(database_name)
     if ec is not 0:
         raise RuntimeError('failed to create database [{}]'.format(database_name))
@@ -1,43 +1,305 @@
 # grown-up modules
 import compose.cli.command
 import docker
+import itertools
 import logging
 import os
 
 # local modules
 import context
+import tracing
 
-def execute_command(container, command, user='', workdir=None, stream_output=False):
-    OUTPUT_ENCODING = 'utf-8'
+class command_result(object):
+    """The outcome of a command executed in a container."""
+    def __init__(self, container_name, command):
+        """Construct a command_result.
+
+        Arguments:
+        container_name -- name of the container in which the command was executed
+        command -- the command which was executed
+        """
+        self.container_name = container_name
+        self.command = command
+        self.ec = None
+        self.duration = 0.0
+        self.stdout_bytes = 0
+        self.stderr_bytes = 0
+        self.output_path = None
+        self.truncated = False
+
+
+class line_framer(object):
+    """Splits a stream of bytes which arrives in arbitrary chunks into whole lines."""
+    def __init__(self, max_line_length=64 * 1024):
+        """Construct a line_framer.
+
+        Arguments:
+        max_line_length -- number of bytes after which an unfinished line is returned anyway, so
+                           that a stream without newlines cannot use unbounded memory
+        """
+        self.max_line_length = max_line_length
+        self.buffer = b''
+
+    def feed(self, data):
+        """Return the lines completed by `data`, without their newlines.
+
+        Arguments:
+        data -- the next chunk of bytes from the stream
+        """
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b'\n')
+
+        while len(self.buffer) > self.max_line_length:
+            lines.append(self.buffer[:self.max_line_length])
+            self.buffer = self.buffer[self.max_line_length:]
+
+        return lines
+
+    def flush(self):
+        """Return whatever is left of an unfinished last line (if anything) as a list of lines."""
+        lines = [self.buffer] if self.buffer else []
+        self.buffer = b''
+        return lines
+
+
+OUTPUT_ENCODING = 'utf-8'
+
+# Streamed output (e.g. from the tests) is logged at INFO whatever the verbosity, so that it
+# reaches every log handler, including the script's log file
+stream_logger = logging.getLogger('irods_test.output')
+stream_logger.setLevel(logging.INFO)
+
+command_counter = itertools.count(1)
+
+
+class output_configuration(object):
+    """Where the output of each command is saved, and how much of it."""
+    def __init__(self, directory=None, max_bytes=16 * 1024 * 1024):
+        """Construct an output_configuration, creating `directory` if it does not exist.
+
+        Arguments:
+        directory -- local directory for the output files (if None, output is not saved)
+        max_bytes -- number of bytes after which the rest of a command's output is not saved
+        """
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+
+# The output_configuration used by commands which are not given one (see configure_output)
+default_output = {'configuration': output_configuration()}
+
+
+def configure_output(directory=None, max_bytes=16 * 1024 * 1024):
+    """Make commands which are not given an output_configuration save their output in `directory`.
+
+    Scripts call this once at startup. Returns the new output_configuration so that it can also
+    be passed to run_command explicitly.
+
+    Arguments:
+    directory -- local directory for the output files (if None, output is not saved)
+    max_bytes -- number of bytes after which the rest of a command's output is not saved
+    """
+    configuration = output_configuration(directory, max_bytes)
+
+    default_output['configuration'] = configuration
+
+    return configuration
+
+
+def output_file_path(directory, container_name):
+    """Return a path in `directory` for the output of the next command run on the container.
+
+    Arguments:
+    directory -- local directory for the output files
+    container_name -- name of the container on which the command is executed
+    """
+    return os.path.join(directory, '{0:05d}-{1}.log'.format(next(command_counter), container_name))
+
+
+class output_recorder(object):
+    """Splits the output of a command into lines, then logs and saves them (see run_command)."""
+    def __init__(self, result, stream_output=False, configuration=None):
+        """Construct an output_recorder, opening the command's output file if output is saved.
+
+        Arguments:
+        result -- command_result of the command whose output is recorded
+        stream_output -- if True, log the output at INFO whatever the verbosity instead of at DEBUG
+        configuration -- output_configuration saying where the output is saved (default: the one
+                         set by configure_output)
+        """
+        configuration = configuration or default_output['configuration']
+
+        self.result = result
+        self.stream_output = stream_output
+        self.framers = {'stdout': line_framer(), 'stderr': line_framer()}
+        self.max_bytes = configuration.max_bytes
+        self.saved_bytes = 0
+        self.output_file = None
+
+        directory = configuration.directory
+        if directory:
+            result.output_path = output_file_path(directory, result.container_name)
+            self.output_file = open(result.output_path, 'wb')
+            self.output_file.write('# [{0}] [{1}]\n'.format(result.container_name, result.command).encode(OUTPUT_ENCODING))
+
+    def feed(self, stream_name, data):
+        """Record the next chunk of bytes from stdout or stderr.
+
+        Arguments:
+        stream_name -- 'stdout' or 'stderr'
+        data -- the next chunk of bytes from the stream
+        """
+        if stream_name == 'stdout':
+            self.result.stdout_bytes += len(data)
+        else:
+            self.result.stderr_bytes += len(data)
+
+        self.handle(stream_name, self.framers[stream_name].feed(data))
+
+    def flush(self):
+        """Record whatever is left of unfinished last lines."""
+        for stream_name, framer in self.framers.items():
+            self.handle(stream_name, framer.flush())
+
+    def handle(self, stream_name, lines):
+        for line in lines:
+            prefix = b'' if stream_name == 'stdout' else b'[stderr] '
+            text = line.decode(OUTPUT_ENCODING, 'replace')
+
+            if self.stream_output:
+                stream_logger.info('{0}{1}'.format(prefix.decode(OUTPUT_ENCODING), text))
+            else:
+                logging.debug('[{0}] {1}{2}'.format(self.result.container_name, prefix.decode(OUTPUT_ENCODING), text))
+
+            if self.output_file and not self.result.truncated:
+                record = prefix + line + b'\n'
+                if self.saved_bytes + len(record) > self.max_bytes:
+                    self.output_file.write(b'# output truncated\n')
+                    self.result.truncated = True
+                else:
+                    self.output_file.write(record)
+                    self.saved_bytes += len(record)
+
+    def close(self):
+        """Close the output file, if there is one."""
+        if self.output_file:
+            self.output_file.close()
+            self.output_file = None
+
+
+def run_command(container, command, user='', workdir=None, stream_output=False, output=None, environment=None):
+    """Execute `command` on `container` and return a command_result.
+
+    Output is read as it is produced, with stdout and stderr kept apart and split into whole
+    lines, so memory use does not grow with the amount of output. Each line is logged at the
+    DEBUG level (or, with `stream_output`, at the INFO level whatever the verbosity, so that
+    all of it reaches the script's log file), and the output is saved to its own file (up to a
+    size cap) if the output configuration has a directory.
+
+    Arguments:
+    container -- docker container on which the command is executed
+    command -- the command to execute, as a string or a list of arguments
+    user -- user as which the command is executed (default: the container's user)
+    workdir -- working directory in which the command is executed
+    stream_output -- if True, log the output at INFO as it is produced
+    output -- output_configuration saying where the output is saved (default: the one set by
+              configure_output)
+    environment -- dict of environment variables to set for the command
+    """
+    import time
 
     logging.debug('executing on [{0}] [{1}]'.format(container.name, command))
 
-    exec_instance = container.client.api.exec_create(container.id, command, user=user, workdir=workdir)
-    exec_out = container.client.api.exec_start(exec_instance['Id'], stream=stream_output)
+    result = command_result(container.name, command)
+
+    recorder = output_recorder(result, stream_output=stream_output, configuration=output)
+
+    start_time = time.time()
 
-    previous_log_level = logging.getLogger().getEffectiveLevel()
-    if previous_log_level > logging.INFO:
-        logging.getLogger().setLevel(logging.INFO)
+    command_string = command if isinstance(command, str) else ' '.join(command)
 
     try:
-        # Stream output from the executing command. A StopIteration exception is raised
-        # by the generator returned by the docker-py API when there is no more output.
-        while stream_output:
-            logging.info(next(exec_out).decode(OUTPUT_ENCODING))
+        with tracing.span(command_string[:80], 'command', container=container.name, command=command_string):
+            exec_instance = container.client.api.exec_create(container.id, command, user=user, workdir=workdir,
+                                                              environment=environment)
 
-    except StopIteration:
-        logging.debug('done')
+            for stdout, stderr in container.client.api.exec_start(exec_instance['Id'], stream=True, demux=True):
+                if stdout:
+                    recorder.feed('stdout', stdout)
+
+                if stderr:
+                    recorder.feed('stderr', stderr)
+
+            recorder.flush()
+
+            result.ec = container.client.api.exec_inspect(exec_instance['Id'])['ExitCode']
 
     finally:
-        logging.getLogger().setLevel(previous_log_level)
+        result.duration = time.time() - start_time
+
+        recorder.close()
+
+    logging.debug('command finished [ec=[{0}], duration=[{1:.1f}s], stdout=[{2}], stderr=[{3}]] [{4}]'
+                  .format(result.ec, result.duration, result.stdout_bytes, result.stderr_bytes, container.name))
+
+    return result
+
+
+def execute_command(container, command, user='', workdir=None, stream_output=False, output=None, environment=None):
+    """Execute `command` on `container` and return its exit code (see run_command).
+
+    Arguments:
+    container -- docker container on which the command is executed
+    command -- the command to execute, as a string or a list of arguments
+    user -- user as which the command is executed (default: the container's user)
+    workdir -- working directory in which the command is executed
+    stream_output -- if True, log the output at INFO as it is produced
+    output -- output_configuration saying where the output is saved (default: the one set by
+              configure_output)
+    environment -- dict of environment variables to set for the command
+    """
+    return run_command(container, command, user=user, workdir=workdir, stream_output=stream_output, output=output,
+                       environment=environment).ec
+
+def for_each_container(function, containers, max_workers=None):
+    """Call `function` on every container concurrently and return 0 if all of the calls succeeded.
+
+    Exceptions raised by `function` are logged and reflected in the return value rather than
+    raised so that one container failing does not hide the outcome for the others.
+
+    Arguments:
+    function -- callable which takes a container as its only argument
+    containers -- list of containers on which `function` is called
+    max_workers -- maximum number of calls to run at the same time (default: one per container)
+    """
+    import concurrent.futures
+
+    if not containers:
+        return 0
+
+    rc = 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or len(containers)) as executor:
+        futures_to_containers = {executor.submit(function, c): c for c in containers}
+
+        for f in concurrent.futures.as_completed(futures_to_containers):
+            container = futures_to_containers[f]
+            try:
+                f.result()
 
-    if not stream_output:
-        logging.debug(exec_out.decode(OUTPUT_ENCODING))
+            except Exception as e:
+                logging.error('exception raised on container [{}]'.format(container.name))
+                logging.error(e)
+                rc = 1
 
-    return container.client.api.exec_inspect(exec_instance['Id'])['ExitCode']
+    return rc
 
 if __name__ == "__main__":
     import argparse
+    import client_cache
     import logs
 
     parser = argparse.ArgumentParser(description='Run commands on a running container as iRODS service account.')
@@ -63,7 +325,7 @@ if __name__ == "__main__":
     ec = 0
     containers = list()
 
-    docker_client = docker.from_env()
+    docker_client = client_cache.shared_client()
 
     try:
         p = compose.cli.command.get_project(os.path.abspath(args.project_path), project_name=args.project_name)
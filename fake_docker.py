@@ -0,0 +1,659 @@
+# grown-up modules
+import docker
+import io
+import itertools
+import json
+import logging
+import re
+import tarfile
+import threading
+import time
+
+# local modules
+import context
+
+def default_latencies():
+    """Return the number of seconds each kind of simulated docker call takes by default.
+
+    api -- round trip to the docker daemon, added to every call
+    exec -- running a command which matches none of the canned responses
+    up -- creating and starting one container with docker-compose up
+    down -- stopping and removing one container with docker-compose down
+    archive_bandwidth -- bytes per second at which archives are copied in or out (None: no limit)
+    """
+    return {
+        'api': 0.002,
+        'exec': 0.01,
+        'up': 0.05,
+        'down': 0.02,
+        'archive_bandwidth': None
+    }
+
+
+class canned_response(object):
+    """What a simulated command does when its command line matches a pattern."""
+    def __init__(self, pattern, exit_code=0, output=b'', duration=None):
+        """Construct a canned_response.
+
+        Arguments:
+        pattern -- regular expression searched for in the command line
+        exit_code -- exit code of the command
+        output -- bytes written to stdout by the command
+        duration -- number of seconds the command runs (default: the 'exec' latency)
+        """
+        self.pattern = re.compile(pattern)
+        self.exit_code = exit_code
+        self.output = output
+        self.duration = duration
+
+
+def server_config_template():
+    """Return the parts of a server_config.json (or its template) which setting up a server looks at."""
+    return {
+        'catalog_provider_hosts': ['localhost'],
+        'catalog_service_role': 'provider',
+        'plugin_configuration': {'database': {}},
+        'schema_name': 'server_config',
+        'schema_version': 'v3',
+        'server_control_plane_port': 1248,
+        'zone_name': 'tempZone',
+        'zone_port': 1247
+    }
+
+
+def default_responses(install_duration=1.0, setup_duration=0.5):
+    """Return canned responses for the slow steps of setting up a zone.
+
+    Arguments:
+    install_duration -- number of seconds each package manager command runs
+    setup_duration -- number of seconds each iRODS or catalog setup command runs
+    """
+    return [
+        canned_response(r'apt-get|yum|dpkg|rpm ', duration=install_duration),
+        canned_response(r'setup_irods\.py|psql|mysql', duration=setup_duration),
+        canned_response(r'odbcinst -q -d', output=b'[PostgreSQL ANSI]\n[PostgreSQL Unicode]\n[MySQL ANSI]\n[MySQL Unicode]\n'),
+        canned_response(r'server_config\.json\.template', output=json.dumps(server_config_template()).encode('utf-8')),
+        canned_response(r'/etc/irods/server_config\.json', output=json.dumps(server_config_template()).encode('utf-8'))
+    ]
+
+
+class fake_api(object):
+    """Stands in for docker.APIClient with the low-level calls used by these modules."""
+    def __init__(self, client):
+        """Construct a fake_api.
+
+        Arguments:
+        client -- the fake_client which owns the containers
+        """
+        self.client = client
+        self.lock = threading.Lock()
+        self.execs = dict()
+        self.exec_ids = itertools.count(1)
+
+    def exec_create(self, container, cmd, user='', workdir=None, **kwargs):
+        """Create an exec instance in `container` and return a dict with its Id."""
+        self.client.call('exec_create')
+
+        target = self.client.containers.find(container)
+
+        with self.lock:
+            exec_id = 'exec{}'.format(next(self.exec_ids))
+            self.execs[exec_id] = {'container': target, 'cmd': cmd, 'ExitCode': None, 'Running': False}
+
+        return {'Id': exec_id}
+
+    def exec_start(self, exec_id, stream=False, demux=False, **kwargs):
+        """Run the exec instance and return its output the way docker-py does."""
+        self.client.call('exec_start')
+
+        instance = self.execs[exec_id]
+        response = self.client.respond(instance['cmd'])
+
+        def output():
+            instance['Running'] = True
+            time.sleep(self.client.command_duration(response))
+
+            if response.output:
+                yield (response.output, None) if demux else response.output
+
+            instance['ExitCode'] = response.exit_code
+            instance['Running'] = False
+
+        if stream:
+            return output()
+
+        chunks = list(output())
+        if demux:
+            return (b''.join(c[0] for c in chunks) or None, None)
+
+        return b''.join(chunks)
+
+    def exec_inspect(self, exec_id):
+        """Return the state of the exec instance."""
+        self.client.call('exec_inspect')
+
+        instance = self.execs[exec_id]
+        return {'ExitCode': instance['ExitCode'], 'Running': instance['Running']}
+
+    def inspect_container(self, container):
+        """Return the attributes of `container`."""
+        self.client.call('inspect_container')
+
+        return self.client.containers.find(container).attrs
+
+    def put_archive(self, container, path, data):
+        """Unpack the tar archive `data` (bytes or an iterable of chunks) at `path` in `container`."""
+        import os
+
+        self.client.call('put_archive')
+
+        target = self.client.containers.find(container)
+
+        if isinstance(data, (bytes, bytearray)):
+            chunks = [data]
+        elif hasattr(data, 'read'):
+            chunks = iter(lambda: data.read(1024 * 1024), b'')
+        else:
+            chunks = data
+
+        buf = io.BytesIO()
+        for chunk in chunks:
+            buf.write(chunk)
+
+        time.sleep(self.client.transfer_duration(buf.tell()))
+
+        buf.seek(0)
+        with tarfile.open(fileobj=buf, mode='r:*') as tf:
+            for member in tf:
+                if member.isfile():
+                    target.files[os.path.join(path, member.name)] = tf.extractfile(member).read()
+
+        return True
+
+    def get_archive(self, container, path, chunk_size=2 * 1024 * 1024, **kwargs):
+        """Return a tuple of a generator of tar archive chunks holding `path` in `container` and a stat dict."""
+        import os
+
+        self.client.call('get_archive')
+
+        target = self.client.containers.find(container)
+
+        path = path.rstrip('/')
+        members = {p: v for p, v in target.files.items() if p == path or p.startswith(path + '/')}
+        if not members:
+            raise docker.errors.NotFound('no such file or directory [{0}] [{1}]'.format(path, target.name))
+
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode='w') as tf:
+            for p, contents in sorted(members.items()):
+                name = os.path.basename(path)
+                info = tarfile.TarInfo(name if p == path else os.path.join(name, os.path.relpath(p, path)))
+                info.size = len(contents)
+                tf.addfile(info, io.BytesIO(contents))
+
+        data = buf.getvalue()
+
+        def chunks():
+            time.sleep(self.client.transfer_duration(len(data)))
+            for i in range(0, len(data), chunk_size):
+                yield data[i:i + chunk_size]
+
+        return chunks(), {'name': os.path.basename(path), 'size': len(data)}
+
+    def start(self, container):
+        """Start `container`."""
+        self.client.call('start')
+        self.client.containers.find(container).status = 'running'
+
+    def stop(self, container, **kwargs):
+        """Stop `container`."""
+        self.client.call('stop')
+        self.client.containers.find(container).status = 'exited'
+
+    def remove_container(self, container, force=False, **kwargs):
+        """Remove `container`."""
+        self.client.call('remove')
+        self.client.containers.forget(self.client.containers.find(container))
+
+    def commit(self, container, repository=None, tag=None, changes=None, **kwargs):
+        """Add an image tagged `repository`:`tag` with the labels set by LABEL instructions in `changes`."""
+        self.client.call('commit')
+
+        labels = dict()
+        for change in changes or []:
+            instruction, _, argument = change.partition(' ')
+            if instruction == 'LABEL':
+                name, _, value = argument.partition('=')
+                labels[name] = json.loads(value)
+
+        return {'Id': self.client.images.add('{0}:{1}'.format(repository, tag or 'latest'), labels=labels).id}
+
+
+class fake_exec_result(object):
+    """Stands in for docker.models.containers.ExecResult."""
+    def __init__(self, exit_code, output):
+        """Construct a fake_exec_result with the exit code and output of a command."""
+        self.exit_code = exit_code
+        self.output = output
+
+    def __iter__(self):
+        """Unpack as (exit_code, output), as docker-py's ExecResult does."""
+        return iter((self.exit_code, self.output))
+
+
+class fake_container(object):
+    """Stands in for docker.models.containers.Container."""
+    def __init__(self, client, name, image, network_name=None):
+        """Construct a fake_container.
+
+        Arguments:
+        client -- the fake_client which owns the container
+        name -- name of the container
+        image -- name of the image from which the container was created
+        network_name -- name of the network to which the container is connected
+        """
+        self.client = client
+        self.name = name
+        self.id = '{:064x}'.format(abs(hash(name)))
+        self.short_id = self.id[:12]
+        self.image = image
+        self.status = 'running'
+        self.files = dict(client.files)
+        self.network_name = network_name or 'bridge'
+
+    @property
+    def attrs(self):
+        """Return the inspect data of the container, as docker reports it."""
+        return {
+            'Id': self.id,
+            'Name': '/' + self.name,
+            'Config': {'Hostname': self.short_id, 'Image': self.image, 'Labels': {}},
+            'State': {'Status': self.status, 'Running': self.status == 'running'},
+            'NetworkSettings': {'Networks': {self.network_name: {'Gateway': '172.17.0.1', 'Aliases': []}}}
+        }
+
+    def reload(self):
+        """Fetch the inspect data of the container again, as docker-py does."""
+        self.client.api.inspect_container(self.id)
+
+    def start(self):
+        """Start the container."""
+        self.client.api.start(self.id)
+
+    def stop(self, **kwargs):
+        """Stop the container."""
+        self.client.api.stop(self.id)
+
+    def remove(self, force=False, **kwargs):
+        """Remove the container."""
+        self.client.api.remove_container(self.id, force=force)
+
+    def commit(self, repository=None, tag=None, changes=None, **kwargs):
+        """Add an image tagged `repository`:`tag` with the labels set by LABEL instructions in `changes`."""
+        response = self.client.api.commit(self.id, repository=repository, tag=tag, changes=changes)
+
+        return self.client.images.get(response['Id'])
+
+    def exec_run(self, cmd, user='', workdir=None, **kwargs):
+        """Run `cmd` and return a fake_exec_result with its exit code and output."""
+        exec_id = self.client.api.exec_create(self.id, cmd, user=user, workdir=workdir)['Id']
+        output = self.client.api.exec_start(exec_id)
+
+        return fake_exec_result(self.client.api.exec_inspect(exec_id)['ExitCode'], output)
+
+    def put_archive(self, path, data):
+        """Unpack the tar archive `data` (bytes or an iterable of chunks) at `path`."""
+        return self.client.api.put_archive(self.id, path, data)
+
+    def get_archive(self, path, chunk_size=2 * 1024 * 1024, **kwargs):
+        """Return a tuple of a generator of tar archive chunks holding `path` and a stat dict."""
+        return self.client.api.get_archive(self.id, path, chunk_size=chunk_size)
+
+
+class fake_container_collection(object):
+    """Stands in for docker_client.containers."""
+    def __init__(self, client):
+        """Construct a fake_container_collection with no containers."""
+        self.client = client
+        self.lock = threading.Lock()
+        self.by_name = dict()
+
+    def add(self, name, image, network_name=None):
+        """Create a running container named `name` and return it."""
+        container = fake_container(self.client, name, image, network_name)
+
+        with self.lock:
+            self.by_name[name] = container
+
+        return container
+
+    def forget(self, container):
+        """Forget `container`, as if it had been removed."""
+        with self.lock:
+            self.by_name.pop(container.name, None)
+
+    def get(self, container_id):
+        """Return the container with the name or id `container_id`."""
+        self.client.call('containers.get')
+
+        return self.find(container_id)
+
+    def find(self, container_id):
+        """Return the container with the name or id `container_id` without a call to the daemon."""
+        with self.lock:
+            for c in self.by_name.values():
+                if container_id in (c.name, c.id, c.short_id):
+                    return c
+
+        raise docker.errors.NotFound('no such container [{}]'.format(container_id))
+
+    def list(self, all=False, filters=None, **kwargs):
+        """Return the running containers (or all of them, with `all`)."""
+        self.client.call('containers.list')
+
+        with self.lock:
+            return [c for c in self.by_name.values() if all or c.status == 'running']
+
+    def run(self, image, name=None, detach=False, **kwargs):
+        """Create a running container from `image` and return it."""
+        self.client.call('containers.run')
+        time.sleep(self.client.latencies['up'])
+
+        return self.add(name or 'container{}'.format(len(self.by_name) + 1), image)
+
+
+class fake_image(object):
+    """Stands in for docker.models.images.Image."""
+    ids = itertools.count(1)
+
+    def __init__(self, tag, labels=None):
+        """Construct a fake_image tagged `tag` with a new id."""
+        self.id = 'sha256:{:064x}'.format(next(fake_image.ids))
+        self.tags = [tag]
+        self.labels = dict(labels or dict())
+
+
+class fake_image_collection(object):
+    """Stands in for docker_client.images.
+
+    An image replaced by a new one with the same tag is kept, untagged, as docker keeps it.
+    """
+    def __init__(self, client):
+        """Construct a fake_image_collection with no images."""
+        self.client = client
+        self.images = dict()
+        self.untagged = list()
+
+    def add(self, tag, labels=None):
+        """Add an image tagged `tag`, untagging the image which had that tag before."""
+        image = fake_image(tag, labels)
+
+        replaced = self.images.get(tag)
+        if replaced:
+            replaced.tags = []
+            self.untagged.append(replaced)
+
+        self.images[tag] = image
+        return image
+
+    def get(self, name):
+        """Return the image with the tag or id `name`."""
+        self.client.call('images.get')
+
+        for i in list(self.images.values()) + self.untagged:
+            if name in i.tags or name == i.id:
+                return i
+
+        raise docker.errors.ImageNotFound('no such image [{}]'.format(name))
+
+    def list(self, filters=None, **kwargs):
+        """Return the images (tagged or not) which have the label named by a `label` filter, if any."""
+        self.client.call('images.list')
+
+        images = list(self.images.values()) + self.untagged
+
+        label_filter = (filters or dict()).get('label')
+        if label_filter:
+            name, has_value, value = label_filter.partition('=')
+            images = [i for i in images if name in i.labels and (not has_value or i.labels[name] == value)]
+
+        return images
+
+    def build(self, tag=None, **kwargs):
+        """Add an image tagged `tag`, as if it had been built, and return it."""
+        self.client.call('images.build')
+        return self.add(tag)
+
+    def remove(self, image, force=False, **kwargs):
+        """Remove the image with the tag or id `image`, tagged or not."""
+        self.client.call('images.remove')
+        self.images = {t: i for t, i in self.images.items() if image not in (t, i.id)}
+        self.untagged = [i for i in self.untagged if image != i.id]
+
+
+class fake_network(object):
+    """Stands in for docker.models.networks.Network."""
+    def __init__(self, client, name):
+        """Construct a fake_network named `name` with no containers connected."""
+        self.client = client
+        self.name = name
+        self.id = '{:064x}'.format(abs(hash(name)))
+        self.aliases = dict()
+
+    def connect(self, container, aliases=None, **kwargs):
+        """Connect `container` to the network with the network aliases `aliases`."""
+        self.client.call('networks.connect')
+        self.aliases[getattr(container, 'name', container)] = list(aliases or [])
+
+    def disconnect(self, container, **kwargs):
+        """Disconnect `container` from the network."""
+        self.client.call('networks.disconnect')
+        self.aliases.pop(getattr(container, 'name', container), None)
+
+
+class fake_network_collection(object):
+    """Stands in for docker_client.networks."""
+    def __init__(self, client):
+        """Construct a fake_network_collection with no networks."""
+        self.client = client
+        self.networks = dict()
+
+    def add(self, name):
+        """Return the network named `name`, creating it if it does not exist."""
+        return self.networks.setdefault(name, fake_network(self.client, name))
+
+    def get(self, network_id):
+        """Return the network with the name or id `network_id`."""
+        self.client.call('networks.get')
+
+        for n in self.networks.values():
+            if network_id in (n.name, n.id):
+                return n
+
+        raise docker.errors.NotFound('no such network [{}]'.format(network_id))
+
+    def list(self, names=None, **kwargs):
+        """Return the networks (only those named in `names`, if given)."""
+        self.client.call('networks.list')
+        return [n for n in self.networks.values() if not names or n.name in names]
+
+
+class fake_volume_collection(object):
+    """Stands in for docker_client.volumes. No volumes exist."""
+    def __init__(self, client):
+        """Construct a fake_volume_collection."""
+        self.client = client
+
+    def get(self, volume_id):
+        """Raise NotFound: no volumes exist."""
+        self.client.call('volumes.get')
+        raise docker.errors.NotFound('no such volume [{}]'.format(volume_id))
+
+
+class fake_client(object):
+    """Stands in for docker.DockerClient without talking to a docker daemon.
+
+    Every call sleeps for a configurable latency so that the cost of round trips to the daemon,
+    commands, and archive copies can be simulated, and every call is counted so that the number
+    of round trips made by a piece of orchestration code can be compared across changes.
+    """
+    def __init__(self, latencies=None, responses=None, files=None, max_concurrent_calls=None):
+        """Construct a fake_client.
+
+        Arguments:
+        latencies -- dict overriding entries of default_latencies()
+        responses -- list of canned_responses; the first one matching a command line is used
+        files -- dict of paths to the bytes found at each path in every new container
+        max_concurrent_calls -- number of calls the simulated daemon serves at the same time
+                                (default: no limit)
+        """
+        self.latencies = default_latencies()
+        self.latencies.update(latencies or dict())
+        self.responses = list(responses if responses is not None else default_responses())
+        self.files = dict(files or dict())
+
+        self.daemon = threading.BoundedSemaphore(max_concurrent_calls) if max_concurrent_calls else None
+
+        self.calls_lock = threading.Lock()
+        self.calls = dict()
+
+        self.api = fake_api(self)
+        self.containers = fake_container_collection(self)
+        self.images = fake_image_collection(self)
+        self.networks = fake_network_collection(self)
+        self.volumes = fake_volume_collection(self)
+
+    def call(self, name):
+        """Count a call to the daemon and wait for its round trip.
+
+        Arguments:
+        name -- name of the docker API call
+        """
+        with self.calls_lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+        if self.daemon:
+            with self.daemon:
+                time.sleep(self.latencies['api'])
+        else:
+            time.sleep(self.latencies['api'])
+
+    def call_count(self):
+        """Return the total number of calls made to the simulated daemon."""
+        with self.calls_lock:
+            return sum(self.calls.values())
+
+    def respond(self, cmd):
+        """Return the canned_response for the command line `cmd`.
+
+        Arguments:
+        cmd -- the command, as a string or a list of arguments
+        """
+        command_string = cmd if isinstance(cmd, str) else ' '.join(cmd)
+
+        for r in self.responses:
+            if r.pattern.search(command_string):
+                return r
+
+        return canned_response('')
+
+    def command_duration(self, response):
+        """Return the number of seconds the command answered by `response` runs."""
+        return self.latencies['exec'] if response.duration is None else response.duration
+
+    def transfer_duration(self, size):
+        """Return the number of seconds it takes to copy `size` bytes in or out of a container."""
+        bandwidth = self.latencies['archive_bandwidth']
+        return size / bandwidth if bandwidth else 0.0
+
+    def close(self):
+        """Do nothing: there is no connection to close."""
+
+
+class fake_service(object):
+    """Stands in for compose.service.Service."""
+    def __init__(self, name, network_name):
+        """Construct a fake_service named `name` on the network `network_name`."""
+        self.name = name
+        self.networks = {network_name: {}}
+
+
+class fake_compose_project(object):
+    """Stands in for compose.project.Project with the services of an iRODS zone.
+
+    The zone has one catalog database, one catalog service provider and, once it is up,
+    however many catalog service consumers the scale override asks for.
+    """
+    def __init__(self, client, name, platform='ubuntu:18.04', database='postgres:10.12'):
+        """Construct a fake_compose_project.
+
+        Arguments:
+        client -- the fake_client in which the containers are created
+        name -- name of the docker-compose project
+        platform -- repo:tag of the image used by the iRODS services
+        database -- repo:tag of the image used by the catalog database service
+        """
+        self.client = client
+        self.name = context.sanitize(name)
+        self.platform = platform
+        self.database = database
+        self.network_name = '{}_default'.format(self.name)
+
+        self.services = [fake_service(s, self.network_name) for s in
+                         [context.irods_catalog_database_service(),
+                          context.irods_catalog_provider_service(),
+                          context.irods_catalog_consumer_service()]]
+
+        self.created = list()
+
+    def initialize(self):
+        """Create the network of the project."""
+        self.client.networks.add(self.network_name)
+
+    def up(self, scale_override=None, **kwargs):
+        """Create and start the containers of every service and return them."""
+        import concurrent.futures
+
+        self.initialize()
+
+        scale = {s.name: 1 for s in self.services}
+        scale.update(scale_override or dict())
+
+        def create(service, instance):
+            self.client.call('containers.create')
+            time.sleep(self.client.latencies['up'])
+
+            image = self.database if service == context.irods_catalog_database_service() else self.platform
+            return self.client.containers.add(context.container_name(self.name, service, instance),
+                                              image,
+                                              self.network_name)
+
+        names = [(s.name, i + 1) for s in self.services for i in range(scale[s.name])]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(names)) as executor:
+            self.created = list(executor.map(lambda n: create(*n), names))
+
+        logging.debug('created containers [{0}] [{1}]'.format(len(self.created), self.name))
+
+        return list(self.created)
+
+    def containers(self, service_names=None, stopped=False, **kwargs):
+        """Return the containers of the project, optionally only those of `service_names`."""
+        self.client.call('containers.list')
+
+        prefix = self.name + '_'
+        with self.client.containers.lock:
+            containers = [c for c in self.client.containers.by_name.values() if c.name.startswith(prefix)]
+
+        return [c for c in containers
+                if (not service_names or context.service_name(c.name) in service_names)
+                and (stopped or c.status == 'running')]
+
+    def down(self, include_volumes=False, remove_image_type=None, **kwargs):
+        """Stop and remove every container of the project."""
+        for c in self.containers(stopped=True):
+            self.client.call('containers.remove')
+            time.sleep(self.client.latencies['down'])
+            self.client.containers.forget(c)
+
+        self.client.networks.networks.pop(self.network_name, None)
@@ -0,0 +1,233 @@
+# grown-up modules
+import contextlib
+import functools
+import logging
+import os
+import threading
+import time
+
+def default_limits():
+    """Return the number of docker calls of each kind which may be in flight at the same time.
+
+    exec calls run commands in containers, archive calls copy files in and out of them, and
+    lifecycle calls create, start, stop, remove, commit and (dis)connect them. The
+    IRODS_TEST_DOCKER_MAX_EXEC_CALLS, IRODS_TEST_DOCKER_MAX_ARCHIVE_CALLS and
+    IRODS_TEST_DOCKER_MAX_LIFECYCLE_CALLS environment variables override the defaults.
+    """
+    return {
+        'exec': int(os.environ.get('IRODS_TEST_DOCKER_MAX_EXEC_CALLS', 16)),
+        'archive': int(os.environ.get('IRODS_TEST_DOCKER_MAX_ARCHIVE_CALLS', 4)),
+        'lifecycle': int(os.environ.get('IRODS_TEST_DOCKER_MAX_LIFECYCLE_CALLS', 4))
+    }
+
+
+def call_kind(name):
+    """Return the kind of docker API call made by the method called `name`, or None if it is not limited.
+
+    Arguments:
+    name -- name of a method of docker.APIClient (or of a container collection)
+    """
+    if name.startswith('exec_'):
+        return 'exec'
+
+    if name in ('put_archive', 'get_archive'):
+        return 'archive'
+
+    if name in ('create_container', 'start', 'stop', 'restart', 'kill', 'pause', 'unpause',
+                'remove_container', 'commit', 'run', 'connect_container_to_network',
+                'disconnect_container_from_network', 'create_network', 'remove_network'):
+        return 'lifecycle'
+
+    return None
+
+
+class call_stats(object):
+    """How the calls of one kind fared against their limit."""
+    def __init__(self, limit):
+        self.limit = limit
+        self.calls = 0
+        self.queued = 0
+        self.wait = 0.0
+        self.max_wait = 0.0
+        self.in_flight = 0
+        self.peak = 0
+
+    def as_dict(self):
+        return {
+            'limit': self.limit,
+            'calls': self.calls,
+            'queued': self.queued,
+            'wait': self.wait,
+            'max_wait': self.max_wait,
+            'mean_wait': self.wait / self.calls if self.calls else 0.0,
+            'peak': self.peak
+        }
+
+
+class call_governor(object):
+    """Limits how many docker calls of each kind are in flight at the same time in this process.
+
+    Without a limit, every thread working on a container calls the docker daemon at once, and
+    the daemon serves bursts of dozens of execs or archive copies more slowly than it would
+    serve them a few at a time. Calls past the limit for their kind wait for a slot; how many
+    waited and for how long is kept (see stats) so that the limits can be tuned.
+
+    A slot is held for as long as the API call takes. For streamed exec output, that is until
+    the stream is attached, not until the command finishes, so long-running commands do not
+    hold slots. Calls which only make progress together (e.g. uploads fed from one stream, see
+    archive.put_archive_in_containers) must take one slot for the whole group and make their
+    calls in exempt threads; otherwise the calls holding slots wait for the calls which are
+    waiting for them.
+
+    Only calls made through docker clients are governed: docker-compose makes its own
+    lifecycle calls when it brings a project up or down.
+    """
+    def __init__(self, limits=None):
+        """Construct a call_governor.
+
+        Arguments:
+        limits -- dict of call kinds to the number of calls in flight at once (default: default_limits())
+        """
+        self.lock = threading.Lock()
+        self.exempt_threads = threading.local()
+        self.semaphores = dict()
+        self.call_stats = dict()
+        self.configure(limits or default_limits())
+
+    def configure(self, limits):
+        """Change the limits for the kinds of calls in `limits` and forget the stats for them.
+
+        Calls already waiting keep waiting on the old limit.
+
+        Arguments:
+        limits -- dict of call kinds to the number of calls in flight at once
+        """
+        with self.lock:
+            for kind, limit in limits.items():
+                if kind not in default_limits():
+                    raise ValueError('unknown kind of docker call [{}]'.format(kind))
+
+                if limit < 1:
+                    raise ValueError('docker call limit must be at least 1 [{}]'.format(kind))
+
+                self.semaphores[kind] = threading.BoundedSemaphore(limit)
+                self.call_stats[kind] = call_stats(limit)
+
+    @contextlib.contextmanager
+    def slot(self, kind):
+        """Wait for a slot for a docker call of kind `kind` and hold it in the body of the `with` statement.
+
+        Arguments:
+        kind -- exec, archive or lifecycle
+        """
+        with self.lock:
+            semaphore = self.semaphores[kind]
+            stats = self.call_stats[kind]
+
+        start_time = time.time()
+
+        queued = not semaphore.acquire(blocking=False)
+        if queued:
+            semaphore.acquire()
+
+        waited = time.time() - start_time
+
+        with self.lock:
+            stats.calls += 1
+            stats.queued += 1 if queued else 0
+            stats.wait += waited
+            stats.max_wait = max(stats.max_wait, waited)
+            stats.in_flight += 1
+            stats.peak = max(stats.peak, stats.in_flight)
+
+        try:
+            yield waited
+
+        finally:
+            with self.lock:
+                stats.in_flight -= 1
+
+            semaphore.release()
+
+    @contextlib.contextmanager
+    def exempt(self):
+        """Let governed calls made by this thread in the body of the `with` statement skip the wait for a slot."""
+        previous = getattr(self.exempt_threads, 'exempt', False)
+        self.exempt_threads.exempt = True
+
+        try:
+            yield
+
+        finally:
+            self.exempt_threads.exempt = previous
+
+    def governed(self, kind, function):
+        """Return `function` wrapped so that each call to it waits for a slot of kind `kind`.
+
+        Arguments:
+        kind -- exec, archive or lifecycle
+        function -- callable which makes a docker call
+        """
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if getattr(self.exempt_threads, 'exempt', False):
+                return function(*args, **kwargs)
+
+            with self.slot(kind):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    def stats(self):
+        """Return a dict of call kinds to dicts describing how their calls fared (see call_stats)."""
+        with self.lock:
+            return {kind: s.as_dict() for kind, s in self.call_stats.items()}
+
+    def reset_stats(self):
+        """Forget the stats of every kind of call (e.g. between runs of a benchmark)."""
+        with self.lock:
+            for kind, s in self.call_stats.items():
+                in_flight = s.in_flight
+                self.call_stats[kind] = call_stats(s.limit)
+                self.call_stats[kind].in_flight = in_flight
+
+    def summary(self):
+        """Return a line of text describing the calls and queue waits of each kind."""
+        return ', '.join('{0}: {1} calls, {2} queued, {3:.1f}s waited (max {4:.2f}s, limit {5}, peak {6})'
+                         .format(kind, s['calls'], s['queued'], s['wait'], s['max_wait'], s['limit'], s['peak'])
+                         for kind, s in sorted(self.stats().items()))
+
+
+# The governor shared by every docker client in this process (see shared_governor)
+shared = {'governor': None}
+shared_lock = threading.Lock()
+
+
+def shared_governor():
+    """Return the call_governor shared by everything in this process, creating it on first use."""
+    with shared_lock:
+        if not shared['governor']:
+            shared['governor'] = call_governor()
+
+        return shared['governor']
+
+
+def write_stats(path):
+    """Write the stats of the shared governor to `path` as JSON and log a summary of them.
+
+    Arguments:
+    path -- local path to the JSON file to write
+    """
+    import json
+
+    g = shared_governor()
+
+    try:
+        with open(path, 'w') as f:
+            json.dump(g.stats(), f, indent=4, sort_keys=True)
+
+        logging.info('docker calls [{}]'.format(g.summary()))
+
+    except Exception as e:
+        logging.error('failed to write docker call stats [{}]'.format(path))
+        logging.error(e)
@@ -8,6 +8,8 @@ import os
 import archive
 import context
 import execute
+import package_cache
+import tracing
 
 def platform_update_command(platform):
     if 'centos' in platform:
@@ -43,6 +45,174 @@ def package_filename_extension(platform):
         raise RuntimeError('unsupported platform [{}]'.format(platform))
 
 
+class package_manager_strategy(object):
+    """'Base class' for strategies for installing packages on a platform.
+
+    In fast mode, only the package metadata is refreshed (nothing already installed is upgraded)
+    and only the dependencies the packages actually need are installed. Otherwise, the whole
+    image is updated first, as it always has been.
+
+    This class should not be instantiated directly.
+    """
+    def __init__(self, container, fast=True):
+        """Construct a package_manager_strategy.
+
+        Arguments:
+        container -- docker container in which packages are installed
+        fast -- if True, use the minimal install described above
+        """
+        self.container = container
+        self.fast = fast
+
+    def execute(self, script, *args):
+        """Run `script` with bash in the container, passing `args` as the positional parameters.
+
+        Arguments:
+        script -- bash script to run
+        args -- values of $1, $2, ... in the script
+        """
+        cmd = ['env', 'DEBIAN_FRONTEND=noninteractive', 'bash', '-c', script, 'bash'] + list(args)
+        return execute.execute_command(self.container, cmd)
+
+    def refresh(self):
+        """Bring the package metadata in the container up to date.
+
+        This method must be overridden.
+        """
+        raise NotImplementedError('method not implemented for package manager strategy')
+
+    def install_local(self, packages):
+        """Install package files which are already in the container, along with their dependencies.
+
+        This method must be overridden.
+
+        Arguments:
+        packages -- paths inside the container of the package files to install
+        """
+        raise NotImplementedError('method not implemented for package manager strategy')
+
+    def install_official(self, packages):
+        """Install packages from the configured package repositories.
+
+        This method must be overridden.
+
+        Arguments:
+        packages -- names (and, optionally, versions) of the packages to install
+        """
+        raise NotImplementedError('method not implemented for package manager strategy')
+
+
+class ubuntu_package_manager_strategy(package_manager_strategy):
+    """Package manager strategy for Ubuntu (apt and dpkg)"""
+    def refresh(self):
+        """Update the apt package lists (or the whole image, when not in fast mode).
+
+        Returns the exit code of the command.
+        """
+        if not self.fast:
+            return self.execute(platform_update_command('ubuntu'))
+
+        return self.execute('apt-get update')
+
+    def install_local(self, packages):
+        """Install .deb files in the container with dpkg, letting apt install their missing dependencies.
+
+        Returns the exit code of the command.
+
+        Arguments:
+        packages -- paths inside the container of the .deb files to install
+        """
+        if not self.fast:
+            return self.execute(platform_install_local_packages_command('ubuntu') + ' "$@"', *packages)
+
+        # dpkg stops at missing dependencies, which apt then installs (and nothing else). apt is
+        # also allowed to give up by removing the packages, so make sure they were installed.
+        script = '\n'.join([
+            'dpkg -i "$@" || apt-get install -fy --no-install-recommends || exit 1',
+            'for f in "$@"; do',
+            '    dpkg -s "$(dpkg-deb -f "$f" Package)" | grep -q "^Status: install ok installed" || exit 1',
+            'done'
+        ])
+
+        return self.execute(script, *packages)
+
+    def install_official(self, packages):
+        """Install packages from the apt repositories without their recommended packages.
+
+        Returns the exit code of the command.
+
+        Arguments:
+        packages -- names (and, optionally, versions) of the packages to install
+        """
+        if not self.fast:
+            return self.execute(platform_install_official_packages_command('ubuntu') + ' "$@"', *packages)
+
+        return self.execute('apt-get install -y --no-install-recommends "$@"', *packages)
+
+
+class centos_package_manager_strategy(package_manager_strategy):
+    """Package manager strategy for CentOS (yum and rpm)"""
+    def refresh(self):
+        """Update the yum metadata cache (or the whole image, when not in fast mode).
+
+        Returns the exit code of the command.
+        """
+        if not self.fast:
+            return self.execute(platform_update_command('centos'))
+
+        return self.execute('yum makecache fast')
+
+    def install_local(self, packages):
+        """Install .rpm files in the container with rpm after yum installs only their missing dependencies.
+
+        Returns the exit code of the command.
+
+        Arguments:
+        packages -- paths inside the container of the .rpm files to install
+        """
+        if not self.fast:
+            return self.execute(platform_install_local_packages_command('centos') + ' "$@"', *packages)
+
+        # Ask rpm which capabilities are missing, have yum install only those, and then install
+        # the packages themselves with rpm
+        script = '\n'.join([
+            'missing=$(rpm -U --test "$@" 2>&1 | awk \'/is needed by/ {print $1}\' | sort -u)',
+            'if [ -n "$missing" ]; then yum -y install $missing || exit 1; fi',
+            'rpm -U --replacepkgs "$@"'
+        ])
+
+        return self.execute(script, *packages)
+
+    def install_official(self, packages):
+        """Install packages from the yum repositories.
+
+        Returns the exit code of the command.
+
+        Arguments:
+        packages -- names (and, optionally, versions) of the packages to install
+        """
+        if not self.fast:
+            return self.execute(platform_install_official_packages_command('centos') + ' "$@"', *packages)
+
+        return self.execute('yum -y install "$@"', *packages)
+
+
+def make_strategy(platform_name, container=None, fast=True):
+    """Make a package manager strategy for the given platform.
+
+    Arguments:
+    platform_name -- repo for the docker image of the OS platform (e.g. ubuntu)
+    container -- docker container in which packages are installed
+    fast -- if True, refresh metadata only and install only the dependencies which are needed
+    """
+    # Make sure the platform is supported before looking for its strategy
+    package_filename_extension(platform_name)
+
+    strat_name = platform_name + '_package_manager_strategy'
+
+    return eval(strat_name)(container, fast=fast)
+
+
 def get_list_of_package_paths(platform_name, package_directory, package_name_list):
     import glob
 
@@ -68,54 +238,142 @@ def is_package_database_plugin(p):
     return 'database' in p
 
 
-# TODO: Want to make a more generic version of this
-def install_local_irods_packages(docker_client, platform_name, database_name, package_directory, containers):
-    def install_packages(docker_client, docker_compose_container, packages_list, packages_tarfile_path, platform_name):
-        # Only the iRODS containers need to have packages installed
-        if context.is_catalog_database_container(docker_compose_container):
-            return 0
+def irods_package_names(database_name):
+    """Return the names of the iRODS packages installed in a zone which uses `database_name`.
 
-        container = docker_client.containers.get(docker_compose_container.name)
+    Arguments:
+    database_name -- repo for the docker image of the database server (e.g. postgres)
+    """
+    return ['irods-runtime', 'irods-icommands', 'irods-server', 'irods-database-plugin-{}'.format(database_name)]
 
-        path_to_packages_in_container = archive.copy_archive_to_container(container, packages_tarfile_path)
 
-        package_list = ' '.join([p for p in packages_list if not is_package_database_plugin(p) or context.is_irods_catalog_provider_container(container)])
+def refresh_and_install(strat, packages, local=True):
+    """Refresh the package metadata and install `packages`, logging how long each step took.
 
-        cmd = ' '.join([platform_install_local_packages_command(platform_name), package_list])
+    Returns the exit code of the first failing step, or 0.
 
-        logging.warning('executing cmd [{0}] on container [{1}]'.format(cmd, container.name))
+    Arguments:
+    strat -- package manager strategy for the container in which packages are installed
+    packages -- package files in the container (if `local`) or package names to install
+    local -- if True, `packages` are package files rather than names
+    """
+    import time
 
-        ec = execute.execute_command(container, platform_update_command(platform_name))
-        if ec is not 0:
-            logging.error('failed to update local repositories [{}]'.format(container.name))
-            return ec
+    container = strat.container
 
-        ec = execute.execute_command(container, cmd)
-        if ec is not 0:
-            logging.error(
-                'failed to install packages on container [ec=[{0}], container=[{1}]'.format(ec, container.name))
-            return ec
+    logging.warning('installing packages [{0}] on container [{1}]'.format(' '.join(packages), container.name))
 
+    start_time = time.time()
+
+    ec = strat.refresh()
+    if ec != 0:
+        logging.error('failed to update local repositories [{}]'.format(container.name))
+        return ec
+
+    refresh_time = time.time()
+
+    ec = strat.install_local(packages) if local else strat.install_official(packages)
+    if ec != 0:
+        logging.error(
+            'failed to install packages on container [ec=[{0}], container=[{1}]'.format(ec, container.name))
+        return ec
+
+    end_time = time.time()
+
+    logging.warning('installed packages in [{0:.1f}s] (metadata [{1:.1f}s], install [{2:.1f}s]) [{3}]'
+                    .format(end_time - start_time, refresh_time - start_time, end_time - refresh_time, container.name))
+
+    return 0
+
+
+def install_local_packages_on_container(docker_client, docker_compose_container, packages_list, packages_tarfile_path, platform_name, fast=True):
+    """Install local packages from an archive on the host into a single container.
+
+    Returns the exit code of the first failing step, or 0.
+
+    Arguments:
+    docker_client -- docker client for interacting with the container
+    docker_compose_container -- docker-compose container on which the packages are installed
+    packages_list -- local paths of the packages in the archive
+    packages_tarfile_path -- local path to the archive containing the packages (if None, the
+                             packages must already be in the container; see copy_packages_to_containers)
+    platform_name -- repo for the docker image of the OS platform (e.g. ubuntu)
+    fast -- if True, refresh metadata only and install only the dependencies which are needed
+    """
+    # Only the iRODS containers need to have packages installed
+    if context.is_catalog_database_container(docker_compose_container):
         return 0
 
+    container = docker_client.containers.get(docker_compose_container.name)
+
+    if packages_tarfile_path:
+        archive.copy_archive_to_container(container, packages_tarfile_path)
+
+    package_list = [p for p in packages_list if not is_package_database_plugin(p) or context.is_irods_catalog_provider_container(container)]
+
+    return refresh_and_install(make_strategy(platform_name, container, fast=fast), package_list, local=True)
+
+
+def copy_packages_to_containers(docker_client, docker_compose_containers, packages_list, compression=None):
+    """Stream local packages into every iRODS container at once, reading each package once.
+
+    The packages end up at the same paths inside the containers as on the host.
+
+    Arguments:
+    docker_client -- docker client for interacting with the containers
+    docker_compose_containers -- docker-compose containers into which the packages are copied
+    packages_list -- local paths of the packages to copy
+    compression -- compression used for the stream: 'gz', 'bz2', or 'xz' (default: none)
+    """
+    # Only the iRODS containers need to have packages installed
+    containers = [docker_client.containers.get(c.name) for c in docker_compose_containers
+                  if not context.is_catalog_database_container(c)]
+
+    logging.info('copying packages to containers [{}]'.format([c.name for c in containers]))
+
+    archive.put_archive_in_containers(containers, packages_list, compression=compression)
+
+
+def log_install_timings(timings):
+    """Log how long it took to install packages on each container.
+
+    Arguments:
+    timings -- dict of container names to the number of seconds until their install finished
+    """
+    logging.warning('install timings [{}]'.format(
+        ', '.join('{0}: {1:.1f}s'.format(name, seconds) for name, seconds in sorted(timings.items()))))
+
+
+# TODO: Want to make a more generic version of this
+@tracing.traced()
+def install_local_irods_packages(docker_client, platform_name, database_name, package_directory, containers, compression=None, fast=True, max_workers=None):
     import concurrent.futures
+    import time
 
-    package_name_list = ['irods-runtime', 'irods-icommands', 'irods-server', 'irods-database-plugin-{}'.format(database_name)]
+    package_name_list = irods_package_names(database_name)
 
     packages = get_list_of_package_paths(platform_name, package_directory, package_name_list)
 
     logging.info('packages to install [{}]'.format(packages))
 
-    # TODO: output directory should contain the tarfile of packages for archaeological purposes
-    tarfile_path = archive.create_archive(packages)
+    try:
+        copy_packages_to_containers(docker_client, containers, packages, compression=compression)
+
+    except Exception as e:
+        logging.error('exception raised while copying packages')
+        logging.error(e)
+        return 1
 
     rc = 0
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures_to_containers = {executor.submit(install_packages, docker_client, c, packages, tarfile_path, platform_name): c for c in containers}
+    timings = dict()
+    start_time = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures_to_containers = {executor.submit(install_local_packages_on_container, docker_client, c, packages, None, platform_name, fast): c for c in containers}
         logging.debug(futures_to_containers)
 
         for f in concurrent.futures.as_completed(futures_to_containers):
             container = futures_to_containers[f]
+            timings[container.name] = time.time() - start_time
             try:
                 ec = f.result()
                 if ec is not 0:
@@ -129,56 +387,100 @@ def install_local_irods_packages(docker_client, platform_name, database_name, pa
                 logging.error(e)
                 rc = 1
 
+    log_install_timings(timings)
+
     return rc
 
 
-def install_official_irods_packages(docker_client, platform_name, database_name, version, containers):
-    def install_packages(docker_client, docker_compose_container, packages_list, platform_name):
-        # Only the iRODS containers need to have packages installed
-        if context.is_catalog_database_container(docker_compose_container):
-            return 0
+def official_package_list(database_name, version=None):
+    """Return the official iRODS packages to install, pinned to `version` if provided.
+
+    Arguments:
+    database_name -- repo for the docker image of the database server (e.g. postgres)
+    version -- version of the official iRODS packages to install (default: latest)
+    """
+    package_name_list = irods_package_names(database_name)
+
+    # If a version is not provided, just install the latest
+    if version:
+        return ['{0}={1}'.format(p, version) for p in package_name_list]
+
+    return package_name_list
+
 
-        container = docker_client.containers.get(docker_compose_container.name)
+def install_official_packages_on_container(docker_client, docker_compose_container, packages_list, platform_name, fast=True):
+    """Install official packages from the package repositories into a single container.
+
+    Returns the exit code of the first failing step, or 0.
+
+    Arguments:
+    docker_client -- docker client for interacting with the container
+    docker_compose_container -- docker-compose container on which the packages are installed
+    packages_list -- names (and, optionally, versions) of the packages to install
+    platform_name -- repo for the docker image of the OS platform (e.g. ubuntu)
+    fast -- if True, refresh metadata only and install only the dependencies which are needed
+    """
+    # Only the iRODS containers need to have packages installed
+    if context.is_catalog_database_container(docker_compose_container):
+        return 0
 
-        package_list = ' '.join([p for p in packages_list if not is_package_database_plugin(p) or context.is_irods_catalog_provider_container(container)])
+    container = docker_client.containers.get(docker_compose_container.name)
 
-        cmd = ' '.join([platform_install_official_packages_command(platform_name), package_list])
+    package_list = [p for p in packages_list if not is_package_database_plugin(p) or context.is_irods_catalog_provider_container(container)]
 
-        logging.warning('executing cmd [{0}] on container [{1}]'.format(cmd, container.name))
+    return refresh_and_install(make_strategy(platform_name, container, fast=fast), package_list, local=False)
 
-        ec = execute.execute_command(container, platform_update_command(platform_name))
-        if ec is not 0:
-            logging.error('failed to update local repositories [{}]'.format(container.name))
-            return ec
 
-        ec = execute.execute_command(container, cmd)
-        if ec is not 0:
-            logging.error(
-                'failed to install packages on container [ec=[{0}], container=[{1}]'.format(ec, container.name))
+def install_packages_through_cache_on_container(docker_client, docker_compose_container, packages_list, platform_name, repository_path=None, fast=True):
+    """Install packages into a single container through the package cache (see package_cache.py).
 
-            return ec
+    The package manager is pointed at the package cache (and the local repository at
+    `repository_path`, if any) only for the install; its configuration is restored afterwards.
 
+    Returns the exit code of the first failing step, or 0.
+
+    Arguments:
+    docker_client -- docker client for interacting with the container
+    docker_compose_container -- docker-compose container on which the packages are installed
+    packages_list -- names (and, optionally, versions) of the packages to install
+    platform_name -- repo for the docker image of the OS platform (e.g. ubuntu)
+    repository_path -- URL path on the package cache of the local repository holding the packages
+    fast -- if True, refresh metadata only and install only the dependencies which are needed
+    """
+    # Only the iRODS containers need to have packages installed
+    if context.is_catalog_database_container(docker_compose_container):
         return 0
 
-    import concurrent.futures
+    container = docker_client.containers.get(docker_compose_container.name)
 
-    package_name_list = ['irods-runtime', 'irods-icommands', 'irods-server', 'irods-database-plugin-{}'.format(database_name)]
+    package_cache.configure_container(container, platform_name, repository_path=repository_path)
 
-    # If a version is not provided, just install the latest
-    if version:
-        packages = ['{0}={1}'.format(p, version) for p in package_name_list]
-    else:
-        packages = package_name_list
+    try:
+        return install_official_packages_on_container(docker_client, docker_compose_container, packages_list, platform_name, fast=fast)
+
+    finally:
+        package_cache.restore_container(container, platform_name)
+
+
+@tracing.traced()
+def install_official_irods_packages(docker_client, platform_name, database_name, version, containers, fast=True, max_workers=None):
+    import concurrent.futures
+    import time
+
+    packages = official_package_list(database_name, version)
 
     logging.info('packages to install [{}]'.format(packages))
 
     rc = 0
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures_to_containers = {executor.submit(install_packages, docker_client, c, packages, platform_name): c for c in containers}
+    timings = dict()
+    start_time = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures_to_containers = {executor.submit(install_official_packages_on_container, docker_client, c, packages, platform_name, fast): c for c in containers}
         logging.debug(futures_to_containers)
 
         for f in concurrent.futures.as_completed(futures_to_containers):
             container = futures_to_containers[f]
+            timings[container.name] = time.time() - start_time
             try:
                 ec = f.result()
                 if ec is not 0:
@@ -192,11 +494,14 @@ def install_official_irods_packages(docker_client, platform_name, database_name,
                 logging.error(e)
                 rc = 1
 
+    log_install_timings(timings)
+
     return rc
 
 
 if __name__ == "__main__":
     import argparse
+    import client_cache
     import logs
 
     parser = argparse.ArgumentParser(description='Install iRODS packages to a docker-compose project.')
@@ -212,6 +517,10 @@ if __name__ == "__main__":
                         help='The tag of the base Docker image to use.')
     parser.add_argument('--database-tag', '-d', metavar='DATABASE_IMAGE_TAG', dest='database', type=str,
                         help='The tag of the database container to use.')
+    parser.add_argument('--full-upgrade', dest='fast', action='store_false',
+                        help='If indicated, upgrade every package in the containers and install recommended packages instead of the minimal install.')
+    parser.add_argument('--compression', dest='compression', choices=['gz', 'bz2', 'xz'],
+                        help='Compress the stream of local packages sent to the containers (useful for remote docker hosts).')
     parser.add_argument('--verbose', '-v', dest='verbosity', action='count', default=1,
                         help='Increase the level of output to stdout. CRITICAL and ERROR messages will always be printed.')
 
@@ -254,21 +563,24 @@ if __name__ == "__main__":
     if args.package_directory:
         exit(
             install_local_irods_packages(
-                docker.from_env(),
+                client_cache.shared_client(),
                 context.image_repo(platform),
                 context.image_repo(database),
                 os.path.abspath(args.package_directory),
-                p.containers()
+                p.containers(),
+                compression=args.compression,
+                fast=args.fast
             )
         )
 
     # Even if no version was provided, we default to using the latest official release
     exit(
         install_official_irods_packages(
-            docker.from_env(),
+            client_cache.shared_client(),
             context.image_repo(platform),
             context.image_repo(database),
             args.package_version,
-            p.containers()
+            p.containers(),
+            fast=args.fast
         )
     )
@@ -1,14 +1,19 @@
 # grown-up modules
 import compose
+import copy
 import docker
+import json
 import logging
 import os
 
 # local modules
+import archive
 import context
 import database_setup
-import odbc_setup
 import execute
+import odbc_setup
+import readiness
+import tracing
 
 class setup_input_builder(object):
     """Builder for iRODS setup script inputs.
@@ -26,6 +31,7 @@ class setup_input_builder(object):
         self.service_account_group = ''
         self.catalog_service_role = ''
 
+        self.database_type = 'postgres'
         self.odbc_driver = ''
         self.database_server_hostname = 'localhost'
         self.database_server_port = 5432
@@ -50,6 +56,7 @@ class setup_input_builder(object):
         self.vault_directory = ''
 
         self.catalog_service_provider_host = 'localhost'
+        self.server_hostname = 'localhost'
 
     def service_account(self,
                         service_account_name='',
@@ -72,6 +79,7 @@ class setup_input_builder(object):
 
 
     def database_connection(self,
+                            database_type='postgres',
                             odbc_driver='',
                             database_server_hostname='localhost',
                             database_server_port=5432,
@@ -84,6 +92,7 @@ class setup_input_builder(object):
         Returns this instance of the class.
 
         Arguments:
+        database_type -- kind of database server holding the catalog (postgres or mysql)
         odbc_driver -- driver on the server used to talk to the ODBC database layer
         database_server_hostname -- hostname for the database server
         database_server_port -- port on which database server listens for notifications from
@@ -93,6 +102,7 @@ class setup_input_builder(object):
         database_password -- password for the database user
         stored_passwords_salt -- obfuscates the passwords stored in the database
         """
+        self.database_type = database_type
         self.odbc_driver = odbc_driver
         self.database_server_hostname = database_server_hostname
         self.database_server_port = database_server_port
@@ -112,7 +122,8 @@ class setup_input_builder(object):
                        parallel_port_range_end=20199,
                        control_plane_port=1248,
                        schema_validation_base_uri='',
-                       admin_username='rods'):
+                       admin_username='rods',
+                       server_hostname='localhost'):
         """Set values for the server options section of the setup script.
 
         Returns this instance of the class.
@@ -129,6 +140,7 @@ class setup_input_builder(object):
         schema_validation_base_uri -- location of the schema files used to validate the server's
                                       configuration files
         admin_username -- name of the iRODS administration account
+        server_hostname -- hostname of the server being set up, by which it refers to itself
         """
         self.zone_name = zone_name
         self.catalog_service_provider_host = catalog_service_provider_host
@@ -138,6 +150,7 @@ class setup_input_builder(object):
         self.control_plane_port = control_plane_port
         self.schema_validation_base_uri = schema_validation_base_uri
         self.admin_username = admin_username
+        self.server_hostname = server_hostname
 
         return self
 
@@ -248,12 +261,159 @@ class setup_input_builder(object):
             '' # final confirmation
         ])
 
+    def build_server_config(self, server_config_template):
+        """Generate the contents of server_config.json for the unattended configuration.
+
+        The server's own template supplies the layout and schema version. Only the settings
+        which the template names are filled in, so settings which a release has dropped (e.g.
+        the control plane) are left out rather than rejected by the schema.
+
+        Arguments:
+        server_config_template -- dict parsed from the server_config.json template shipped
+                                  with the server being set up
+        """
+        server_config = copy.deepcopy(server_config_template)
+
+        if self.catalog_service_role == 'provider':
+            catalog_provider_hosts = [self.server_hostname]
+        else:
+            catalog_provider_hosts = [self.catalog_service_provider_host]
+
+        settings = {
+            'catalog_provider_hosts': catalog_provider_hosts,
+            'catalog_service_role': self.catalog_service_role,
+            'negotiation_key': self.negotiation_key,
+            'server_control_plane_key': self.control_plane_key,
+            'server_control_plane_port': self.control_plane_port,
+            'server_port_range_end': self.parallel_port_range_end,
+            'server_port_range_start': self.parallel_port_range_begin,
+            'zone_key': self.zone_key,
+            'zone_name': self.zone_name,
+            'zone_port': self.zone_port,
+            'zone_user': self.admin_username
+        }
+
+        if self.schema_validation_base_uri:
+            settings['schema_validation_base_uri'] = self.schema_validation_base_uri
+
+        for key, value in settings.items():
+            if key in server_config:
+                server_config[key] = value
+
+        if self.catalog_service_role == 'provider':
+            plugin_configuration = server_config.setdefault('plugin_configuration', {})
+            plugin_configuration.setdefault('database', {})[self.database_type] = {
+                'db_host': self.database_server_hostname,
+                'db_name': self.database_name,
+                'db_odbc_driver': self.odbc_driver,
+                'db_password': self.database_password,
+                'db_port': self.database_server_port,
+                'db_username': self.database_username
+            }
+
+        return server_config
+
+    def build_service_account_environment(self, server_config):
+        """Generate the contents of the service account's irods_environment.json for the unattended configuration.
+
+        Arguments:
+        server_config -- dict built by build_server_config, whose schema version and control
+                         plane settings the environment follows
+        """
+        home = '/{0}/home/{1}'.format(self.zone_name, self.admin_username)
+
+        environment = {
+            'irods_client_server_negotiation': 'request_server_negotiation',
+            'irods_client_server_policy': 'CS_NEG_REFUSE',
+            'irods_connection_pool_refresh_time_in_seconds': 300,
+            'irods_cwd': home,
+            'irods_default_hash_scheme': 'SHA256',
+            'irods_default_number_of_transfer_threads': 4,
+            'irods_default_resource': 'demoResc',
+            'irods_encryption_algorithm': 'AES-256-CBC',
+            'irods_encryption_key_size': 32,
+            'irods_encryption_num_hash_rounds': 16,
+            'irods_encryption_salt_size': 8,
+            'irods_home': home,
+            'irods_host': self.server_hostname,
+            'irods_match_hash_policy': 'compatible',
+            'irods_maximum_size_for_single_buffer_in_megabytes': 32,
+            'irods_port': self.zone_port,
+            'irods_transfer_buffer_size_for_parallel_transfer_in_megabytes': 4,
+            'irods_user_name': self.admin_username,
+            'irods_zone_name': self.zone_name,
+            'schema_name': 'service_account_environment',
+            'schema_version': server_config['schema_version']
+        }
+
+        if 'server_control_plane_port' in server_config:
+            environment.update({
+                'irods_server_control_plane_encryption_algorithm': 'AES-256-CBC',
+                'irods_server_control_plane_encryption_num_hash_rounds': 16,
+                'irods_server_control_plane_key': self.control_plane_key,
+                'irods_server_control_plane_port': self.control_plane_port
+            })
+
+        return environment
+
+    def build_unattended_configuration(self, server_config_template):
+        """Build the document for setting up the server with setup_irods.py --json_configuration_file.
+
+        The document holds the complete server configuration rather than answers to prompts, so
+        it does not depend on the order in which the setup script asks its questions. It is
+        built from the server_config.json template of the server being set up (see
+        server_config_template), so it follows the layout and schema version of that release.
+        Values left empty are given the defaults which the setup script would have offered,
+        except for the ODBC driver, which must be set for a catalog service provider.
+
+        Arguments:
+        server_config_template -- dict parsed from the server_config.json template shipped
+                                  with the server being set up
+        """
+        if self.catalog_service_role not in ['provider', 'consumer']:
+            raise NotImplementedError('unsupported catalog service role [{}]'.format(self.catalog_service_role))
+
+        if self.catalog_service_role == 'provider' and not self.odbc_driver:
+            raise ValueError('an ODBC driver is required to set up a catalog service provider')
+
+        # Consumers get a resource of their own, named as the setup script would name it
+        if self.catalog_service_role == 'consumer':
+            default_resource_name = '{}Resource'.format(self.server_hostname.split('.')[0])
+        else:
+            default_resource_name = 'demoResc'
+
+        server_config = self.build_server_config(server_config_template)
+        schema_version = server_config['schema_version']
+
+        return {
+            'admin_password': self.admin_password,
+            'default_resource_directory': self.vault_directory or os.path.join(context.irods_home(), 'Vault'),
+            'default_resource_name': default_resource_name,
+            'host_access_control_config': {
+                'access_entries': [],
+                'schema_name': 'host_access_control_config',
+                'schema_version': schema_version
+            },
+            'host_system_information': {
+                'service_account_user_name': self.service_account_name or 'irods',
+                'service_account_group_name': self.service_account_group or 'irods'
+            },
+            'hosts_config': {
+                'host_entries': [],
+                'schema_name': 'hosts_config',
+                'schema_version': schema_version
+            },
+            'server_config': server_config,
+            'service_account_environment': self.build_service_account_environment(server_config)
+        }
+
     def build(self):
         """Build the string for the setup script input.
 
         Depending on the way the inputs were provided, either an iRODS catalog service provider
         or a catalog service consumer will be set up and the resulting input string will be
-        returned.
+        returned. This is only used for servers which do not ship a server_config.json template
+        (see setup_irods_server); newer servers are set up from build_unattended_configuration.
         """
         build_for_role = {
             'provider': self.build_input_for_catalog_provider,
@@ -267,8 +427,117 @@ class setup_input_builder(object):
             raise NotImplementedError('unsupported catalog service role [{}]'.format(self.catalog_service_role))
 
 
+def unattended_configuration_path():
+    """Return the path in each iRODS container of the document applied by setup_irods_server."""
+    return os.path.join('/', 'unattended_installation.json')
+
+
+def server_config_template_path():
+    """Return the path in each iRODS container of the server_config.json template shipped with the server."""
+    return os.path.join(context.irods_home(), 'packaging', 'server_config.json.template')
+
+
+def parse_server_config_template(ec, output, container_name):
+    """Return the server_config.json template read from a container, or None if there is none.
+
+    Arguments:
+    ec -- exit code of the command which read the template
+    output -- bytes written by the command which read the template
+    container_name -- name of the container from which the template was read
+    """
+    if ec != 0:
+        logging.info('no server_config.json template, answering setup prompts [{}]'.format(container_name))
+        return None
+
+    return json.loads(output.decode('utf-8'))
+
+
+def server_config_template(container):
+    """Return the server_config.json template shipped with the iRODS server in `container`, or None.
+
+    Arguments:
+    container -- docker.client.container on which the iRODS packages are installed
+    """
+    result = container.exec_run(['cat', server_config_template_path()])
+
+    return parse_server_config_template(result.exit_code, result.output, container.name)
+
+
+def server_config_path():
+    """Return the path in each iRODS container of the configuration of the set up server."""
+    return os.path.join('/etc', 'irods', 'server_config.json')
+
+
+def parse_zone_port(ec, output, container_name):
+    """Return the zone port read from the server_config.json of a set up server.
+
+    Arguments:
+    ec -- exit code of the command which read server_config.json
+    output -- bytes written by the command which read server_config.json
+    container_name -- name of the container from which server_config.json was read
+    """
+    if ec != 0:
+        raise RuntimeError('failed to read server configuration [ec=[{0}], container=[{1}]]'
+                           .format(ec, container_name))
+
+    return json.loads(output.decode('utf-8'))['zone_port']
+
+
+def configured_zone_port(container):
+    """Return the port on which the iRODS server in `container` was set up to listen.
+
+    Arguments:
+    container -- docker.client.container on which the iRODS server is set up
+    """
+    result = container.exec_run(['cat', server_config_path()])
+
+    return parse_zone_port(result.exit_code, result.output, container.name)
+
+
 def setup_irods_server(container, setup_input):
-    """Set up iRODS server on the given container with the provided input.
+    """Set up iRODS server on the given container with the provided setup input.
+
+    Servers which ship a server_config.json template are set up without prompts: the
+    unattended configuration is built from that template, copied into the container, and
+    applied by the setup script in a single step. The setup script starts the server when it
+    is done, so the server is only started here if it is not already serving on its zone port.
+    Older servers are set up by answering the prompts of the setup script instead (see
+    setup_irods_server_from_prompts).
+
+    Arguments:
+    container -- docker.client.container on which the iRODS packages are installed
+    setup_input -- setup_input_builder holding the values with which the server is set up
+    """
+    template = server_config_template(container)
+    if template is None:
+        setup_irods_server_from_prompts(container, setup_input.build())
+        return
+
+    configuration = setup_input.build_unattended_configuration(template)
+
+    logging.debug('unattended configuration [{}]'.format(configuration))
+
+    path = unattended_configuration_path()
+
+    archive.write_file_to_container(container, path, json.dumps(configuration, indent=4, sort_keys=True).encode('utf-8'))
+
+    path_to_setup_script = os.path.join(context.irods_home(), 'scripts', 'setup_irods.py')
+    ec = execute.execute_command(container, ['python', path_to_setup_script, '--json_configuration_file={}'.format(path)])
+    if ec != 0:
+        raise RuntimeError('failed to set up iRODS server [ec=[{0}], container=[{1}]]'.format(ec, container.name))
+
+    if readiness.port_is_open(container, 'localhost', configuration['server_config']['zone_port']):
+        return
+
+    irodsctl = os.path.join(context.irods_home(), 'irodsctl')
+    ec = execute.execute_command(container, '{} start'.format(irodsctl), user='irods')
+    if ec != 0:
+        raise RuntimeError('failed to start iRODS server after setup [ec=[{0}], container=[{1}]]'
+                           .format(ec, container.name))
+
+
+def setup_irods_server_from_prompts(container, setup_input):
+    """Set up iRODS server on the given container by answering the prompts of the setup script.
 
     After setup completes, the server is restarted in order to guarantee that the iRODS server
     is running and available for immediate use after setting it up.
@@ -277,24 +546,70 @@ def setup_irods_server(container, setup_input):
     container -- docker.client.container on which the iRODS packages are installed
     setup_input -- string which will be provided as input to the iRODS setup script
     """
-    ec = execute.execute_command(container, 'bash -c \'echo "{}" > /input\''.format(setup_input))
-    if ec is not 0:
-        raise RuntimeError('failed to create setup script input file [{}]'.format(container.name))
+    logging.debug('input to setup script [{}]'.format(setup_input))
 
-    execute.execute_command(container, 'cat /input')
+    ec = execute.execute_command(container, 'bash -c \'echo "{}" > /input\''.format(setup_input))
+    if ec != 0:
+        raise RuntimeError('failed to create setup script input file [ec=[{0}], container=[{1}]]'
+                           .format(ec, container.name))
 
     path_to_setup_script = os.path.join(context.irods_home(), 'scripts', 'setup_irods.py')
     run_setup_script = 'bash -c \'python {0} < /input\''.format(path_to_setup_script)
     ec = execute.execute_command(container, run_setup_script)
-    if ec is not 0:
-        raise RuntimeError('failed to set up iRODS server [{}]'.format(container.name))
+    if ec != 0:
+        raise RuntimeError('failed to set up iRODS server [ec=[{0}], container=[{1}]]'.format(ec, container.name))
 
     irodsctl = os.path.join(context.irods_home(), 'irodsctl')
     ec = execute.execute_command(container, '{} restart'.format(irodsctl), user='irods')
-    if ec is not 0:
-        raise RuntimeError('failed to start iRODS server after setup [{}]'.format(container.name))
+    if ec != 0:
+        raise RuntimeError('failed to start iRODS server after setup [ec=[{0}], container=[{1}]]'
+                           .format(ec, container.name))
+
+
+def start_irods_server(container, timeout=120, interval=2):
+    """Start the iRODS server in `container` and wait until it accepts connections.
+
+    The server cannot start until its catalog (or catalog service provider) is reachable, so
+    failures are retried with backoff until `timeout` expires.
+
+    Arguments:
+    container -- docker container with iRODS installed and set up
+    timeout -- seconds after which to give up on starting the server
+    interval -- seconds to wait after the first failed attempt
+    """
+    irodsctl = os.path.join(context.irods_home(), 'irodsctl')
+
+    readiness.wait_until(lambda: execute.execute_command(container, '{} start'.format(irodsctl), user='irods') == 0,
+                         'iRODS server to start [{}]'.format(container.name),
+                         timeout,
+                         initial_interval=interval)
 
+    readiness.wait_for_irods_server(container, phase=server_phase(container))
 
+
+def server_phase(container):
+    """Return the readiness phase for the iRODS server in `container`: provider or consumer.
+
+    Arguments:
+    container -- docker container running an iRODS server
+    """
+    return 'provider' if context.is_irods_catalog_provider_container(container) else 'consumer'
+
+
+def stop_irods_server(container):
+    """Stop the iRODS server in `container`.
+
+    Arguments:
+    container -- docker container with iRODS installed and set up
+    """
+    irodsctl = os.path.join(context.irods_home(), 'irodsctl')
+    ec = execute.execute_command(container, '{} stop'.format(irodsctl), user='irods')
+    if ec != 0:
+        raise RuntimeError('failed to stop iRODS server [ec=[{0}], container=[{1}]]'
+                           .format(ec, container.name))
+
+
+@tracing.traced()
 def setup_irods_catalog_provider(docker_client,
                                  compose_project,
                                  platform_image,
@@ -332,19 +647,22 @@ def setup_irods_catalog_provider(docker_client,
     setup_input = (setup_input_builder()
         .service_account(catalog_service_role='provider')
         .database_connection(
+            database_type=context.image_repo(database_image),
+            odbc_driver=odbc_setup.registered_odbc_driver(csp_container, database_image),
             database_server_hostname=context.container_hostname(db_container),
             database_server_port=database_setup.database_server_port(database_image)
         )
-        .build()
+        .server_options(server_hostname=context.container_hostname(csp_container))
     )
 
-    logging.debug('input to setup script [{}]'.format(setup_input))
-
     logging.warning('setting up iRODS catalog provider [{}]'.format(csp_container.name))
 
     setup_irods_server(csp_container, setup_input)
 
+    readiness.wait_for_irods_server(csp_container, phase='provider')
 
+
+@tracing.traced()
 def setup_irods_catalog_consumer(docker_client,
                                  compose_project,
                                  platform_image,
@@ -369,30 +687,38 @@ def setup_irods_catalog_consumer(docker_client,
         )
     )
 
-    setup_input = (setup_input_builder()
-        .service_account(catalog_service_role='consumer')
-        .server_options(catalog_service_provider_host=context.container_hostname(csp_container))
-        .build()
-    )
-
-    logging.debug('input to setup script [{}]'.format(setup_input))
-
     csc_container = docker_client.containers.get(
         context.irods_catalog_consumer_container(
             compose_project.name, consumer_service_instance
         )
     )
 
+    # The consumer joins the zone on the port the provider was set up with
+    zone_port = configured_zone_port(csp_container)
+
+    setup_input = (setup_input_builder()
+        .service_account(catalog_service_role='consumer')
+        .server_options(catalog_service_provider_host=context.container_hostname(csp_container),
+                        zone_port=zone_port,
+                        server_hostname=context.container_hostname(csc_container))
+    )
+
+    # Setting up a consumer fails unless it can reach the provider
+    readiness.wait_for_port(csc_container, context.container_hostname(csp_container), zone_port, 'consumer')
+
     logging.warning('setting up iRODS catalog consumer [{}]'.format(csc_container.name))
 
     setup_irods_server(csc_container, setup_input)
 
+    readiness.wait_for_irods_server(csc_container, phase='consumer')
+
 def setup_irods_catalog_consumers(docker_client,
                                   compose_project,
                                   platform_image,
                                   database_image,
                                   provider_service_instance=1,
-                                  consumer_service_instances=None):
+                                  consumer_service_instances=None,
+                                  max_workers=None):
     """Set up all iRODS catalog service consumers in a docker-compose project in parallel.
 
     Arguments:
@@ -406,6 +732,8 @@ def setup_irods_catalog_consumers(docker_client,
                                   to run the iRODS catalog service consumer (if None, all
                                   containers with the iRODS catalog service consumer service
                                   name in the docker project will be targeted)
+    max_workers -- maximum number of consumers to set up at the same time (default: determined
+                   by concurrent.futures)
     """
     import concurrent.futures
 
@@ -420,7 +748,7 @@ def setup_irods_catalog_consumers(docker_client,
 
     rc = 0
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
         futures_to_containers = {
             executor.submit(
                 setup_irods_catalog_consumer,
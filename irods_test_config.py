@@ -7,103 +7,176 @@ import os
 # local modules
 import context
 import execute
+import tracing
 
 def reconnect_with_alias(container, network, alias):
     network.disconnect(container)
     network.connect(container, aliases=[alias])
 
 
-def set_hostnames_for_irods(docker_client, compose_project):
+def test_hostname_alias(container):
+    """Return the hostname by which the iRODS tests expect to reach `container`.
+
+    Arguments:
+    container -- docker container running an iRODS server
+    """
+    if context.is_irods_catalog_provider_container(container):
+        return 'icat.example.org'
+
+    return 'resource{}.example.org'.format(context.service_instance(container.name))
+
+
+def add_alias_to_hosts_file(container, alias):
+    """Append `alias` to the last line of the /etc/hosts file in `container`.
+
+    Arguments:
+    container -- docker container whose /etc/hosts file is modified
+    alias -- hostname to add as an alias for the container
+    """
+    hosts_file = os.path.join('/etc', 'hosts')
+
+    # TODO: need to have each container recognize itself as `alias`
+    # TODO: use /etc/irods/hosts_config.json!!
+    # this does not work because the docker daemon is controlling the /etc/hosts file
+    add_to_hosts_file = 'sed -i \'${{s/$/\\t{}/}}\' {}'.format(alias, hosts_file)
+    if execute.execute_command(container, add_to_hosts_file) is not 0:
+        raise RuntimeError('failed to add hostname [{}]'.format(container.name))
+
+
+def project_network(docker_client, compose_project):
+    """Return the docker network used by the services in `compose_project`.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker-compose project
+    compose_project -- compose.Project in which the iRODS servers are running
+    """
     # Assuming only the default network is in use for all services
     network_name = list(compose_project.services[0].networks.keys())[0]
-    network = docker_client.networks.get(
+    return docker_client.networks.get(
         list(n.id for n in docker_client.networks.list() if n.name == network_name)[0])
 
-    hosts_file = os.path.join('/etc', 'hosts')
 
-    # TODO: PARALLEL
-    containers = compose_project.containers(service_names=[
-        context.irods_catalog_provider_service(),
-        context.irods_catalog_consumer_service()])
-    for c in containers:
-        container = docker_client.containers.get(c.name)
+def set_hostname_for_irods(container, network):
+    """Make `container` reachable by the hostname which the iRODS tests expect for it.
 
-        if context.is_irods_catalog_provider_container(container):
-            alias = 'icat.example.org'
-        else:
-            alias = 'resource{}.example.org'.format(context.service_instance(c.name))
+    Arguments:
+    container -- docker container running an iRODS server
+    network -- docker network in which the alias is registered
+    """
+    alias = test_hostname_alias(container)
+
+    add_alias_to_hosts_file(container, alias)
 
-        # TODO: need to have each container recognize itself as `alias`
-        # TODO: use /etc/irods/hosts_config.json!!
-        # this does not work because the docker daemon is controlling the /etc/hosts file
-        add_to_hosts_file = 'sed -i \'${{s/$/\\t{}/}}\' {}'.format(alias, hosts_file)
-        if execute.execute_command(container, add_to_hosts_file) is not 0:
-            raise RuntimeError('failed to add hostname [{}]'.format(c.name))
+    reconnect_with_alias(container, network, alias)
 
-        reconnect_with_alias(container, network, alias)
 
-def configure_univmss_script(docker_client, compose_project):
-    """Configure UnivMSS script for iRODS tests.
+def set_hostnames_for_irods(docker_client, compose_project, max_workers=None):
+    """Set the hostnames expected by the iRODS tests on every iRODS server concurrently.
 
     Arguments:
     docker_client -- docker client for interacting with the docker-compose project
     compose_project -- compose.Project in which the iRODS servers are running
+    max_workers -- maximum number of containers to configure at the same time
+    """
+    network = project_network(docker_client, compose_project)
+
+    containers = [docker_client.containers.get(c.name) for c in compose_project.containers(
+        service_names=[context.irods_catalog_provider_service(),
+                       context.irods_catalog_consumer_service()])]
+
+    rc = execute.for_each_container(lambda c: set_hostname_for_irods(c, network),
+                                    containers,
+                                    max_workers=max_workers)
+    if rc != 0:
+        raise RuntimeError('failed to set hostnames on one or more containers')
+
+
+def configure_univmss_script_on_container(container):
+    """Configure UnivMSS script for iRODS tests on a single container.
+
+    All of the steps are run in a single exec to save round trips to the docker daemon.
+
+    Arguments:
+    container -- docker container running an iRODS server
     """
-    # TODO: PARALLEL
     univmss_script = os.path.join(context.irods_home(),
                                   'msiExecCmd_bin',
                                   'univMSSInterface.sh')
-    chown_msiexec = 'chown irods:irods {}'.format(os.path.dirname(univmss_script))
-    copy_from_template = 'cp {0}.template {0}'.format(univmss_script)
-    remove_template_from_commands = 'sed -i \"s/template-//g\" {}'.format(univmss_script)
-    make_script_executable = 'chmod 544 {}'.format(univmss_script)
-
-    containers = compose_project.containers(service_names=[
-        context.irods_catalog_provider_service(),
-        context.irods_catalog_consumer_service()])
-
-    for c in containers:
-        on_container = docker_client.containers.get(c.name)
-        if execute.execute_command(on_container,
-                                   chown_msiexec) is not 0:
-            raise RuntimeError('failed to change ownership to msiExecCmd_bin [{}]'
-                               .format(c.name))
-
-        if execute.execute_command(on_container,
-                                   copy_from_template,
-                                   user='irods',
-                                   workdir=context.irods_home()) is not 0:
-            raise RuntimeError('failed to copy univMSSInterface.sh template file [{}]'
-                               .format(c.name))
-
-        if execute.execute_command(on_container,
-                                   remove_template_from_commands,
-                                   user='irods',
-                                   workdir=context.irods_home()) is not 0:
-            raise RuntimeError('failed to modify univMSSInterface.sh template file [{}]'
-                               .format(c.name))
-
-        if execute.execute_command(on_container,
-                                   make_script_executable,
-                                   user='irods',
-                                   workdir=context.irods_home()) is not 0:
-            raise RuntimeError('failed to change permissions on univMSSInterface.sh [{}]'
-                               .format(c.name))
-
-
-def configure_irods_testing(docker_client, compose_project):
+
+    # The paths are passed as positional parameters to avoid quoting them
+    script = ('chown irods:irods "$1" && '
+              'cp "$2.template" "$2" && '
+              'sed -i "s/template-//g" "$2" && '
+              'chmod 544 "$2" && '
+              'chown irods:irods "$2"')
+    cmd = ['bash', '-c', script, 'bash', os.path.dirname(univmss_script), univmss_script]
+
+    ec = execute.execute_command(container, cmd)
+    if ec != 0:
+        raise RuntimeError('failed to configure univMSSInterface.sh [ec=[{0}], container=[{1}]]'
+                           .format(ec, container.name))
+
+
+def configure_univmss_script(docker_client, compose_project, max_workers=None):
+    """Configure UnivMSS script for iRODS tests on every iRODS server concurrently.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker-compose project
+    compose_project -- compose.Project in which the iRODS servers are running
+    max_workers -- maximum number of containers to configure at the same time
+    """
+    containers = [docker_client.containers.get(c.name) for c in compose_project.containers(
+        service_names=[context.irods_catalog_provider_service(),
+                       context.irods_catalog_consumer_service()])]
+
+    rc = execute.for_each_container(configure_univmss_script_on_container,
+                                    containers,
+                                    max_workers=max_workers)
+    if rc != 0:
+        raise RuntimeError('failed to configure univMSSInterface.sh on one or more containers')
+
+
+@tracing.traced()
+def configure_container_for_testing(container, network):
+    """Run the prerequisite configuration steps for iRODS tests on a single container.
+
+    Arguments:
+    container -- docker container running an iRODS server
+    network -- docker network in which the container's test hostname is registered
+    """
+    set_hostname_for_irods(container, network)
+
+    configure_univmss_script_on_container(container)
+
+
+@tracing.traced()
+def configure_irods_testing(docker_client, compose_project, max_workers=None):
     """Run a series of prerequisite configuration steps for iRODS tests.
 
+    Each container runs through all of the steps independently of the others, so the time
+    taken follows the slowest container rather than the sum of all of them.
+
     Arguments:
     docker_client -- docker client for interacting with the docker-compose project
     compose_project -- compose.Project in which the iRODS servers are running
+    max_workers -- maximum number of containers to configure at the same time
     """
-    set_hostnames_for_irods(docker_client, compose_project)
+    network = project_network(docker_client, compose_project)
+
+    containers = [docker_client.containers.get(c.name) for c in compose_project.containers(
+        service_names=[context.irods_catalog_provider_service(),
+                       context.irods_catalog_consumer_service()])]
+
+    rc = execute.for_each_container(lambda c: configure_container_for_testing(c, network),
+                                    containers,
+                                    max_workers=max_workers)
+    if rc != 0:
+        raise RuntimeError('failed to configure one or more containers for testing')
 
-    configure_univmss_script(docker_client, compose_project)
 
 if __name__ == "__main__":
     import argparse
+    import client_cache
     import logs
 
     parser = argparse.ArgumentParser(description='Run iRODS tests in a consistent environment.')
@@ -115,12 +188,14 @@ if __name__ == "__main__":
                         help='The repo:tag of the OS platform image to use')
     parser.add_argument('--database-image', '-d', metavar='DATABASE_IMAGE_REPO_AND_TAG', dest='database', type=str,
                         help='The repo:tag of the database image to use')
+    parser.add_argument('--max-workers', metavar='MAX_WORKERS', dest='max_workers', type=int,
+                        help='Maximum number of containers to configure at the same time. (Default: all of them)')
     parser.add_argument('--verbose', '-v', dest='verbosity', action='count', default=1,
                         help='Increase the level of output to stdout. CRITICAL and ERROR messages will always be printed.')
 
     args = parser.parse_args()
 
-    docker_client = docker.from_env()
+    docker_client = client_cache.shared_client()
 
     compose_project = compose.cli.command.get_project(os.path.abspath(args.project_directory),
                                                       project_name=args.project_name)
@@ -145,7 +220,7 @@ if __name__ == "__main__":
         logging.debug('derived database image tag [{}]'.format(database))
 
     try:
-        configure_irods_testing(docker_client, compose_project)
+        configure_irods_testing(docker_client, compose_project, args.max_workers)
 
     except Exception as e:
         logging.critical(e)
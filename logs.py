@@ -5,6 +5,8 @@ import os
 
 # local modules
 import context
+import execute
+import tracing
 
 # TODO: Maybe this should be some kind of builder
 def configure(verbosity=1, log_filename=None):
@@ -22,29 +24,395 @@ def configure(verbosity=1, log_filename=None):
         handlers = handlers
     )
 
-def collect_logs(docker_client, containers, output_directory, logfile_path=None):
+def list_log_files(container, logfile_path):
+    """Return a list of (inode, size, path) for every regular file under `logfile_path` in the container.
+
+    Arguments:
+    container -- docker container in which the log files are found
+    logfile_path -- path inside the container to the directory holding the log files
+    """
+    result = container.exec_run(['find', logfile_path, '-type', 'f', '-printf', '%i %s %p\\n'])
+    if result.exit_code != 0:
+        raise RuntimeError('failed to list log files [ec=[{0}], container=[{1}]]'
+                           .format(result.exit_code, container.name))
+
+    files = list()
+    for line in result.output.decode('utf-8').splitlines():
+        inode, size, path = line.split(' ', 2)
+        files.append((int(inode), int(size), path))
+
+    return sorted(files, key=lambda f: f[2])
+
+
+def stream_file_range(container, path, offset, length):
+    """Yield the chunks of `length` bytes of the file at `path` starting at `offset`.
+
+    A RuntimeError is raised once the chunks are exhausted if the file could not be read.
+
+    Arguments:
+    container -- docker container in which the file is found
+    path -- path inside the container to the file
+    offset -- number of bytes at the beginning of the file to skip
+    length -- number of bytes to read
+    """
+    # tail is killed by SIGPIPE (141) when head has read enough of a file which is still growing
+    script = ('tail -c +"$1" "$2" 2>/dev/null | head -c "$3"; s=("${PIPESTATUS[@]}"); '
+              'if [ "${s[0]}" -ne 0 ] && [ "${s[0]}" -ne 141 ]; then exit "${s[0]}"; fi; exit "${s[1]}"')
+    cmd = ['bash', '-c', script, 'bash', str(offset + 1), path, str(length)]
+
+    exec_instance = container.client.api.exec_create(container.id, cmd)
+
+    for chunk in container.client.api.exec_start(exec_instance['Id'], stream=True):
+        yield chunk
+
+    ec = container.client.api.exec_inspect(exec_instance['Id'])['ExitCode']
+    if ec != 0:
+        raise RuntimeError('failed to read log file [ec=[{0}], container=[{1}], path=[{2}]]'
+                           .format(ec, container.name, path))
+
+
+def collect_log_files(container, output_directory, logfile_path, incremental=False, max_bytes=None):
+    """Copy each log file in the container into a gzip file of the same name under `output_directory`.
+
+    In incremental mode, only what was added to each file since the last collection is copied
+    and appended to the gzip file as a new member (gzip readers read all of the members as one
+    stream). A file whose inode changed or which shrank (i.e. it was rotated or truncated) is
+    copied from the beginning again.
+
+    If more than `max_bytes` are to be copied from the container, only the ends of the files
+    are copied and a line saying how many bytes were skipped is written in place of the rest.
+
+    Files which cannot be read are logged and copied again from the same offset next time; a
+    RuntimeError is raised after the other files have been copied.
+
+    Returns the number of bytes copied.
+
+    Arguments:
+    container -- docker container from which the log files are copied
+    output_directory -- local directory for the log files of this container
+    logfile_path -- path inside the container to the directory holding the log files
+    incremental -- if True, copy only what was added since the last collection
+    max_bytes -- maximum number of bytes to copy from the container (default: no limit)
+    """
+    import gzip
+    import json
+
+    offsets_path = os.path.join(output_directory, '.offsets.json')
+
+    offsets = dict()
+    if incremental and os.path.exists(offsets_path):
+        with open(offsets_path, 'r') as f:
+            offsets = json.load(f)
+
+    remaining = max_bytes
+    copied = 0
+    failed = list()
+
+    for inode, size, path in list_log_files(container, logfile_path):
+        previous_inode, offset = offsets.get(path, (None, 0))
+        if previous_inode != inode or offset > size:
+            offset = 0
+
+        length = size - offset
+        if length == 0:
+            continue
+
+        skipped = 0
+        if remaining is not None and length > remaining:
+            skipped = length - remaining
+            offset += skipped
+            length = remaining
+
+        local_path = os.path.join(output_directory, os.path.relpath(path, logfile_path) + '.gz')
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+
+        with gzip.open(local_path, 'ab') as f:
+            if skipped:
+                logging.warning('log exceeds size cap, skipping [{0}] bytes [{1}] [{2}]'
+                                .format(skipped, path, container.name))
+                f.write('\n[irods_test: skipped {} bytes]\n'.format(skipped).encode('utf-8'))
+
+            try:
+                for chunk in stream_file_range(container, path, offset, length):
+                    f.write(chunk)
+
+            except RuntimeError as e:
+                logging.error(e)
+                failed.append(path)
+                continue
+
+        offsets[path] = (inode, offset + length)
+        copied += length
+
+        if remaining is not None:
+            remaining -= length
+
+    if incremental:
+        with open(offsets_path, 'w') as f:
+            json.dump(offsets, f)
+
+    if failed:
+        raise RuntimeError('failed to copy log files [count=[{0}], container=[{1}]]'
+                           .format(len(failed), container.name))
+
+    return copied
+
+
+def collect_log_archive(container, output_path, logfile_path):
+    """Stream the directory holding the log files out of the container into a gzipped tar file.
+
+    Arguments:
+    container -- docker container from which the log files are copied
+    output_path -- local path to the gzipped tar file
+    logfile_path -- path inside the container to the directory holding the log files
+    """
+    import gzip
+
+    bits, _ = container.get_archive(logfile_path)
+
+    with gzip.open(output_path, 'wb', compresslevel=6) as f:
+        for chunk in bits:
+            f.write(chunk)
+
+
+@tracing.traced()
+def collect_logs(docker_client,
+                 containers,
+                 output_directory,
+                 logfile_path=None,
+                 incremental=False,
+                 max_bytes=None,
+                 max_workers=None):
+    """Copy the iRODS server logs out of every iRODS container at the same time.
+
+    Returns the number of containers whose logs could not be collected; failures are logged
+    rather than raised so that one container cannot hide the logs of the others.
+
+    By default, the log directory of each container is streamed into `<container>.tar.gz`
+    under `output_directory`/logs. With `incremental` or `max_bytes`, each log file is copied
+    into its own gzip file under `output_directory`/logs/<container> instead, so that only
+    new bytes need to be fetched from a long-lived zone and the amount copied can be capped.
+
+    Arguments:
+    docker_client -- docker client for interacting with the containers
+    containers -- containers from which logs are collected (database containers are skipped)
+    output_directory -- local directory under which the logs are saved
+    logfile_path -- path inside the containers to the directory holding the log files
+    incremental -- if True, copy only what was added since the last collection
+    max_bytes -- maximum number of bytes of logs to copy from each container (default: no limit)
+    max_workers -- maximum number of containers to copy from at the same time (default: all)
+    """
+    import concurrent.futures
+
     od = os.path.join(output_directory, 'logs')
     if not os.path.exists(od):
-        os.makedirs(od)
+        os.makedirs(od, exist_ok=True)
 
     if not logfile_path:
         logfile_path = os.path.join(context.irods_home(), 'log')
 
-    for c in containers:
-        if context.is_catalog_database_container(c): continue
+    containers = [c for c in containers if not context.is_catalog_database_container(c)]
+    if not containers:
+        return 0
+
+    def collect(c):
+        # TODO: get server version to determine path of the log files
+        container = docker_client.containers.get(c.name)
 
-        log_archive_path = os.path.join(od, c.name)
+        if incremental or max_bytes is not None:
+            log_directory = os.path.join(od, c.name)
 
-        logging.info('saving log [{}]'.format(log_archive_path))
+            logging.info('saving logs [{}]'.format(log_directory))
+
+            copied = collect_log_files(container, log_directory, logfile_path,
+                                       incremental=incremental, max_bytes=max_bytes)
+
+            logging.debug('copied [{0}] bytes of logs [{1}]'.format(copied, c.name))
+
+        else:
+            log_archive_path = os.path.join(od, c.name + '.tar.gz')
+
+            logging.info('saving log [{}]'.format(log_archive_path))
+
+            collect_log_archive(container, log_archive_path, logfile_path)
+
+    failures = 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or len(containers)) as executor:
+        futures_to_containers = {executor.submit(collect, c): c for c in containers}
+
+        for f in concurrent.futures.as_completed(futures_to_containers):
+            c = futures_to_containers[f]
+            try:
+                f.result()
+
+            except Exception as e:
+                logging.error('failed to collect log [{}]'.format(c.name))
+                logging.error(e)
+                failures += 1
+
+    return failures
+
+
+class log_tailer(object):
+    """Follows the iRODS server logs of several containers and multiplexes them into one stream.
+
+    Each line is prefixed with the name of the container it came from and written to stdout
+    and to a file. If a line matches `fatal_pattern`, `fatal` is set so that whoever is running
+    the tests can stop waiting for them.
+    """
+    def __init__(self, docker_client, containers, output_path, logfile_path=None, fatal_pattern=None):
+        """Construct a log_tailer.
+
+        Arguments:
+        docker_client -- docker client for interacting with the containers
+        containers -- containers whose logs are followed (database containers are skipped)
+        output_path -- local path to the file to which the multiplexed lines are written
+        logfile_path -- path inside the containers to the directory holding the log files
+        fatal_pattern -- regular expression which sets `fatal` when a line matches it
+        """
+        import re
+        import threading
+
+        self.containers = [docker_client.containers.get(c.name) for c in containers
+                           if not context.is_catalog_database_container(c)]
+        self.output_path = output_path
+        self.logfile_path = logfile_path or os.path.join(context.irods_home(), 'log')
+        self.fatal_pattern = re.compile(fatal_pattern) if fatal_pattern else None
+
+        self.fatal = threading.Event()
+        self.fatal_line = None
+
+        self.lock = threading.Lock()
+        self.output_file = None
+
+    def process_name(self):
+        """Return the name under which the tail processes run so that stop can find them."""
+        return 'irods_test_tail'
+
+    def start(self):
+        """Start following the logs of every container in the background."""
+        import threading
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.output_path)), exist_ok=True)
+        self.output_file = open(self.output_path, 'a')
+
+        for c in self.containers:
+            threading.Thread(target=self.follow, args=(c,), daemon=True).start()
+
+    def follow(self, container, max_line_length=1024 * 1024):
+        """Read the log lines of one container as they are written and emit them.
+
+        Arguments:
+        container -- docker container whose logs are followed
+        max_line_length -- number of bytes after which an unfinished line is emitted anyway
+        """
+        # Only lines written from now on are followed; files created later are not picked up
+        script = 'cd "$1" && exec -a "$2" tail -q -n 0 -F -- *'
+        cmd = ['bash', '-c', script, 'bash', self.logfile_path, self.process_name()]
 
         try:
-            # TODO: get server version to determine path of the log files
-            bits, _ = docker_client.containers.get(c.name).get_archive(logfile_path)
+            exec_instance = container.client.api.exec_create(container.id, cmd)
 
-            with open(log_archive_path, 'wb') as f:
-                for chunk in bits:
-                    f.write(chunk)
+            buffer = b''
+            for chunk in container.client.api.exec_start(exec_instance['Id'], stream=True):
+                buffer += chunk
+                *lines, buffer = buffer.split(b'\n')
+
+                if len(buffer) > max_line_length:
+                    lines.append(buffer)
+                    buffer = b''
+
+                for line in lines:
+                    self.emit(container.name, line.decode('utf-8', 'replace'))
 
         except Exception as e:
-            logging.error('failed to collect log [{}]'.format(log_archive_path))
+            logging.error('stopped following logs [{}]'.format(container.name))
             logging.error(e)
+
+    def emit(self, container_name, line):
+        """Write a line from the logs of a container to stdout and the output file.
+
+        Arguments:
+        container_name -- name of the container the line came from
+        line -- the line, without its newline
+        """
+        import sys
+
+        text = '[{0}] {1}\n'.format(container_name, line)
+
+        with self.lock:
+            if not self.output_file:
+                return
+
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+            self.output_file.write(text)
+            self.output_file.flush()
+
+        if self.fatal_pattern and not self.fatal.is_set() and self.fatal_pattern.search(line):
+            logging.critical('fatal pattern found in server log [{0}] [{1}]'.format(line, container_name))
+            self.fatal_line = text
+            self.fatal.set()
+
+    def stop(self):
+        """Stop following the logs and close the output file."""
+        with self.lock:
+            if self.output_file:
+                self.output_file.close()
+                self.output_file = None
+
+        # The tail processes would otherwise keep running in zones which outlive this job
+        for c in self.containers:
+            try:
+                execute.execute_command(c, ['pkill', '-f', self.process_name()])
+            except Exception as e:
+                logging.debug('failed to stop following logs [{0}] [{1}]'.format(c.name, e))
+
+
+if __name__ == "__main__":
+    import argparse
+    import client_cache
+    import compose.cli.command
+
+    parser = argparse.ArgumentParser(description='Collect the iRODS server logs from a running docker-compose project.')
+    parser.add_argument('--project-directory', metavar='PATH_TO_PROJECT_DIRECTORY', type=str, dest='project_directory', default='.',
+                        help='Path to the docker-compose project from which logs are collected.')
+    parser.add_argument('--project-name', metavar='PROJECT_NAME', type=str, dest='project_name',
+                        help='Name of the docker-compose project from which logs are collected.')
+    parser.add_argument('--output-directory', '-o', metavar='FULLPATH_TO_DIRECTORY_FOR_OUTPUT', dest='output_directory', type=str, default='.',
+                        help='Local directory under which the logs are saved.')
+    parser.add_argument('--incremental', dest='incremental', action='store_true',
+                        help='If indicated, only copy what was added to the logs since the last collection into the same output directory.')
+    parser.add_argument('--max-bytes', metavar='BYTES', dest='max_bytes', type=int,
+                        help='Maximum number of bytes of logs to copy from each container. The ends of the logs are kept.')
+    parser.add_argument('--async-engine', dest='async_engine', action='store_true',
+                        help='If indicated, copy the logs from an asyncio event loop talking to the docker socket instead of from threads. Cannot be combined with --incremental or --max-bytes.')
+    parser.add_argument('--verbose', '-v', dest='verbosity', action='count', default=1,
+                        help='Increase the level of output to stdout. CRITICAL and ERROR messages will always be printed.')
+
+    args = parser.parse_args()
+
+    configure(args.verbosity)
+
+    if args.async_engine and (args.incremental or args.max_bytes is not None):
+        parser.error('--async-engine cannot be combined with --incremental or --max-bytes')
+
+    compose_project = compose.cli.command.get_project(os.path.abspath(args.project_directory),
+                                                      project_name=args.project_name)
+
+    if args.async_engine:
+        import async_engine
+
+        failures = async_engine.run(async_engine.collect_logs(async_engine.docker_engine(),
+                                                              compose_project.containers(),
+                                                              os.path.abspath(args.output_directory)))
+    else:
+        failures = collect_logs(client_cache.shared_client(),
+                                compose_project.containers(),
+                                os.path.abspath(args.output_directory),
+                                incremental=args.incremental,
+                                max_bytes=args.max_bytes)
+
+    exit(1 if failures else 0)
@@ -0,0 +1,378 @@
+# grown-up modules
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+# local modules
+import context
+
+def projects_directory():
+    """Return the path to the directory holding the OS platform/database docker-compose projects."""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'projects')
+
+
+def list_combinations(projects_dir=None):
+    """Return a sorted list of (platform, database) repo:tag pairs which have a project.
+
+    The projects are expected to live at `projects_dir`/<platform>-<tag>/<database>-<tag> with a
+    docker-compose.yml file inside (e.g. projects/ubuntu-18.04/postgres-10.12).
+
+    Arguments:
+    projects_dir -- directory in which to look for docker-compose projects
+    """
+    if not projects_dir:
+        projects_dir = projects_directory()
+
+    combinations = list()
+
+    for platform_dir in sorted(os.listdir(projects_dir)):
+        platform_path = os.path.join(projects_dir, platform_dir)
+        if not os.path.isdir(platform_path): continue
+
+        for database_dir in sorted(os.listdir(platform_path)):
+            if not os.path.exists(os.path.join(platform_path, database_dir, 'docker-compose.yml')):
+                continue
+
+            combinations.append((':'.join(platform_dir.split('-', 1)),
+                                 ':'.join(database_dir.split('-', 1))))
+
+    return combinations
+
+
+def project_directory(platform, database, projects_dir=None):
+    """Return the path to the docker-compose project for the platform and database.
+
+    Arguments:
+    platform -- repo:tag for the docker image of the platform running the iRODS servers
+    database -- repo:tag for the docker image of the database server
+    projects_dir -- directory in which to look for docker-compose projects
+    """
+    if not projects_dir:
+        projects_dir = projects_directory()
+
+    return os.path.join(projects_dir,
+                        '-'.join(context.image_repo_and_tag(platform)),
+                        '-'.join(context.image_repo_and_tag(database)))
+
+
+def combination_name(platform, database):
+    """Return a hyphen-delimited name for the platform and database which is safe for docker-compose.
+
+    Arguments:
+    platform -- repo:tag for the docker image of the platform running the iRODS servers
+    database -- repo:tag for the docker image of the database server
+    """
+    return '-'.join([context.sanitize(p) for p in context.image_repo_and_tag(platform)] +
+                    [context.sanitize(d) for d in context.image_repo_and_tag(database)])
+
+
+def meminfo(field):
+    """Return the bytes of memory reported for a field of /proc/meminfo, or 0 if it is not there.
+
+    Arguments:
+    field -- name of the field (e.g. MemTotal)
+    """
+    with open(os.path.join('/proc', 'meminfo'), 'r') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+
+    return 0
+
+
+def host_capacity():
+    """Return a tuple of the number of idle CPUs and the bytes of available memory on this host."""
+    return os.cpu_count() - os.getloadavg()[0], meminfo('MemAvailable')
+
+
+class matrix_job(object):
+    """A single platform/database combination run through run_tests_in_zone.py in its own process.
+
+    Running each combination in a separate process keeps its logging configuration and its
+    script_output.log separate from every other job.
+    """
+    def __init__(self, platform, database, output_directory, arguments):
+        """Construct a matrix_job.
+
+        Arguments:
+        platform -- repo:tag for the docker image of the platform running the iRODS servers
+        database -- repo:tag for the docker image of the database server
+        output_directory -- local directory for output from this job
+        arguments -- list of arguments passed through to run_tests_in_zone.py
+        """
+        self.platform = platform
+        self.database = database
+        self.name = combination_name(platform, database)
+        self.output_directory = output_directory
+        self.arguments = arguments
+
+        self.process = None
+        self.stdout = None
+        self.start_time = None
+        self.end_time = None
+        self.ec = None
+
+    def command(self, job_id):
+        """Return the run_tests_in_zone.py command line for this job.
+
+        Arguments:
+        job_id -- string which uniquely identifies the matrix run across the docker host
+        """
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run_tests_in_zone.py')
+
+        return [sys.executable, script,
+                '--project-directory', project_directory(self.platform, self.database),
+                '--project-name', '-'.join(['matrix', job_id, self.name]),
+                '--os-platform-image', self.platform,
+                '--database-image', self.database,
+                '--output-directory', self.output_directory] + self.arguments
+
+    def start(self, job_id):
+        """Start the job in a subprocess with its output redirected to a file.
+
+        Arguments:
+        job_id -- string which uniquely identifies the matrix run across the docker host
+        """
+        os.makedirs(self.output_directory, exist_ok=True)
+
+        cmd = self.command(job_id)
+        logging.info('starting job [{0}] [{1}]'.format(self.name, ' '.join(cmd)))
+
+        self.stdout = open(os.path.join(self.output_directory, 'job_output.log'), 'w')
+        self.start_time = time.time()
+        self.process = subprocess.Popen(cmd, stdout=self.stdout, stderr=subprocess.STDOUT)
+
+    def poll(self):
+        """Return True if the job has finished, recording its exit code and end time."""
+        if self.ec is not None:
+            return True
+
+        ec = self.process.poll()
+        if ec is None:
+            return False
+
+        self.ec = ec
+        self.end_time = time.time()
+        self.stdout.close()
+
+        logging.warning('job finished [ec=[{0}], job=[{1}], duration=[{2:.0f}s]]'
+                        .format(self.ec, self.name, self.duration()))
+
+        return True
+
+    def duration(self):
+        """Return the number of seconds the job ran (or has been running)."""
+        if self.start_time is None:
+            return 0.0
+
+        return (self.end_time or time.time()) - self.start_time
+
+    def terminate(self):
+        """Stop the job if it is still running."""
+        if self.process and self.ec is None:
+            self.process.terminate()
+            self.process.wait()
+            self.poll()
+
+
+def run_matrix(jobs,
+               job_id,
+               max_jobs=None,
+               cpus_per_job=2.0,
+               memory_per_job=4 * 1024 ** 3,
+               poll_interval=5):
+    """Run the jobs concurrently, starting new ones only while the host has capacity for them.
+
+    At most `max_jobs` jobs run at once and the count is further capped by how many jobs the
+    host's CPUs and memory can hold. A job is only started when the currently idle CPUs and
+    available memory can accommodate it, but at least one job is always allowed to run.
+
+    Arguments:
+    jobs -- list of matrix_job to run
+    job_id -- string which uniquely identifies the matrix run across the docker host
+    max_jobs -- maximum number of jobs to run at the same time (default: no explicit limit)
+    cpus_per_job -- number of CPUs which one running job is expected to use
+    memory_per_job -- bytes of memory which one running job is expected to use
+    poll_interval -- seconds to wait between checks on the running jobs
+    """
+    total_memory = meminfo('MemTotal')
+    host_limit = max(1, min(int(os.cpu_count() // cpus_per_job),
+                            int(total_memory // memory_per_job)))
+    limit = min(max_jobs, host_limit) if max_jobs else host_limit
+
+    logging.info('running [{0}] jobs with at most [{1}] at a time'.format(len(jobs), limit))
+
+    pending = list(jobs)
+    running = list()
+
+    try:
+        while pending or running:
+            running = [j for j in running if not j.poll()]
+
+            # At most one job is started per poll so that it shows up in the load before the next
+            if pending and len(running) < limit:
+                free_cpus, free_memory = host_capacity()
+                if running and (free_cpus < cpus_per_job or free_memory < memory_per_job):
+                    logging.debug('waiting for capacity [cpus=[{0:.1f}], memory=[{1}]]'
+                                  .format(free_cpus, free_memory))
+                else:
+                    j = pending.pop(0)
+                    j.start(job_id)
+                    running.append(j)
+
+            if pending or running:
+                time.sleep(poll_interval)
+
+    finally:
+        for j in running:
+            j.terminate()
+
+    return jobs
+
+
+def summarize(jobs):
+    """Return a text table of pass/fail and duration with a row per platform and a column per database.
+
+    Arguments:
+    jobs -- list of finished matrix_job
+    """
+    def cell(j):
+        if j.ec is None:
+            return 'NOT RUN'
+
+        status = 'PASS' if j.ec == 0 else 'FAIL({})'.format(j.ec)
+        minutes, seconds = divmod(int(j.duration()), 60)
+        return '{0} {1}m{2:02d}s'.format(status, minutes, seconds)
+
+    platforms = sorted(set(j.platform for j in jobs))
+    databases = sorted(set(j.database for j in jobs))
+    cells = {(j.platform, j.database): cell(j) for j in jobs}
+
+    rows = [[''] + databases]
+    for p in platforms:
+        rows.append([p] + [cells.get((p, d), '-') for d in databases])
+
+    widths = [max(len(r[i]) for r in rows) for i in range(len(rows[0]))]
+
+    return '\n'.join(' | '.join(c.ljust(w) for c, w in zip(r, widths)) for r in rows)
+
+
+def write_summary(jobs, output_directory):
+    """Write the matrix results to matrix.json and matrix.txt in `output_directory`.
+
+    Arguments:
+    jobs -- list of finished matrix_job
+    output_directory -- local directory for output from the matrix run
+    """
+    with open(os.path.join(output_directory, 'matrix.json'), 'w') as f:
+        json.dump([{'platform': j.platform,
+                    'database': j.database,
+                    'ec': j.ec,
+                    'duration': j.duration(),
+                    'output_directory': j.output_directory} for j in jobs], f, indent=4)
+
+    table = summarize(jobs)
+
+    with open(os.path.join(output_directory, 'matrix.txt'), 'w') as f:
+        f.write(table + '\n')
+
+    return table
+
+
+if __name__ == "__main__":
+    import argparse
+    import logs
+    import uuid
+
+    parser = argparse.ArgumentParser(description='Run iRODS tests on several OS platform/database combinations at the same time.')
+    parser.add_argument('commands', metavar='COMMANDS', nargs='+',
+                        help='Space-delimited list of commands to be run in each combination')
+    parser.add_argument('--combination', '-c', metavar='OS_PLATFORM_IMAGE DATABASE_IMAGE', dest='combinations', nargs=2, action='append',
+                        help='repo:tag of the OS platform and database images to run. May be repeated. (Default: every project in projects/)')
+    parser.add_argument('--output-directory', '-o', metavar='FULLPATH_TO_DIRECTORY_FOR_OUTPUT', dest='output_directory', type=str,
+                        help='Full path to local directory for output from execution.')
+    parser.add_argument('--package-directory', metavar='PATH_TO_DIRECTORY_WITH_PACKAGES', type=str, dest='package_directory',
+                        help='Path to local directory which contains iRODS packages to be installed. If it contains a subdirectory named for the OS platform (e.g. ubuntu-18.04), that is used instead.')
+    parser.add_argument('--package-version', metavar='PACKAGE_VERSION_TO_DOWNLOAD', type=str, dest='package_version',
+                        help='Version of iRODS to download and install.')
+    parser.add_argument('--package-cache', dest='use_package_cache', action='store_true',
+                        help='If indicated, every job installs packages through the package cache shared by the zones on this host.')
+    parser.add_argument('--use-snapshots', dest='use_snapshots', action='store_true',
+                        help='If indicated, each combination starts from (or saves) a snapshot of its set up zone.')
+    parser.add_argument('--max-jobs', metavar='MAX_JOBS', dest='max_jobs', type=int,
+                        help='Maximum number of combinations to run at the same time.')
+    parser.add_argument('--cpus-per-job', metavar='CPUS', dest='cpus_per_job', type=float, default=2.0,
+                        help='Number of CPUs one combination is expected to use. (Default: %(default)s)')
+    parser.add_argument('--memory-per-job', metavar='GIGABYTES', dest='memory_per_job', type=float, default=4.0,
+                        help='Gigabytes of memory one combination is expected to use. (Default: %(default)s)')
+    parser.add_argument('--fail-fast', dest='fail_fast', action='store_true',
+                        help='If indicated, each combination exits on the first command that returns a non-zero exit code.')
+    parser.add_argument('--verbose', '-v', dest='verbosity', action='count', default=1,
+                        help='Increase the level of output to stdout. CRITICAL and ERROR messages will always be printed.')
+
+    args = parser.parse_args()
+
+    if args.package_directory and args.package_version:
+        print('--package-directory and --package-version are incompatible')
+        exit(1)
+
+    job_id = uuid.uuid4().hex[:8]
+
+    if args.output_directory:
+        output_directory = os.path.join(os.path.abspath(args.output_directory), 'matrix-' + job_id)
+    else:
+        import tempfile
+        output_directory = tempfile.mkdtemp(prefix='matrix-' + job_id)
+
+    os.makedirs(output_directory, exist_ok=True)
+
+    logs.configure(args.verbosity, os.path.join(output_directory, 'matrix_output.log'))
+
+    combinations = args.combinations or list_combinations()
+
+    jobs = list()
+    for platform, database in combinations:
+        if not os.path.exists(project_directory(platform, database)):
+            logging.critical('no project for combination [{0}] [{1}]'.format(platform, database))
+            exit(1)
+
+        arguments = ['--verbose'] * (args.verbosity - 1)
+        if args.fail_fast:
+            arguments.append('--fail-fast')
+
+        if args.use_snapshots:
+            arguments.append('--use-snapshots')
+
+        if args.use_package_cache:
+            arguments.append('--package-cache')
+
+        if args.package_version:
+            arguments.extend(['--package-version', args.package_version])
+
+        if args.package_directory:
+            package_directory = os.path.abspath(args.package_directory)
+            platform_package_directory = os.path.join(package_directory,
+                                                      '-'.join(context.image_repo_and_tag(platform)))
+            if os.path.isdir(platform_package_directory):
+                package_directory = platform_package_directory
+
+            arguments.extend(['--package-directory', package_directory])
+
+        name = combination_name(platform, database)
+        jobs.append(matrix_job(platform,
+                               database,
+                               os.path.join(output_directory, name),
+                               arguments + ['--'] + args.commands))
+
+    run_matrix(jobs,
+               job_id,
+               max_jobs=args.max_jobs,
+               cpus_per_job=args.cpus_per_job,
+               memory_per_job=int(args.memory_per_job * 1024 ** 3))
+
+    print(write_summary(jobs, output_directory))
+
+    exit(0 if all(j.ec == 0 for j in jobs) else 1)
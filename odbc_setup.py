@@ -48,15 +48,18 @@ def configure_odbc_driver_centos_7_postgres_1012(csp_container, odbc_driver):
     configure_postgres_odbc_driver(csp_container, odbc_driver)
 
 
-def make_mysql_odbcinst_ini(csp_container, container_odbc_driver_dir):
-    """Generate content for the /etc/odbcinst.ini configuration file used by mysql.
+def odbcinst_ini_path():
+    """Return the path in the catalog service provider container of the ODBC driver registry."""
+    return os.path.join('/etc', 'odbcinst.ini')
+
+
+def mysql_odbcinst_ini_contents(container_odbc_driver_dir):
+    """Return the contents of the /etc/odbcinst.ini configuration file used by mysql.
 
     Arguments:
-    csp_container -- container running iRODS catalog service provider using the ODBC driver
-    container_odbc_driver_dir -- path in `csp_container` containing the ODBC driver directory
+    container_odbc_driver_dir -- path in the container containing the ODBC driver directory
     """
-    odbcinst_ini_path = os.path.join('/etc', 'odbcinst.ini')
-    odbcinst_ini_contents = textwrap.dedent("""\
+    return textwrap.dedent("""\
         [MySQL ANSI]
         Description = MySQL OCBC 5.2 ANSI Driver
         Driver = {0}/lib/libmyodbc5a.so
@@ -65,13 +68,24 @@ def make_mysql_odbcinst_ini(csp_container, container_odbc_driver_dir):
         Description = MySQL OCBC 5.2  Unicode Driver
         Driver = {0}/lib/libmyodbc5w.so""".format(container_odbc_driver_dir))
 
-    cmd = 'bash -c \'echo "{0}" > {1}\''.format(odbcinst_ini_contents, odbcinst_ini_path)
+
+def make_mysql_odbcinst_ini(csp_container, container_odbc_driver_dir):
+    """Generate content for the /etc/odbcinst.ini configuration file used by mysql.
+
+    Arguments:
+    csp_container -- container running iRODS catalog service provider using the ODBC driver
+    container_odbc_driver_dir -- path in `csp_container` containing the ODBC driver directory
+    """
+    path = odbcinst_ini_path()
+    odbcinst_ini_contents = mysql_odbcinst_ini_contents(container_odbc_driver_dir)
+
+    cmd = 'bash -c \'echo "{0}" > {1}\''.format(odbcinst_ini_contents, path)
     ec = execute.execute_command(csp_container, cmd)
     if ec is not 0:
         raise RuntimeError('failed to populate odbcinst.ini [ec=[{0}], container=[{1}]]'
             .format(ec, csp_container))
 
-    execute.execute_command(csp_container, 'cat {}'.format(odbcinst_ini_path))
+    execute.execute_command(csp_container, 'cat {}'.format(path))
 
 
 def configure_mysql_odbc_driver(csp_container, odbc_driver, extension='.tar.gz'):
@@ -122,13 +136,63 @@ def download_mysql_odbc_driver(url, destination=None, always_download=False):
 
     logging.info('downloading [{}] to [{}]'.format(url, destination))
 
-    with urllib.request.urlopen(url) as r:
-        with open(destination, 'w+b') as f:
-            shutil.copyfileobj(r, f)
+    # Download to a temporary file first so that a concurrent job never sees a partial file
+    fd, partial = tempfile.mkstemp(dir=os.path.dirname(destination))
+
+    try:
+        with os.fdopen(fd, 'w+b') as f:
+            with urllib.request.urlopen(url) as r:
+                shutil.copyfileobj(r, f)
+
+        os.replace(partial, destination)
+
+    # Also clean up after an interrupted download (e.g. KeyboardInterrupt)
+    except BaseException:
+        os.unlink(partial)
+        raise
 
     return destination
 
 
+def odbc_driver_url(platform_image, database_image):
+    """Return the URL of the ODBC driver package for the platform and database, or None.
+
+    None is returned for combinations which do not need an ODBC driver to be provided.
+
+    Arguments:
+    platform_image -- repo:tag for the docker image of the platform running the iRODS servers
+    database_image -- repo:tag for the docker image of the database server
+    """
+    urls = {
+        ('ubuntu:16.04', 'mysql:5.7'): 'https://downloads.mysql.com/archives/get/p/10/file/mysql-connector-odbc-5.3.13-linux-ubuntu16.04-x86-64bit.tar.gz',
+        ('ubuntu:18.04', 'mysql:5.7'): 'https://downloads.mysql.com/archives/get/p/10/file/mysql-connector-odbc-5.3.13-linux-ubuntu18.04-x86-64bit.tar.gz',
+        ('centos:7', 'mysql:5.7'): 'https://downloads.mysql.com/archives/get/p/10/file/mysql-connector-odbc-5.3.13-linux-el7-x86-64bit.tar.gz'
+    }
+
+    return urls.get((platform_image, database_image))
+
+
+def fetch_odbc_driver(platform_image, database_image, odbc_driver=None):
+    """Return the local path to the ODBC driver archive, downloading it if necessary.
+
+    Returns None if no ODBC driver is needed for the platform and database. This does not touch
+    any container, so it can run before the containers are up.
+
+    Arguments:
+    platform_image -- repo:tag for the docker image of the platform running the iRODS servers
+    database_image -- repo:tag for the docker image of the database server
+    odbc_driver -- if specified, the ODBC driver will be sought here
+    """
+    if odbc_driver:
+        return os.path.abspath(odbc_driver)
+
+    url = odbc_driver_url(platform_image, database_image)
+    if not url:
+        return None
+
+    return download_mysql_odbc_driver(url)
+
+
 def configure_odbc_driver_ubuntu_1604_mysql_57(csp_container, odbc_driver):
     """Configure ODBC driver for mysql 5.7 on ubuntu 16.04.
 
@@ -137,8 +201,7 @@ def configure_odbc_driver_ubuntu_1604_mysql_57(csp_container, odbc_driver):
     odbc_driver -- path to local archive file containing the ODBC driver package
     """
     if not odbc_driver:
-        odbc_driver = download_mysql_odbc_driver(
-            'https://downloads.mysql.com/archives/get/p/10/file/mysql-connector-odbc-5.3.13-linux-ubuntu16.04-x86-64bit.tar.gz')
+        odbc_driver = download_mysql_odbc_driver(odbc_driver_url('ubuntu:16.04', 'mysql:5.7'))
 
     configure_mysql_odbc_driver(csp_container, os.path.abspath(odbc_driver))
 
@@ -151,8 +214,7 @@ def configure_odbc_driver_ubuntu_1804_mysql_57(csp_container, odbc_driver):
     odbc_driver -- path to local archive file containing the ODBC driver package
     """
     if not odbc_driver:
-        odbc_driver = download_mysql_odbc_driver(
-            'https://downloads.mysql.com/archives/get/p/10/file/mysql-connector-odbc-5.3.13-linux-ubuntu18.04-x86-64bit.tar.gz')
+        odbc_driver = download_mysql_odbc_driver(odbc_driver_url('ubuntu:18.04', 'mysql:5.7'))
 
     configure_mysql_odbc_driver(csp_container, os.path.abspath(odbc_driver))
 
@@ -165,8 +227,7 @@ def configure_odbc_driver_centos_7_mysql_57(csp_container, odbc_driver):
     odbc_driver -- path to local archive file containing the ODBC driver package
     """
     if not odbc_driver:
-        odbc_driver = download_mysql_odbc_driver(
-            'https://downloads.mysql.com/archives/get/p/10/file/mysql-connector-odbc-5.3.13-linux-el7-x86-64bit.tar.gz')
+        odbc_driver = download_mysql_odbc_driver(odbc_driver_url('centos:7', 'mysql:5.7'))
 
     configure_mysql_odbc_driver(csp_container, os.path.abspath(odbc_driver))
 
@@ -191,3 +252,41 @@ def configure_odbc_driver(platform_image, database_image, csp_container, odbc_dr
 
     eval(func_name)(csp_container, odbc_driver)
 
+
+def registered_odbc_driver(csp_container, database_image):
+    """Return the name of the first ODBC driver registered for the database in `csp_container`.
+
+    This is the driver which the interactive iRODS setup script offers by default.
+
+    Arguments:
+    csp_container -- docker container on which the iRODS catalog service provider is running
+    database_image -- repo:tag for the docker image of the database server
+    """
+    result = csp_container.exec_run(['odbcinst', '-q', '-d'])
+    if result.exit_code != 0:
+        raise RuntimeError('failed to list ODBC drivers [ec=[{0}], container=[{1}]]'
+                           .format(result.exit_code, csp_container.name))
+
+    name = odbc_driver_for_database(result.output.decode('utf-8'), database_image)
+    if not name:
+        raise RuntimeError('no ODBC driver registered for database [{0}] [{1}]'
+                           .format(database_image, csp_container.name))
+
+    return name
+
+
+def odbc_driver_for_database(driver_list, database_image):
+    """Return the name of the first ODBC driver in `driver_list` for the database, or None.
+
+    Arguments:
+    driver_list -- output of `odbcinst -q -d`
+    database_image -- repo:tag for the docker image of the database server
+    """
+    db = context.image_repo(database_image)
+
+    for line in driver_list.splitlines():
+        name = line.strip().strip('[]')
+        if db.lower() in name.lower():
+            return name
+
+    return None
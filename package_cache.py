@@ -0,0 +1,278 @@
+# grown-up modules
+import docker
+import logging
+import os
+
+# local modules
+import archive
+import execute
+
+def package_cache_name():
+    """Return the name of the package cache container and of its image and cache volume."""
+    return 'irods-test-package-cache'
+
+
+def package_cache_port():
+    """Return the host port on which the package cache listens."""
+    return 3142
+
+
+def repository_directory():
+    """Return the directory inside the package cache container which holds the local repositories."""
+    return '/srv/repo'
+
+
+def package_cache_build_directory():
+    """Return the local directory containing the Dockerfile for the package cache image."""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'projects', 'package-cache')
+
+
+def host_lock(name):
+    """Return a lock shared by every job on this host which is held while changing the package cache.
+
+    Arguments:
+    name -- name of the lock
+    """
+    lock_directory = archive.archive_cache_directory()
+    os.makedirs(lock_directory, exist_ok=True)
+
+    return archive.cache_lock(os.path.join(lock_directory, '{}.lock'.format(name)))
+
+
+def start_package_cache(docker_client, port=None):
+    """Return the package cache container, building and starting it first if it is not running.
+
+    The cache is shared by every zone on the docker host and lives across runs. Cached upstream
+    packages are kept in a named volume so that they survive the container being recreated.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker host
+    port -- host port on which the package cache listens (default: package_cache_port())
+    """
+    name = package_cache_name()
+
+    with host_lock(name):
+        try:
+            container = docker_client.containers.get(name)
+            if container.status != 'running':
+                logging.info('starting package cache [{}]'.format(name))
+                container.start()
+
+            return container
+
+        except docker.errors.NotFound:
+            pass
+
+        try:
+            docker_client.images.get(name)
+
+        except docker.errors.ImageNotFound:
+            logging.warning('building package cache image [{}]'.format(name))
+            docker_client.images.build(path=package_cache_build_directory(), tag=name, rm=True)
+
+        logging.warning('running package cache [{}]'.format(name))
+
+        return docker_client.containers.run(name,
+                                            name=name,
+                                            detach=True,
+                                            ports={'3142/tcp': port or package_cache_port()},
+                                            volumes={name: {'bind': '/var/cache/apt-cacher-ng', 'mode': 'rw'}},
+                                            restart_policy={'Name': 'unless-stopped'})
+
+
+def stop_package_cache(docker_client, remove_volume=False):
+    """Remove the package cache container and, optionally, every upstream package it cached.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker host
+    remove_volume -- if True, the volume holding the cached upstream packages is removed as well
+    """
+    name = package_cache_name()
+
+    with host_lock(name):
+        try:
+            docker_client.containers.get(name).remove(force=True)
+        except docker.errors.NotFound:
+            logging.info('package cache is not running [{}]'.format(name))
+
+        if remove_volume:
+            try:
+                docker_client.volumes.get(name).remove()
+            except docker.errors.NotFound:
+                pass
+
+
+def cache_url(container, port=None):
+    """Return the URL at which `container` reaches the package cache on the docker host.
+
+    Arguments:
+    container -- docker container which will use the package cache
+    port -- host port on which the package cache listens (default: package_cache_port())
+    """
+    container.reload()
+
+    networks = container.attrs['NetworkSettings']['Networks']
+    gateway = list(networks.values())[0]['Gateway']
+
+    return 'http://{0}:{1}'.format(gateway, port or package_cache_port())
+
+
+def publish_packages(cache_container, packages, platform_name, max_age_days=7):
+    """Publish local packages as a repository in the package cache and return its path and contents.
+
+    The repository is keyed by the contents of the packages, so publishing the same build
+    output again reuses the existing repository. Repositories which have not been used for
+    `max_age_days` days are removed.
+
+    Returns a tuple of the URL path of the repository on the package cache and the list of
+    exact package specifications (name=version for apt, name-version-release for yum) to install.
+
+    Arguments:
+    cache_container -- the package cache container
+    packages -- local paths of the packages to publish
+    platform_name -- repo for the docker image of the OS platform (e.g. ubuntu)
+    max_age_days -- number of days after which an unused repository is removed
+    """
+    key = archive.archive_key(packages, archive.archive_cache_directory())[:16]
+    repository = os.path.join(repository_directory(), key)
+
+    if 'centos' in platform_name:
+        index = 'createrepo_c --quiet . && rpm -qp --qf "%{NAME}-%{VERSION}-%{RELEASE}\\n" *.rpm > .specs'
+    elif 'ubuntu' in platform_name:
+        index = ('dpkg-scanpackages --multiversion . /dev/null 2>/dev/null | gzip -9c > Packages.gz && '
+                 'for f in *.deb; do dpkg-deb --showformat=\'${Package}=${Version}\\n\' -W "$f"; done > .specs')
+    else:
+        raise RuntimeError('unsupported platform [{}]'.format(platform_name))
+
+    with host_lock('repository-{}'.format(key)):
+        published = execute.execute_command(cache_container, ['test', '-f', os.path.join(repository, '.specs')]) == 0
+
+        if published:
+            logging.info('using published repository [{}]'.format(repository))
+        else:
+            logging.warning('publishing packages to repository [{}]'.format(repository))
+
+            ec = execute.execute_command(cache_container, ['mkdir', '-p', repository])
+            if ec != 0:
+                raise RuntimeError('failed to create repository [ec=[{0}], repository=[{1}]]'.format(ec, repository))
+
+            archive.put_archive_in_containers([cache_container], packages, path=repository, flatten=True)
+
+            ec = execute.execute_command(cache_container, ['bash', '-c', 'cd "$1" && ' + index, 'bash', repository])
+            if ec != 0:
+                raise RuntimeError('failed to index repository [ec=[{0}], repository=[{1}]]'.format(ec, repository))
+
+        # Mark this repository as used and forget about the ones which have not been used in a while
+        execute.execute_command(cache_container, ['bash', '-c',
+                                'touch "$1" && find "$2" -mindepth 1 -maxdepth 1 -mtime +"$3" -exec rm -rf {} +',
+                                'bash', repository, repository_directory(), str(max_age_days)])
+
+    specs = archive.read_file_from_container(cache_container, os.path.join(repository, '.specs')).decode('utf-8').split()
+
+    return '/'.join(['', 'local', key]), specs
+
+
+def configure_container(container, platform_name, port=None, repository_path=None):
+    """Point the package manager of `container` at the package cache.
+
+    The original configuration is saved so that restore_container can put it back; the zone
+    under test is then configured exactly as it would be without the package cache.
+
+    Arguments:
+    container -- docker container in which packages will be installed
+    platform_name -- repo for the docker image of the OS platform (e.g. ubuntu)
+    port -- host port on which the package cache listens (default: package_cache_port())
+    repository_path -- if provided, URL path on the package cache of a published local repository
+    """
+    url = cache_url(container, port)
+    repository_url = url + repository_path if repository_path else ''
+
+    logging.info('configuring package cache [{0}] [{1}]'.format(url, container.name))
+
+    # HTTPS repositories are fetched through the cache with the http://HTTPS/// prefix; otherwise
+    # the proxy could only tunnel them and nothing would be cached.
+    if 'centos' in platform_name:
+        script = '\n'.join([
+            'set -e',
+            '[ -d /etc/yum.repos.d.irods-test ] || cp -a /etc/yum.repos.d /etc/yum.repos.d.irods-test',
+            '[ -f /etc/yum.conf.irods-test ] || cp -a /etc/yum.conf /etc/yum.conf.irods-test',
+            'echo "proxy=$1" >> /etc/yum.conf',
+            # Mirror lists pick a different mirror every time, which defeats the cache
+            'sed -i -e "s|^mirrorlist=|#mirrorlist=|" -e "s|^metalink=|#metalink=|" -e "s|^#baseurl=|baseurl=|" '
+            '-e "s|https://|http://HTTPS///|g" /etc/yum.repos.d/*.repo',
+            'if [ -n "$2" ]; then',
+            '    printf "[irods-test-local]\\nname=irods-test-local\\nbaseurl=%s\\ngpgcheck=0\\nproxy=_none_\\n" "$2" > /etc/yum.repos.d/irods-test-local.repo',
+            'fi'
+        ])
+    elif 'ubuntu' in platform_name:
+        script = '\n'.join([
+            'set -e',
+            '[ -d /etc/apt.irods-test ] || cp -a /etc/apt /etc/apt.irods-test',
+            'host=$(echo "$1" | cut -d/ -f3 | cut -d: -f1)',
+            'printf "Acquire::http::Proxy \\"%s\\";\\nAcquire::http::Proxy::%s \\"DIRECT\\";\\n" "$1" "$host" > /etc/apt/apt.conf.d/01irods-test-package-cache',
+            'for f in /etc/apt/sources.list /etc/apt/sources.list.d/*.list; do',
+            '    if [ -f "$f" ]; then sed -i "s|https://|http://HTTPS///|g" "$f"; fi',
+            'done',
+            'if [ -n "$2" ]; then',
+            '    echo "deb [trusted=yes] $2 ./" > /etc/apt/sources.list.d/irods-test-local.list',
+            'fi'
+        ])
+    else:
+        raise RuntimeError('unsupported platform [{}]'.format(platform_name))
+
+    ec = execute.execute_command(container, ['bash', '-c', script, 'bash', url, repository_url])
+    if ec != 0:
+        raise RuntimeError('failed to configure package cache [ec=[{0}], container=[{1}]]'.format(ec, container.name))
+
+
+def restore_container(container, platform_name):
+    """Put back the package manager configuration saved by configure_container.
+
+    Arguments:
+    container -- docker container in which packages were installed
+    platform_name -- repo for the docker image of the OS platform (e.g. ubuntu)
+    """
+    if 'centos' in platform_name:
+        script = ('if [ -d /etc/yum.repos.d.irods-test ]; then '
+                  'rm -rf /etc/yum.repos.d && mv /etc/yum.repos.d.irods-test /etc/yum.repos.d && '
+                  'mv -f /etc/yum.conf.irods-test /etc/yum.conf && yum clean all; fi')
+    elif 'ubuntu' in platform_name:
+        script = 'if [ -d /etc/apt.irods-test ]; then rm -rf /etc/apt && mv /etc/apt.irods-test /etc/apt; fi'
+    else:
+        raise RuntimeError('unsupported platform [{}]'.format(platform_name))
+
+    ec = execute.execute_command(container, ['bash', '-c', script])
+    if ec != 0:
+        raise RuntimeError('failed to restore package manager configuration [ec=[{0}], container=[{1}]]'
+                           .format(ec, container.name))
+
+
+if __name__ == "__main__":
+    import argparse
+    import client_cache
+    import logs
+
+    parser = argparse.ArgumentParser(description='Start or stop the package cache shared by the zones on this docker host.')
+    parser.add_argument('--stop', dest='stop', action='store_true',
+                        help='If indicated, remove the package cache container instead of starting it.')
+    parser.add_argument('--remove-volume', dest='remove_volume', action='store_true',
+                        help='If indicated with --stop, also remove every cached upstream package.')
+    parser.add_argument('--port', metavar='PORT', dest='port', type=int, default=package_cache_port(),
+                        help='Host port on which the package cache listens. (Default: %(default)s)')
+    parser.add_argument('--verbose', '-v', dest='verbosity', action='count', default=1,
+                        help='Increase the level of output to stdout. CRITICAL and ERROR messages will always be printed.')
+
+    args = parser.parse_args()
+
+    logs.configure(args.verbosity)
+
+    try:
+        if args.stop:
+            stop_package_cache(client_cache.shared_client(), remove_volume=args.remove_volume)
+        else:
+            container = start_package_cache(client_cache.shared_client(), port=args.port)
+            logging.warning('package cache is running [{}]'.format(container.name))
+
+    except Exception as e:
+        logging.critical(e)
+        exit(1)
@@ -0,0 +1,558 @@
+# grown-up modules
+import compose.cli.command
+import http.server
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.request
+
+# local modules
+import matrix
+import reset
+import run_tests_in_zone
+
+def pool_project_name(platform, database, pool_id, zone_index):
+    """Return a pool-unique docker-compose project name for a zone.
+
+    Arguments:
+    platform -- repo:tag for the docker image of the platform running the iRODS servers
+    database -- repo:tag for the docker image of the database server
+    pool_id -- string which uniquely identifies the pool across the docker host
+    zone_index -- number of the zone within the pool (never reused)
+    """
+    return '-'.join(['pool', pool_id, str(zone_index), matrix.combination_name(platform, database)])
+
+
+class zone_pool(object):
+    """Keeps a number of fully set up zones ready for each OS platform/database combination.
+
+    Jobs lease a ready zone, run their commands, and then return it. Returned zones are either
+    reset and put back into the pool (recycled) or torn down, and the pool is refilled in the
+    background. Leases which are not renewed within `lease_duration` seconds (e.g. because the
+    job crashed) expire and their zones are torn down.
+    """
+    def __init__(self, docker_client, combinations, size, bring_up_options=None, lease_duration=600):
+        """Construct a zone_pool.
+
+        Arguments:
+        docker_client -- docker client for interacting with the docker-compose projects
+        combinations -- list of (platform, database) repo:tag pairs to keep zones for
+        size -- number of ready zones to keep for each combination
+        bring_up_options -- keyword arguments passed through to run_tests_in_zone.bring_up_zone
+        lease_duration -- seconds a lease lasts unless it is renewed
+        """
+        import uuid
+
+        self.docker_client = docker_client
+        self.combinations = [tuple(c) for c in combinations]
+        self.size = size
+        self.bring_up_options = bring_up_options or dict()
+        self.lease_duration = lease_duration
+        self.pool_id = uuid.uuid4().hex[:8]
+
+        self.lock = threading.Condition()
+        self.ready = {c: list() for c in self.combinations}
+        self.pending = {c: 0 for c in self.combinations}
+        self.leased = dict()
+        self.zone_count = 0
+        self.stopping = False
+
+    def project(self, combination, project_name):
+        """Return the compose.Project for a zone in this pool.
+
+        Arguments:
+        combination -- (platform, database) repo:tag pair of the zone
+        project_name -- docker-compose project name of the zone
+        """
+        return compose.cli.command.get_project(matrix.project_directory(*combination),
+                                               project_name=project_name)
+
+    def zone_info(self, combination, project_name):
+        """Return a description of a zone which a job can use to find it.
+
+        Arguments:
+        combination -- (platform, database) repo:tag pair of the zone
+        project_name -- docker-compose project name of the zone
+        """
+        return {
+            'platform': combination[0],
+            'database': combination[1],
+            'project_name': project_name,
+            'project_directory': matrix.project_directory(*combination)
+        }
+
+    def fill(self):
+        """Start bringing up zones for every combination which has fewer than `size` zones."""
+        with self.lock:
+            if self.stopping:
+                return
+
+            for c in self.combinations:
+                while len(self.ready[c]) + self.pending[c] < self.size:
+                    self.zone_count += 1
+                    self.pending[c] += 1
+
+                    name = pool_project_name(c[0], c[1], self.pool_id, self.zone_count)
+                    threading.Thread(target=self.bring_up, args=(c, name), daemon=True).start()
+
+    def bring_up(self, combination, project_name):
+        """Bring up and set up a zone and add it to the ready zones.
+
+        The zone is torn down instead if the pool was stopped while it was being brought up.
+
+        Arguments:
+        combination -- (platform, database) repo:tag pair of the zone
+        project_name -- docker-compose project name of the zone
+        """
+        p = self.project(combination, project_name)
+
+        try:
+            logging.warning('bringing up pool zone [{}]'.format(project_name))
+            run_tests_in_zone.bring_up_zone(self.docker_client,
+                                            p,
+                                            combination[0],
+                                            combination[1],
+                                            **self.bring_up_options)
+
+            # Zones which are returned for recycling are reset to this state
+            reset.save_baseline(self.docker_client, p, combination[1])
+
+        except Exception as e:
+            logging.error('exception raised while bringing up pool zone [{}]'.format(project_name))
+            logging.error(e)
+
+            self.tear_down(combination, project_name)
+
+            with self.lock:
+                self.pending[combination] -= 1
+                stopping = self.stopping
+                self.lock.notify_all()
+
+            if not stopping:
+                # Do not spin on a combination which cannot be brought up
+                time.sleep(30)
+                self.fill()
+
+            return
+
+        with self.lock:
+            stopping = self.stopping
+
+            if not stopping:
+                self.pending[combination] -= 1
+                self.ready[combination].append(project_name)
+                self.lock.notify_all()
+
+        if stopping:
+            self.tear_down(combination, project_name)
+
+            with self.lock:
+                self.pending[combination] -= 1
+                self.lock.notify_all()
+
+            return
+
+        logging.warning('pool zone is ready [{}]'.format(project_name))
+
+    def tear_down(self, combination, project_name):
+        """Bring down a zone and remove its containers and volumes.
+
+        Arguments:
+        combination -- (platform, database) repo:tag pair of the zone
+        project_name -- docker-compose project name of the zone
+        """
+        logging.warning('tearing down pool zone [{}]'.format(project_name))
+
+        try:
+            self.project(combination, project_name).down(include_volumes=True, remove_image_type=False)
+
+        except Exception as e:
+            logging.error('exception raised while tearing down pool zone [{}]'.format(project_name))
+            logging.error(e)
+
+    def lease(self, platform, database, timeout=None):
+        """Lease a ready zone for the combination, waiting up to `timeout` seconds for one.
+
+        Returns a description of the leased zone or None if no zone became ready in time.
+
+        Arguments:
+        platform -- repo:tag for the docker image of the platform running the iRODS servers
+        database -- repo:tag for the docker image of the database server
+        timeout -- seconds to wait for a ready zone (default: wait forever)
+        """
+        c = (platform, database)
+        if c not in self.ready:
+            raise KeyError('combination not in pool [{0}] [{1}]'.format(platform, database))
+
+        with self.lock:
+            if not self.lock.wait_for(lambda: self.ready[c] or self.stopping, timeout):
+                return None
+
+            if self.stopping:
+                return None
+
+            project_name = self.ready[c].pop(0)
+            now = time.time()
+            self.leased[project_name] = (c, now, now + self.lease_duration)
+
+        logging.info('leased pool zone [{}]'.format(project_name))
+
+        self.fill()
+
+        zone = self.zone_info(c, project_name)
+        zone['lease_duration'] = self.lease_duration
+        return zone
+
+    def renew(self, project_name):
+        """Extend the lease of a leased zone by `lease_duration` seconds from now.
+
+        Arguments:
+        project_name -- docker-compose project name of the leased zone
+        """
+        with self.lock:
+            if project_name not in self.leased:
+                raise KeyError('zone is not leased [{}]'.format(project_name))
+
+            c, leased_at, _ = self.leased[project_name]
+            self.leased[project_name] = (c, leased_at, time.time() + self.lease_duration)
+
+    def reclaim_expired_leases(self):
+        """Tear down the zones whose leases have expired and return their project names."""
+        now = time.time()
+
+        with self.lock:
+            expired = [(n, c) for n, (c, _, expires_at) in self.leased.items() if expires_at <= now]
+
+            for n, _ in expired:
+                del self.leased[n]
+
+        for n, c in expired:
+            logging.error('lease expired; reclaiming pool zone [{}]'.format(n))
+            threading.Thread(target=self.tear_down, args=(c, n), daemon=True).start()
+
+        return [n for n, _ in expired]
+
+    def watch_leases(self):
+        """Reclaim expired leases until the pool is stopped."""
+        interval = max(1, min(30, self.lease_duration / 4))
+
+        while True:
+            with self.lock:
+                if self.lock.wait_for(lambda: self.stopping, interval):
+                    return
+
+            self.reclaim_expired_leases()
+
+    def give_back(self, project_name, recycle=False):
+        """Return a leased zone to the pool.
+
+        Arguments:
+        project_name -- docker-compose project name of the leased zone
+        recycle -- if True, the zone is reset and put back as a ready zone; otherwise, it is
+                   torn down
+        """
+        with self.lock:
+            if project_name not in self.leased:
+                raise KeyError('zone is not leased [{}]'.format(project_name))
+
+            c, leased_at, _ = self.leased.pop(project_name)
+
+        logging.info('returned pool zone [{0}] after [{1:.0f}s] [recycle=[{2}]]'
+                     .format(project_name, time.time() - leased_at, recycle))
+
+        if recycle and not self.stopping:
+            threading.Thread(target=self.recycle, args=(c, project_name), daemon=True).start()
+            return
+
+        threading.Thread(target=self.tear_down, args=(c, project_name), daemon=True).start()
+
+    def recycle(self, combination, project_name):
+        """Reset a returned zone to its baseline and put it back as a ready zone.
+
+        The zone is torn down instead if the reset fails or the pool already has enough ready
+        zones for the combination.
+
+        Arguments:
+        combination -- (platform, database) repo:tag pair of the zone
+        project_name -- docker-compose project name of the zone
+        """
+        try:
+            reset.reset_zone(self.docker_client, self.project(combination, project_name), combination[1])
+
+        except Exception as e:
+            logging.error('exception raised while resetting pool zone [{}]'.format(project_name))
+            logging.error(e)
+
+            self.tear_down(combination, project_name)
+            return
+
+        with self.lock:
+            if not self.stopping and len(self.ready[combination]) < self.size:
+                self.ready[combination].append(project_name)
+                self.lock.notify_all()
+                return
+
+        self.tear_down(combination, project_name)
+
+    def status(self):
+        """Return a description of the ready, pending, and leased zones."""
+        with self.lock:
+            return {
+                'pool_id': self.pool_id,
+                'size': self.size,
+                'ready': {' '.join(c): list(z) for c, z in self.ready.items()},
+                'pending': {' '.join(c): n for c, n in self.pending.items()},
+                'leased': {n: {'combination': ' '.join(c),
+                               'seconds': time.time() - t,
+                               'expires_in': expires_at - time.time()}
+                           for n, (c, t, expires_at) in self.leased.items()}
+            }
+
+    def stop(self):
+        """Stop refilling the pool and tear down every zone.
+
+        Zones which are still being brought up are torn down by bring_up once they are ready,
+        and this waits until they have been.
+        """
+        with self.lock:
+            self.stopping = True
+            self.lock.notify_all()
+
+            zones = [(c, n) for c, names in self.ready.items() for n in names]
+            zones.extend((c, n) for n, (c, _, _) in self.leased.items())
+
+        for c, n in zones:
+            self.tear_down(c, n)
+
+        with self.lock:
+            if any(self.pending.values()):
+                logging.warning('waiting for pending pool zones to be torn down')
+
+            self.lock.wait_for(lambda: not any(self.pending.values()))
+
+
+class pool_request_handler(http.server.BaseHTTPRequestHandler):
+    """Handles lease, renew, return, and status requests for the zone_pool attached to the server."""
+    def send_json(self, code, document):
+        body = json.dumps(document).encode('utf-8')
+
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length).decode('utf-8')) if length else dict()
+
+    def do_GET(self):
+        if self.path != '/status':
+            self.send_json(404, {'error': 'not found [{}]'.format(self.path)})
+            return
+
+        self.send_json(200, self.server.zone_pool.status())
+
+    def do_POST(self):
+        try:
+            request = self.read_json()
+
+            if self.path == '/lease':
+                zone = self.server.zone_pool.lease(request['platform'],
+                                                   request['database'],
+                                                   request.get('timeout'))
+                if not zone:
+                    self.send_json(503, {'error': 'no zone became ready in time'})
+                    return
+
+                self.send_json(200, zone)
+
+            elif self.path == '/renew':
+                self.server.zone_pool.renew(request['project_name'])
+                self.send_json(200, {})
+
+            elif self.path == '/return':
+                self.server.zone_pool.give_back(request['project_name'], request.get('recycle', False))
+                self.send_json(200, {})
+
+            else:
+                self.send_json(404, {'error': 'not found [{}]'.format(self.path)})
+
+        except KeyError as e:
+            self.send_json(400, {'error': str(e)})
+
+    def log_message(self, format, *args):
+        logging.debug('pool request [{0}] {1}'.format(self.address_string(), format % args))
+
+
+def post(pool_url, path, document, timeout=None):
+    """Send a JSON request to the pool server and return the JSON response.
+
+    Error responses are raised as a RuntimeError which holds the error reported by the pool.
+
+    Arguments:
+    pool_url -- URL of the pool server (e.g. http://localhost:8740)
+    path -- path of the request on the pool server (e.g. /lease)
+    document -- dict which is sent as the JSON body of the request
+    timeout -- seconds to wait for the response
+    """
+    request = urllib.request.Request(pool_url.rstrip('/') + path,
+                                     data=json.dumps(document).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as r:
+            return json.loads(r.read().decode('utf-8'))
+
+    except urllib.error.HTTPError as e:
+        try:
+            error = json.loads(e.read().decode('utf-8')).get('error')
+        except ValueError:
+            error = e.reason
+
+        raise RuntimeError('pool request failed [path=[{0}], status=[{1}], error=[{2}]]'
+                           .format(path, e.code, error))
+
+
+def lease_zone(pool_url, platform, database, timeout=None):
+    """Lease a ready zone from the pool server and return its description.
+
+    Arguments:
+    pool_url -- URL of the pool server (e.g. http://localhost:8740)
+    platform -- repo:tag for the docker image of the platform running the iRODS servers
+    database -- repo:tag for the docker image of the database server
+    timeout -- seconds to wait for a ready zone (default: wait forever)
+    """
+    try:
+        return post(pool_url, '/lease', {'platform': platform, 'database': database, 'timeout': timeout})
+
+    except RuntimeError as e:
+        raise RuntimeError('failed to lease zone from pool [{0}] [{1}] [{2}]: {3}'
+                           .format(pool_url, platform, database, e))
+
+
+def renew_zone(pool_url, project_name):
+    """Renew the lease of a zone leased from the pool server.
+
+    Arguments:
+    pool_url -- URL of the pool server (e.g. http://localhost:8740)
+    project_name -- docker-compose project name of the leased zone
+    """
+    return post(pool_url, '/renew', {'project_name': project_name})
+
+
+class lease_heartbeat(object):
+    """Renews the lease of a zone in the background so that the pool does not reclaim it."""
+    def __init__(self, pool_url, leased_zone):
+        """Construct a lease_heartbeat.
+
+        Arguments:
+        pool_url -- URL of the pool server (e.g. http://localhost:8740)
+        leased_zone -- description of the zone returned by lease_zone
+        """
+        self.pool_url = pool_url
+        self.project_name = leased_zone['project_name']
+        self.interval = leased_zone.get('lease_duration', 600) / 3
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        """Renew the lease every third of its duration until stopped."""
+        while not self.stopped.wait(self.interval):
+            try:
+                renew_zone(self.pool_url, self.project_name)
+
+            except Exception as e:
+                logging.error('failed to renew lease of pool zone [{}]'.format(self.project_name))
+                logging.error(e)
+
+    def start(self):
+        """Start renewing the lease."""
+        self.thread.start()
+
+    def stop(self):
+        """Stop renewing the lease."""
+        self.stopped.set()
+        self.thread.join()
+
+
+def return_zone(pool_url, project_name, recycle=False):
+    """Return a leased zone to the pool server.
+
+    Arguments:
+    pool_url -- URL of the pool server (e.g. http://localhost:8740)
+    project_name -- docker-compose project name of the leased zone
+    recycle -- if True, the zone is put back as a ready zone; otherwise, it is torn down
+    """
+    return post(pool_url, '/return', {'project_name': project_name, 'recycle': recycle})
+
+
+if __name__ == "__main__":
+    import argparse
+    import client_cache
+    import logs
+
+    parser = argparse.ArgumentParser(description='Keep a pool of set up iRODS zones ready to be leased by test jobs.')
+    parser.add_argument('--combination', '-c', metavar='OS_PLATFORM_IMAGE DATABASE_IMAGE', dest='combinations', nargs=2, action='append',
+                        help='repo:tag of the OS platform and database images to keep zones for. May be repeated. (Default: every project in projects/)')
+    parser.add_argument('--size', '-n', metavar='ZONES_PER_COMBINATION', dest='size', type=int, default=1,
+                        help='Number of ready zones to keep for each combination. (Default: %(default)s)')
+    parser.add_argument('--lease-duration', metavar='SECONDS', dest='lease_duration', type=float, default=600,
+                        help='Seconds after which a lease which has not been renewed expires and its zone is torn down. (Default: %(default)s)')
+    parser.add_argument('--port', metavar='PORT', dest='port', type=int, default=8740,
+                        help='Port on which to listen for lease and return requests. (Default: %(default)s)')
+    parser.add_argument('--consumer-count', metavar='CONSUMER_COUNT', dest='consumer_count', type=int, default=3,
+                        help='Number of iRODS catalog service consumers to run in each zone. (Default: %(default)s)')
+    parser.add_argument('--package-directory', metavar='PATH_TO_DIRECTORY_WITH_PACKAGES', type=str, dest='package_directory',
+                        help='Path to local directory which contains iRODS packages to be installed')
+    parser.add_argument('--package-version', metavar='PACKAGE_VERSION_TO_DOWNLOAD', type=str, dest='package_version',
+                        help='Version of iRODS to download and install.')
+    parser.add_argument('--odbc-driver-path', metavar='PATH_TO_ODBC_DRIVER_ARCHIVE', dest='odbc_driver', type=str,
+                        help='Path to the ODBC driver archive file on the local machine. If not provided, the driver will be downloaded.')
+    parser.add_argument('--package-cache', dest='use_package_cache', action='store_true',
+                        help='If indicated, zones install packages through the package cache shared by the zones on this host.')
+    parser.add_argument('--use-snapshots', dest='use_snapshots', action='store_true',
+                        help='If indicated, zones start from (or save) a snapshot of a set up zone.')
+    parser.add_argument('--verbose', '-v', dest='verbosity', action='count', default=1,
+                        help='Increase the level of output to stdout. CRITICAL and ERROR messages will always be printed.')
+
+    args = parser.parse_args()
+
+    if args.package_directory and args.package_version:
+        print('--package-directory and --package-version are incompatible')
+        exit(1)
+
+    logs.configure(args.verbosity)
+
+    zone_pool_instance = zone_pool(client_cache.shared_client(),
+                                   args.combinations or matrix.list_combinations(),
+                                   args.size,
+                                   bring_up_options={
+                                       'package_directory': args.package_directory,
+                                       'package_version': args.package_version,
+                                       'odbc_driver': args.odbc_driver,
+                                       'consumer_count': args.consumer_count,
+                                       'use_snapshots': args.use_snapshots,
+                                       'use_package_cache': args.use_package_cache
+                                   },
+                                   lease_duration=args.lease_duration)
+
+    server = http.server.ThreadingHTTPServer(('', args.port), pool_request_handler)
+    server.zone_pool = zone_pool_instance
+
+    zone_pool_instance.fill()
+    threading.Thread(target=zone_pool_instance.watch_leases, daemon=True).start()
+
+    logging.warning('pool listening on port [{}]'.format(args.port))
+
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        logging.warning('stopping pool')
+
+    finally:
+        server.server_close()
+        zone_pool_instance.stop()
@@ -0,0 +1,160 @@
+# grown-up modules
+import logging
+import random
+import time
+
+# local modules
+import execute
+import tracing
+
+# Seconds to wait for each kind of server before giving up (see configure_deadlines)
+deadlines = {'database': 180, 'provider': 120, 'consumer': 120}
+
+
+def configure_deadlines(**phase_deadlines):
+    """Override the number of seconds to wait for servers to become ready in each phase.
+
+    Arguments:
+    phase_deadlines -- seconds keyed by phase: database, provider or consumer
+    """
+    for phase, seconds in phase_deadlines.items():
+        if phase not in deadlines:
+            raise ValueError('unknown readiness phase [{}]'.format(phase))
+
+        deadlines[phase] = float(seconds)
+
+
+def parse_deadline(text):
+    """Return the (phase, seconds) pair described by `text` of the form PHASE=SECONDS.
+
+    Arguments:
+    text -- phase and number of seconds separated by '=' (e.g. database=300)
+    """
+    phase, _, seconds = text.partition('=')
+    if phase not in deadlines or not seconds:
+        raise ValueError('expected PHASE=SECONDS with PHASE one of {0} [{1}]'.format(sorted(deadlines), text))
+
+    return phase, float(seconds)
+
+
+def wait_until(probe, description, deadline, initial_interval=0.1, max_interval=5.0):
+    """Call `probe` until it returns True, backing off between attempts, or raise at the deadline.
+
+    The interval between attempts doubles (with a little jitter so that many waiters do not
+    poll in lockstep) up to `max_interval`. Exceptions raised by `probe` count as not ready.
+
+    Returns the number of seconds spent waiting.
+
+    Arguments:
+    probe -- callable taking no arguments which returns True when the thing is ready
+    description -- what is being waited for, for messages (e.g. database [project_db_1])
+    deadline -- seconds after which to give up
+    initial_interval -- seconds to wait after the first failed attempt
+    max_interval -- most seconds to wait between attempts
+    """
+    start_time = time.time()
+    interval = initial_interval
+    attempts = 0
+
+    with tracing.span('wait for ' + description):
+        while True:
+            attempts += 1
+
+            try:
+                if probe():
+                    elapsed = time.time() - start_time
+                    logging.info('ready after [{0:.1f}s] [{1}]'.format(elapsed, description))
+                    return elapsed
+
+            except Exception as e:
+                logging.debug('readiness probe raised [{0}] [{1}]'.format(e, description))
+
+            remaining = start_time + deadline - time.time()
+            if remaining <= 0:
+                raise RuntimeError('timed out waiting for {0} [attempts=[{1}], deadline=[{2}s]]'
+                                   .format(description, attempts, deadline))
+
+            logging.debug('waiting for {0} [attempt=[{1}]]'.format(description, attempts))
+
+            time.sleep(min(remaining, interval * random.uniform(0.8, 1.2)))
+            interval = min(interval * 2, max_interval)
+
+
+def port_probe_command(host, port):
+    """Return the command which succeeds if a TCP connection to `host`:`port` can be made.
+
+    Arguments:
+    host -- hostname or address to connect to
+    port -- TCP port to connect to
+    """
+    # bash connects on redirection to /dev/tcp; timeout covers addresses which drop packets
+    return ['timeout', '5', 'bash', '-c', 'exec 3<>"/dev/tcp/$1/$2"', 'bash', host, str(port)]
+
+
+def port_is_open(container, host, port):
+    """Return True if a TCP connection to `host`:`port` can be made from inside `container`.
+
+    Arguments:
+    container -- docker container from which the connection is made
+    host -- hostname or address to connect to
+    port -- TCP port to connect to
+    """
+    return execute.execute_command(container, port_probe_command(host, port)) == 0
+
+
+def wait_for_port(container, host, port, phase):
+    """Wait until `host`:`port` accepts connections from inside `container`.
+
+    Arguments:
+    container -- docker container from which the connection is made
+    host -- hostname or address to connect to
+    port -- TCP port to connect to
+    phase -- readiness phase whose deadline applies: database, provider or consumer
+    """
+    return wait_until(lambda: port_is_open(container, host, port),
+                      'port [{0}:{1}] from [{2}]'.format(host, port, container.name),
+                      deadlines[phase])
+
+
+def wait_for_database(strategy):
+    """Wait until the database server behind a database setup strategy accepts connections.
+
+    Arguments:
+    strategy -- database_setup.database_setup_strategy for the database container
+    """
+    return wait_until(strategy.is_ready,
+                      'database [{}]'.format(strategy.container.name),
+                      deadlines['database'])
+
+
+def control_plane_port(container):
+    """Return the control plane port configured for the iRODS server in `container`, or None.
+
+    Servers which have no control plane (or have not been set up yet) do not name a port in
+    /etc/irods/server_config.json.
+
+    Arguments:
+    container -- docker container with iRODS installed and set up
+    """
+    cmd = ['bash', '-c', 'grep -o \'"server_control_plane_port": *[0-9]*\' /etc/irods/server_config.json']
+    result = container.exec_run(cmd)
+    if result.exit_code != 0:
+        return None
+
+    port = result.output.decode('utf-8').split(':')[-1].strip()
+    return int(port) if port.isdigit() else None
+
+
+def wait_for_irods_server(container, zone_port=1247, phase='provider'):
+    """Wait until the iRODS server in `container` is serving its zone port and control plane.
+
+    Arguments:
+    container -- docker container running the iRODS server
+    zone_port -- port on which the iRODS server accepts connections
+    phase -- readiness phase whose deadline applies: provider or consumer
+    """
+    wait_for_port(container, 'localhost', zone_port, phase)
+
+    port = control_plane_port(container)
+    if port:
+        wait_for_port(container, 'localhost', port, phase)
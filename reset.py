@@ -0,0 +1,223 @@
+# grown-up modules
+import logging
+import os
+import time
+
+# local modules
+import context
+import database_setup
+import execute
+import irods_setup
+
+def baseline_name(database_name):
+    """Return the name of the saved baseline for the iRODS database.
+
+    Arguments:
+    database_name -- name of the iRODS database
+    """
+    return '{}_baseline'.format(database_name)
+
+
+def irods_containers(docker_client, compose_project):
+    """Return the iRODS catalog service provider and consumer containers in `compose_project`.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker-compose project
+    compose_project -- compose.Project in which the iRODS servers are running
+    """
+    return [docker_client.containers.get(c.name) for c in compose_project.containers(
+        service_names=[context.irods_catalog_provider_service(),
+                       context.irods_catalog_consumer_service()])]
+
+
+def for_each_container(function, containers):
+    """Call `function` on every container concurrently and raise if any of the calls failed.
+
+    Arguments:
+    function -- callable which takes a container as its only argument
+    containers -- list of containers on which `function` is called
+    """
+    if execute.for_each_container(function, containers) != 0:
+        raise RuntimeError('failed to reset one or more containers')
+
+
+def stop_irods_servers(docker_client, compose_project):
+    """Stop the iRODS servers in the zone, consumers first.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker-compose project
+    compose_project -- compose.Project in which the iRODS servers are running
+    """
+    containers = irods_containers(docker_client, compose_project)
+
+    for_each_container(irods_setup.stop_irods_server,
+                       [c for c in containers if context.is_irods_catalog_consumer_container(c)])
+
+    for_each_container(irods_setup.stop_irods_server,
+                       [c for c in containers if context.is_irods_catalog_provider_container(c)])
+
+
+def start_irods_servers(docker_client, compose_project):
+    """Start the iRODS servers in the zone, provider first.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker-compose project
+    compose_project -- compose.Project in which the iRODS servers are running
+    """
+    containers = irods_containers(docker_client, compose_project)
+
+    for_each_container(irods_setup.start_irods_server,
+                       [c for c in containers if context.is_irods_catalog_provider_container(c)])
+
+    for_each_container(irods_setup.start_irods_server,
+                       [c for c in containers if context.is_irods_catalog_consumer_container(c)])
+
+
+def wipe_vault(container, vault_directory=None, log_directory=None):
+    """Remove everything in the vault (and, optionally, the log directory) of an iRODS server.
+
+    Arguments:
+    container -- docker container running an iRODS server
+    vault_directory -- path to the vault of the default resource (default: /var/lib/irods/Vault)
+    log_directory -- if provided, the contents of this directory are removed as well
+    """
+    if not vault_directory:
+        vault_directory = os.path.join(context.irods_home(), 'Vault')
+
+    directories = [vault_directory] + ([log_directory] if log_directory else [])
+
+    for d in directories:
+        ec = execute.execute_command(container, 'find {} -mindepth 1 -delete'.format(d))
+        if ec != 0:
+            raise RuntimeError('failed to wipe directory [ec=[{0}], directory=[{1}], container=[{2}]]'
+                               .format(ec, d, container.name))
+
+
+def save_baseline(docker_client,
+                  compose_project,
+                  database_image,
+                  service_instance=1,
+                  database_name='ICAT'):
+    """Save the current catalog as the baseline to which reset_zone restores the zone.
+
+    The iRODS servers hold connections to the catalog, so they are stopped while the baseline
+    is saved and started again afterwards.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker-compose project
+    compose_project -- compose.Project in which the iRODS zone is set up
+    database_image -- repo:tag for the docker image of the database server
+    service_instance -- service instance number for the database service being targeted
+    database_name -- name of the iRODS database
+    """
+    db_container = docker_client.containers.get(
+        context.irods_catalog_database_container(compose_project.name, service_instance))
+
+    logging.warning('saving catalog baseline [{}]'.format(db_container.name))
+
+    strat = database_setup.make_strategy(database_image, db_container)
+
+    stop_irods_servers(docker_client, compose_project)
+
+    ec = strat.save_baseline(database_name, baseline_name(database_name))
+    if ec != 0:
+        raise RuntimeError('failed to save catalog baseline [ec=[{0}], container=[{1}]]'
+                           .format(ec, db_container.name))
+
+    start_irods_servers(docker_client, compose_project)
+
+
+def reset_zone(docker_client,
+               compose_project,
+               database_image,
+               service_instance=1,
+               database_name='ICAT',
+               database_user='irods',
+               wipe_logs=True):
+    """Return a standing zone to the state it was in when save_baseline was called.
+
+    The iRODS servers are stopped, the catalog is restored from the baseline, the vaults (and
+    logs) are emptied, and the servers are started again.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker-compose project
+    compose_project -- compose.Project in which the iRODS zone is set up
+    database_image -- repo:tag for the docker image of the database server
+    service_instance -- service instance number for the database service being targeted
+    database_name -- name of the iRODS database
+    database_user -- name of the iRODS database user
+    wipe_logs -- if True, the iRODS server logs are removed as well
+    """
+    start_time = time.time()
+
+    db_container = docker_client.containers.get(
+        context.irods_catalog_database_container(compose_project.name, service_instance))
+
+    logging.warning('resetting zone [{}]'.format(compose_project.name))
+
+    strat = database_setup.make_strategy(database_image, db_container)
+
+    stop_irods_servers(docker_client, compose_project)
+
+    ec = strat.restore_baseline(database_name, baseline_name(database_name))
+    if ec != 0:
+        raise RuntimeError('failed to restore catalog baseline [ec=[{0}], container=[{1}]]'
+                           .format(ec, db_container.name))
+
+    ec = strat.grant_privileges(database_name, database_user)
+    if ec != 0:
+        raise RuntimeError('failed to grant privileges to user [{0}] on database [{1}]'
+                           .format(database_user, database_name))
+
+    log_directory = os.path.join(context.irods_home(), 'log') if wipe_logs else None
+    for_each_container(lambda c: wipe_vault(c, log_directory=log_directory),
+                       irods_containers(docker_client, compose_project))
+
+    start_irods_servers(docker_client, compose_project)
+
+    logging.warning('reset zone in [{0:.1f}s] [{1}]'.format(time.time() - start_time, compose_project.name))
+
+
+if __name__ == "__main__":
+    import argparse
+    import client_cache
+    import compose.cli.command
+    import logs
+
+    parser = argparse.ArgumentParser(description='Reset the catalog, vaults, and servers of a set up iRODS zone to a saved baseline.')
+    parser.add_argument('--project-directory', metavar='PATH_TO_PROJECT_DIRECTORY', type=str, dest='project_directory', default='.',
+                        help='Path to the docker-compose project which is running the zone.')
+    parser.add_argument('--project-name', metavar='PROJECT_NAME', type=str, dest='project_name',
+                        help='Name of the docker-compose project which is running the zone.')
+    parser.add_argument('--database-image', '-d', metavar='DATABASE_IMAGE_REPO_AND_TAG', dest='database', type=str,
+                        help='The repo:tag of the database image to use')
+    parser.add_argument('--save-baseline', dest='save_baseline', action='store_true',
+                        help='If indicated, save the current state of the catalog as the baseline instead of resetting.')
+    parser.add_argument('--keep-logs', dest='wipe_logs', action='store_false',
+                        help='If indicated, the iRODS server logs are not removed when resetting.')
+    parser.add_argument('--verbose', '-v', dest='verbosity', action='count', default=1,
+                        help='Increase the level of output to stdout. CRITICAL and ERROR messages will always be printed.')
+
+    args = parser.parse_args()
+
+    logs.configure(args.verbosity)
+
+    compose_project = compose.cli.command.get_project(os.path.abspath(args.project_directory),
+                                                      project_name=args.project_name)
+
+    database = args.database
+    if not database:
+        database = context.image_repo_and_tag_string(
+            context.database_image_repo_and_tag(args.project_name or compose_project.name))
+
+        logging.debug('derived database image tag [{}]'.format(database))
+
+    try:
+        if args.save_baseline:
+            save_baseline(client_cache.shared_client(), compose_project, database)
+        else:
+            reset_zone(client_cache.shared_client(), compose_project, database, wipe_logs=args.wipe_logs)
+
+    except Exception as e:
+        logging.critical(e)
+        exit(1)
@@ -1,16 +1,27 @@
 # grown-up modules
 import compose.cli.command
 import docker
+import errno
+import functools
 import logging
 import os
 
 # local modules
+import checkpoint
+import client_cache
 import context
 import database_setup
 import execute
 import install
 import irods_setup
 import irods_test_config
+import odbc_setup
+import package_cache
+import readiness
+import scheduler
+import snapshot
+import test_results
+import tracing
 
 def job_name(project_name, prefix=None):
     """Construct unique job name based on the docker-compose project name.
@@ -49,12 +60,472 @@ def make_output_directory(dirname, basename):
     return directory
 
 
+def concurrency_limits(consumer_count, overrides=None):
+    """Return the number of containers worked on at the same time in each phase of a zone's life.
+
+    Doing every container at once stops paying off well before a zone has dozens of consumers:
+    package installs compete for the host's CPUs and disks, every consumer registers with the
+    catalog service provider while it is set up, and network reconnections for the test
+    hostnames and log copies are all served by the one docker daemon.
+
+    Returns a dict with the keys install, setup (of consumers), configure (test hostnames and
+    configuration) and logs.
+
+    Arguments:
+    consumer_count -- number of iRODS catalog service consumers in the zone
+    overrides -- dict of phase names to limits which replace the defaults
+    """
+    servers = consumer_count + 1
+
+    limits = {
+        'install': min(servers, max(4, os.cpu_count() or 1)),
+        'setup': max(1, min(consumer_count, 8)),
+        'configure': min(servers, 16),
+        'logs': min(servers, 16)
+    }
+
+    for phase, limit in (overrides or dict()).items():
+        if phase not in limits:
+            raise ValueError('unknown phase [{}]'.format(phase))
+
+        limits[phase] = int(limit)
+
+    return limits
+
+
+def parse_concurrency_limit(text):
+    """Return the (phase, limit) pair described by `text` of the form PHASE=COUNT.
+
+    Arguments:
+    text -- phase and number of containers separated by '=' (e.g. setup=4)
+    """
+    phase, _, count = text.partition('=')
+    if phase not in concurrency_limits(0) or not count.isdigit() or int(count) < 1:
+        raise ValueError('expected PHASE=COUNT with PHASE one of {0} [{1}]'.format(sorted(concurrency_limits(0)), text))
+
+    return phase, int(count)
+
+
+@tracing.traced('group')
+def bring_up_zone(docker_client,
+                  compose_project,
+                  platform,
+                  database,
+                  package_directory=None,
+                  package_version=None,
+                  odbc_driver=None,
+                  consumer_count=3,
+                  use_snapshots=False,
+                  use_package_cache=False,
+                  checkpoints=False,
+                  concurrency=None):
+    """Bring up the docker-compose project and set up an iRODS zone for testing.
+
+    Returns the list of containers in the docker-compose project.
+
+    If `use_snapshots` is True and a snapshot of a zone set up with the same inputs exists, the
+    containers are created from the snapshot and every setup step is skipped. Otherwise, the
+    zone is set up from scratch and then saved as a snapshot for later runs.
+
+    If `checkpoints` is True, each setup phase is recorded in its container when it completes
+    (see checkpoint.py). Containers of the zone which already exist (running or stopped) are
+    reused: stopped ones are started, and only the phases which have not completed in them are
+    run. If the whole zone exists, it is not brought up again.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker-compose project
+    compose_project -- compose.Project which will be brought up to host the iRODS zone
+    platform -- repo:tag for the docker image of the platform running the iRODS servers
+    database -- repo:tag for the docker image of the database server
+    package_directory -- path to local directory which contains iRODS packages to be installed
+    package_version -- version of the official iRODS packages to install (default: latest)
+    odbc_driver -- path to the local archive file containing the ODBC driver
+    consumer_count -- number of iRODS catalog service consumers to run in the zone
+    use_snapshots -- if True, restore the zone from (or save it to) a snapshot
+    use_package_cache -- if True, install packages through the package cache (see package_cache.py)
+    checkpoints -- if True, reuse an existing zone and skip (or record) completed setup phases
+    concurrency -- dict of phase names to the number of containers worked on at the same time
+                   in that phase (default: concurrency_limits(consumer_count))
+    """
+    provider = context.irods_catalog_provider_container(compose_project.name)
+    consumers = [context.irods_catalog_consumer_container(compose_project.name, i + 1)
+                 for i in range(consumer_count)]
+    catalog_database = context.irods_catalog_database_container(compose_project.name)
+
+    completed = dict()
+    existing = list()
+
+    if checkpoints:
+        existing = compose_project.containers(stopped=True)
+
+        if existing:
+            logging.warning('reusing existing zone [{}]'.format(compose_project.name))
+
+            # The checkpoints are read from inside the containers, so they must be running
+            running = set(c.name for c in compose_project.containers())
+            for c in existing:
+                if c.name not in running:
+                    logging.info('starting stopped container [{}]'.format(c.name))
+                    docker_client.containers.get(c.name).start()
+
+            completed = checkpoint.zone_checkpoints([docker_client.containers.get(c.name) for c in existing])
+
+    # A zone which is only partly there is brought up, which creates the missing containers
+    reused = existing if set([catalog_database, provider] + consumers) <= set(c.name for c in existing) else list()
+
+    def done(container_name, phase):
+        return phase in completed.get(container_name, set())
+
+    if reused and done(catalog_database, 'catalog') and all(
+            done(c, phase) for c in [provider] + consumers for phase in ['install', 'setup', 'configure']):
+        logging.warning('every setup phase has completed [{}]'.format(compose_project.name))
+        return reused
+
+    def checkpointed(container_name, phase, function):
+        """Return a task which runs `function` unless `phase` has already completed in the container."""
+        def run():
+            if done(container_name, phase):
+                logging.info('skipping completed phase [{0}] [{1}]'.format(phase, container_name))
+                return None
+
+            result = function()
+
+            if checkpoints:
+                checkpoint.mark_phase_completed(docker_client.containers.get(container_name), phase)
+
+            return result
+
+        return run
+
+    key = None
+    if use_snapshots and not existing:
+        key = snapshot.snapshot_key(platform,
+                                    database,
+                                    package_directory=package_directory,
+                                    package_version=package_version,
+                                    odbc_driver=odbc_driver,
+                                    consumer_count=consumer_count)
+
+        if key:
+            containers = snapshot.restore_zone(docker_client, compose_project, key, database_image=database)
+            if containers:
+                return containers
+
+    graph = scheduler.task_graph(compose_project.name)
+
+    limits = concurrency_limits(consumer_count, concurrency)
+    for phase in ['install', 'setup', 'configure']:
+        graph.limit(phase, limits[phase])
+
+    # Bring up the services
+    def up():
+        if reused:
+            return reused
+
+        logging.debug('bringing up project [{}]'.format(compose_project.name))
+        containers = compose_project.up(scale_override={
+            context.irods_catalog_consumer_service(): consumer_count
+        })
+
+        # Containers from an earlier zone with the same names are gone now, and so are the
+        # checkpoints of any existing container which docker-compose recreated
+        existing_ids = {c.name: c.id for c in existing}
+        for c in containers:
+            client_cache.invalidate(docker_client, c.name)
+
+            if existing_ids.get(c.name) != c.id:
+                completed.pop(c.name, None)
+
+        return containers
+
+    graph.add('up', up)
+
+    # Anything which only touches the local machine can happen while the containers come up
+    graph.add('odbc driver', lambda: odbc_setup.fetch_odbc_driver(platform, database, odbc_driver))
+
+    if use_package_cache:
+        graph.add('package cache', lambda: package_cache.start_package_cache(docker_client))
+
+    # TODO: install iRODS externals packages
+
+    # Install iRODS packages
+    def installed():
+        return all(done(c, 'install') for c in [provider] + consumers)
+
+    if package_directory:
+        logging.warning('installing iRODS packages from directory [{}]'
+                        .format(package_directory))
+
+        packages = install.get_list_of_package_paths(context.image_repo(platform),
+                                                     package_directory,
+                                                     install.irods_package_names(context.image_repo(database)))
+
+    if package_directory and use_package_cache:
+        # The packages are served from a local repository so that their dependencies are
+        # resolved (and cached) by the package manager like any other install
+        graph.add('publish packages',
+                  lambda: None if installed() else package_cache.publish_packages(graph.results['package cache'],
+                                                                                  packages,
+                                                                                  context.image_repo(platform)),
+                  ['package cache'])
+
+        install_dependencies = ['up', 'publish packages']
+
+        def install_packages(container_name):
+            repository_path, specs = graph.results['publish packages']
+            return install.install_packages_through_cache_on_container(docker_client,
+                                                                       docker_client.containers.get(container_name),
+                                                                       specs,
+                                                                       context.image_repo(platform),
+                                                                       repository_path=repository_path)
+
+    elif package_directory:
+        # The packages are read once and streamed into every iRODS container at the same time
+        graph.add('copy packages',
+                  lambda: None if installed() else install.copy_packages_to_containers(docker_client,
+                                                                                       graph.results['up'],
+                                                                                       packages),
+                  ['up'])
+
+        install_dependencies = ['copy packages']
+
+        def install_packages(container_name):
+            return install.install_local_packages_on_container(docker_client,
+                                                               docker_client.containers.get(container_name),
+                                                               packages,
+                                                               None,
+                                                               context.image_repo(platform))
+    else:
+        # Even if no version was provided, we default to using the latest official release
+        logging.warning('installing official iRODS packages [{}]'
+                        .format(package_version))
+
+        packages = install.official_package_list(context.image_repo(database), package_version)
+
+        install_dependencies = ['up', 'package cache'] if use_package_cache else ['up']
+
+        def install_packages(container_name):
+            if use_package_cache:
+                return install.install_packages_through_cache_on_container(docker_client,
+                                                                           docker_client.containers.get(container_name),
+                                                                           packages,
+                                                                           context.image_repo(platform))
+
+            return install.install_official_packages_on_container(docker_client,
+                                                                  docker_client.containers.get(container_name),
+                                                                  packages,
+                                                                  context.image_repo(platform))
+
+    def install_task(container_name):
+        ec = install_packages(container_name)
+        if ec != 0:
+            raise RuntimeError('failed to install iRODS packages [ec=[{0}], container=[{1}]]'
+                               .format(ec, container_name))
+
+    for c in [provider] + consumers:
+        graph.add('install ' + c,
+                  checkpointed(c, 'install', functools.partial(install_task, c)),
+                  install_dependencies,
+                  pool='install')
+
+    # The catalog only needs the database server, so it is set up while packages are installed
+    graph.add('catalog',
+              checkpointed(catalog_database, 'catalog',
+                           lambda: database_setup.setup_catalog(docker_client, compose_project, database)),
+              ['up'])
+
+    graph.add('setup ' + provider,
+              checkpointed(provider, 'setup',
+                           lambda: irods_setup.setup_irods_catalog_provider(docker_client,
+                                                                            compose_project,
+                                                                            platform,
+                                                                            database,
+                                                                            odbc_driver=graph.results['odbc driver'])),
+              ['install ' + provider, 'catalog', 'odbc driver'])
+
+    for i, c in enumerate(consumers):
+        graph.add('setup ' + c,
+                  checkpointed(c, 'setup',
+                               functools.partial(irods_setup.setup_irods_catalog_consumer,
+                                                 docker_client,
+                                                 compose_project,
+                                                 platform,
+                                                 database,
+                                                 consumer_service_instance=i + 1)),
+                  ['install ' + c, 'setup ' + provider],
+                  pool='setup')
+
+    # Configure the containers for running iRODS automated tests
+    graph.add('network', lambda: irods_test_config.project_network(docker_client, compose_project), ['up'])
+
+    def configure_task(container_name):
+        irods_test_config.configure_container_for_testing(docker_client.containers.get(container_name),
+                                                          graph.results['network'])
+
+    # Consumers are configured as soon as their own setup is done. Configuring the provider
+    # reconnects it to the network, so it waits until no consumer is still being set up.
+    for c in consumers:
+        graph.add('configure ' + c,
+                  checkpointed(c, 'configure', functools.partial(configure_task, c)),
+                  ['setup ' + c, 'network'],
+                  pool='configure')
+
+    graph.add('configure ' + provider,
+              checkpointed(provider, 'configure', functools.partial(configure_task, provider)),
+              ['setup ' + provider, 'network'] + ['setup ' + c for c in consumers],
+              pool='configure')
+
+    graph.run()
+
+    containers = graph.results['up']
+
+    if key:
+        snapshot.save_zone(docker_client, compose_project, database, key)
+
+    return containers
+
+
+def target_container(docker_client, compose_project, target_service_instance):
+    """Return the container in `compose_project` on which test commands will be executed.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker-compose project
+    compose_project -- compose.Project in which the iRODS servers are running
+    target_service_instance -- service name and instance number, either as a list or as a
+                               space-delimited string (e.g. "irods-catalog-provider 1")
+    """
+    if isinstance(target_service_instance, str):
+        target_service_instance = target_service_instance.split()
+
+    logging.debug('target service instance [{}]'.format(target_service_instance))
+    target_service_name, target_instance = target_service_instance
+
+    container = docker_client.containers.get(
+        context.container_name(compose_project.name,
+                               target_service_name,
+                               target_instance)
+    )
+    logging.debug('got container to run on [{}]'.format(container.name))
+
+    return container
+
+
+def command_marker_variable():
+    """Return the environment variable which marks the processes of each command run by run_commands."""
+    return 'IRODS_TEST_COMMAND_ID'
+
+
+def kill_marked_processes_command(marker):
+    """Return a command which sends SIGTERM to every process marked with `marker`.
+
+    Every process started by a command inherits its environment, so the whole process tree is
+    found without having to match its command lines.
+
+    Arguments:
+    marker -- value of command_marker_variable() in the environment of the processes
+    """
+    script = ('for e in /proc/[0-9]*/environ; do '
+              'if tr "\\0" "\\n" < "$e" 2>/dev/null | grep -qxF -- "$1"; then '
+              'p=${e#/proc/}; kill -TERM "${p%/environ}"; '
+              'fi; done')
+
+    return ['bash', '-c', script, 'bash', '{0}={1}'.format(command_marker_variable(), marker)]
+
+
+def run_commands(container, commands, fail_fast=False, abort_event=None):
+    """Serially execute the list of commands on `container` as the iRODS service account.
+
+    Returns a tuple of the last non-zero exit code (or 0) and the last command to fail.
+
+    If `abort_event` is set while the commands are running (e.g. by logs.log_tailer when a
+    fatal pattern shows up in the server logs), the running command is killed, no further
+    commands are run, and the command which was running is reported as failed.
+
+    Arguments:
+    container -- docker container on which the commands will be executed
+    commands -- list of commands to execute
+    fail_fast -- if True, stop at the first command that returns a non-zero exit code
+    abort_event -- threading.Event which stops the commands when set
+    """
+    import threading
+    import uuid
+
+    state = {'rc': 0, 'last_command_to_fail': None, 'running': None, 'marker': None, 'aborted': False}
+
+    def run():
+        for command in list(commands):
+            if state['aborted']:
+                break
+
+            state['running'] = command
+            state['marker'] = uuid.uuid4().hex
+
+            with tracing.span(command, 'phase', container=container.name):
+                ec = execute.execute_command(container,
+                                             command,
+                                             user='irods',
+                                             workdir=context.irods_home(),
+                                             stream_output=True,
+                                             environment={command_marker_variable(): state['marker']})
+
+            state['running'] = None
+
+            if ec != 0:
+                state['rc'] = ec
+                state['last_command_to_fail'] = command
+                logging.warning('command exited with error code [{}] [{}] [{}]'
+                              .format(ec, command, container.name))
+
+                if fail_fast:
+                    logging.critical('command failed [{}]'.format(command))
+                    break
+
+    if abort_event is None:
+        run()
+
+    else:
+        # The commands run in the background so that this thread can stop waiting for them
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+
+        while thread.is_alive():
+            if not abort_event.wait(1):
+                continue
+
+            state['aborted'] = True
+            command = state['running']
+            marker = state['marker']
+
+            logging.critical('aborting commands [{}]'.format(container.name))
+
+            if command:
+                state['rc'] = 1
+                state['last_command_to_fail'] = command
+                execute.execute_command(container, kill_marked_processes_command(marker))
+
+            thread.join(30)
+            break
+
+    rc = state['rc']
+    last_command_to_fail = state['last_command_to_fail']
+
+    if rc != 0:
+        logging.error('last command to fail [{}]'.format(last_command_to_fail))
+
+    return rc, last_command_to_fail
+
+
 if __name__ == "__main__":
     import argparse
+    import bring_up_times
+    import governor
     import logs
+    import pool
+    import shard
+    import time
 
     parser = argparse.ArgumentParser(description='Run iRODS tests in a consistent environment.')
-    parser.add_argument('commands', metavar='COMMANDS', nargs='+',
+    parser.add_argument('commands', metavar='COMMANDS', nargs='*',
                         help='Space-delimited list of commands to be run')
     parser.add_argument('--output-directory', '-o', metavar='FULLPATH_TO_DIRECTORY_FOR_OUTPUT', dest='output_directory', type=str,
                         help='Full path to local directory for output from execution.')
@@ -78,6 +549,43 @@ if __name__ == "__main__":
                         help='The service instance on which the command will run represented as "SERVICE_NAME SERVICE_INSTANCE_NUM".')
     parser.add_argument('--fail-fast', dest='fail_fast', action='store_true',
                         help='If indicated, exits on the first command that returns a non-zero exit code.')
+    parser.add_argument('--use-snapshots', dest='use_snapshots', action='store_true',
+                        help='If indicated, start from a snapshot of a zone set up with the same packages and options, or save one after setup.')
+    parser.add_argument('--package-cache', dest='use_package_cache', action='store_true',
+                        help='If indicated, install packages through the package cache shared by the zones on this host (see package_cache.py).')
+    parser.add_argument('--max-command-output-bytes', metavar='BYTES', dest='max_command_output_bytes', type=int, default=16 * 1024 * 1024,
+                        help='Maximum number of bytes of output saved for each command executed in the containers. (Default: %(default)s)')
+    parser.add_argument('--max-log-bytes', metavar='BYTES', dest='max_log_bytes', type=int,
+                        help='Maximum number of bytes of iRODS server logs to collect from each container. The ends of the logs are kept.')
+    parser.add_argument('--tail-logs', dest='tail_logs', action='store_true',
+                        help='If indicated, follow the iRODS server logs of every container while the commands run, printing them and saving them to server_logs.log in the output directory.')
+    parser.add_argument('--fatal-pattern', metavar='REGEX', dest='fatal_pattern', type=str,
+                        help='Stop running commands as soon as a server log line matches this regular expression (implies --tail-logs).')
+    parser.add_argument('--consumer-count', '-n', metavar='CONSUMER_COUNT', dest='consumer_count', type=int, default=3,
+                        help='Number of iRODS catalog service consumers to run in the zone. (Default: %(default)s)')
+    parser.add_argument('--max-concurrency', metavar='PHASE=COUNT', dest='concurrency', type=parse_concurrency_limit, action='append', default=[],
+                        help='Number of containers worked on at the same time in the install, setup, configure or logs phase. May be repeated. (Default: sized for the consumer count)')
+    parser.add_argument('--shards', metavar='SHARD_COUNT', dest='shard_count', type=int, default=1,
+                        help='Number of identical zones across which the test suite is spread. If greater than 1, COMMANDS are ignored and each test is run with --test-command.')
+    parser.add_argument('--test-list', metavar='PATH_TO_TEST_LIST', dest='test_list', type=str,
+                        help='Local JSON file with the list of tests to shard. If not provided, the list is read from the first zone to come up.')
+    parser.add_argument('--test-command', metavar='TEST_COMMAND', dest='test_command', type=str, default=shard.default_test_command(),
+                        help='Command to which each test name is appended when running shards or rerunning failed tests. (Default: "%(default)s")')
+    parser.add_argument('--rerun-failed', metavar='PATH_TO_PREVIOUS_OUTPUT_DIRECTORY', dest='rerun_failed', type=str,
+                        help='Output directory of an earlier job. Only the tests which failed in it are run (each with --test-command), in a fresh zone, and the failures which reproduced are reported apart from the flaky ones. COMMANDS are ignored.')
+    parser.add_argument('--keep-up', dest='keep_up', action='store_true',
+                        help='If indicated, the zone is left running at the end (even if something failed) with each completed setup phase recorded so that --reuse can pick up where it left off.')
+    parser.add_argument('--reuse', dest='reuse', action='store_true',
+                        help='If indicated and the containers of the zone already exist (running or stopped), use them instead of bringing the zone up again and run only the setup phases which have not completed in them. Unless --keep-up is also indicated, the zone is brought down at the end as usual.')
+    parser.add_argument('--pool-url', metavar='POOL_URL', dest='pool_url', type=str,
+                        help='URL of a zone pool (see pool.py) from which to lease a zone which is already set up instead of bringing one up.')
+    parser.add_argument('--pool-timeout', metavar='SECONDS', dest='pool_timeout', type=float,
+                        help='Seconds to wait for a zone from the pool. (Default: wait forever)')
+    parser.add_argument('--recycle-zone', dest='recycle_zone', action='store_true',
+                        help='If indicated, the leased zone is put back in the pool for the next job instead of being torn down.')
+    parser.add_argument('--readiness-deadline', metavar='PHASE=SECONDS', dest='readiness_deadlines', type=readiness.parse_deadline, action='append', default=[],
+                        help='Seconds to wait for the database, provider or consumer servers to accept connections. May be repeated. (Default: {})'
+                        .format(', '.join('{0}={1}'.format(k, v) for k, v in sorted(readiness.deadlines.items()))))
     parser.add_argument('--verbose', '-v', dest='verbosity', action='count', default=1,
                         help='Increase the level of output to stdout. CRITICAL and ERROR messages will always be printed.')
 
@@ -93,14 +601,36 @@ if __name__ == "__main__":
         print('    --project-name of the form (.*<platform_repo>-<platform_tag>-<database_repo>-<database_tag>)')
         exit(1)
 
-    compose_project = compose.cli.command.get_project(os.path.abspath(args.project_directory),
-                                                      project_name=args.project_name)
+    if args.shard_count < 1:
+        print('--shards must be at least 1')
+        exit(1)
 
-    job_name = job_name(compose_project.name, args.job_name)
+    if args.consumer_count < 0:
+        print('--consumer-count must not be negative')
+        exit(1)
 
-    output_directory = make_output_directory(dirname, job_name)
+    if args.shard_count == 1 and not args.commands and not args.rerun_failed:
+        print('COMMANDS are required unless running with --shards or --rerun-failed')
+        exit(1)
 
-    logs.configure(args.verbosity, os.path.join(output_directory, 'script_output.log'))
+    if args.rerun_failed and not os.path.exists(os.path.join(args.rerun_failed, 'test_results.xml')):
+        print('no test_results.xml found in [{}]'.format(args.rerun_failed))
+        exit(1)
+
+    if args.pool_url and args.shard_count > 1:
+        print('--pool-url and --shards are incompatible')
+        exit(1)
+
+    if (args.keep_up or args.reuse) and (args.pool_url or args.shard_count > 1):
+        print('--keep-up and --reuse are incompatible with --pool-url and --shards')
+        exit(1)
+
+    if args.reuse and args.rerun_failed:
+        print('--reuse and --rerun-failed are incompatible because failures are rerun in a fresh zone')
+        exit(1)
+
+    compose_project = compose.cli.command.get_project(os.path.abspath(args.project_directory),
+                                                      project_name=args.project_name)
 
     project_name = args.project_name if args.project_name else compose_project.name
 
@@ -110,6 +640,18 @@ if __name__ == "__main__":
         import tempfile
         dirname = tempfile.mkdtemp(prefix=project_name)
 
+    output_directory = make_output_directory(dirname, job_name(compose_project.name, args.job_name))
+
+    logs.configure(args.verbosity, os.path.join(output_directory, 'script_output.log'))
+
+    # Where the time goes is saved to trace.json and trace_summary.txt at the end of the run
+    tracing.enable()
+
+    # The output of every command executed in the containers is saved in its own file
+    execute.configure_output(os.path.join(output_directory, 'commands'), max_bytes=args.max_command_output_bytes)
+
+    readiness.configure_deadlines(**dict(args.readiness_deadlines))
+
     platform = args.platform
     if not platform:
         platform = context.image_repo_and_tag_string(
@@ -125,90 +667,121 @@ if __name__ == "__main__":
 
         logging.debug('derived database image tag [{}]'.format(database))
 
-    rc = 0
-    last_command_to_fail = None
-    containers = list()
-    docker_client = docker.from_env()
+    rerun_tests = None
+    if args.rerun_failed:
+        rerun_tests = test_results.failed_tests(os.path.join(args.rerun_failed, 'test_results.xml'))
+        if not rerun_tests:
+            logging.warning('no failed tests to rerun [{}]'.format(args.rerun_failed))
+            exit(0)
 
-    try:
-        # Bring up the services
-        logging.debug('bringing up project [{}]'.format(compose_project.name))
-        consumer_count = 3
-        containers = compose_project.up(scale_override={
-            context.irods_catalog_consumer_service(): consumer_count
-        })
+        logging.warning('rerunning [{0}] failed tests [{1}]'.format(len(rerun_tests), args.rerun_failed))
 
-        # TODO: install iRODS externals packages
+        args.commands = [' '.join([args.test_command, t]) for t in rerun_tests]
 
-        # Install iRODS packages
-        if args.package_directory:
-            logging.warning('installing iRODS packages from directory [{}]'
-                            .format(args.package_directory))
+    docker_client = client_cache.shared_client()
 
-            install.install_local_irods_packages(docker_client,
-                                                 context.image_repo(platform),
-                                                 context.image_repo(database),
-                                                 args.package_directory,
-                                                 containers)
+    if args.shard_count > 1:
+        if rerun_tests:
+            test_list = rerun_tests
         else:
-            # Even if no version was provided, we default to using the latest official release
-            logging.warning('installing official iRODS packages [{}]'
-                            .format(args.package_version))
+            test_list = shard.load_test_list(args.test_list) if args.test_list else None
+
+        try:
+            rc = shard.run_sharded(docker_client,
+                                   os.path.abspath(args.project_directory),
+                                   compose_project.name,
+                                   platform,
+                                   database,
+                                   output_directory,
+                                   args.shard_count,
+                                   target_service_instance=args.target_service_instance,
+                                   test_list=test_list,
+                                   test_command=args.test_command,
+                                   package_directory=args.package_directory,
+                                   package_version=args.package_version,
+                                   odbc_driver=args.odbc_driver,
+                                   fail_fast=args.fail_fast,
+                                   use_snapshots=args.use_snapshots,
+                                   use_package_cache=args.use_package_cache,
+                                   max_log_bytes=args.max_log_bytes,
+                                   consumer_count=args.consumer_count,
+                                   concurrency=dict(args.concurrency))
+
+        finally:
+            tracing.write_reports(output_directory)
+            governor.write_stats(os.path.join(output_directory, 'docker_calls.json'))
+
+        if rerun_tests:
+            test_results.compare_rerun(rerun_tests, output_directory)
+
+        exit(rc)
 
-            install.install_official_irods_packages(docker_client,
-                                                    context.image_repo(platform),
-                                                    context.image_repo(database),
-                                                    args.package_version,
-                                                    containers)
+    rc = 0
+    containers = list()
+    container = None
+    leased_zone = None
+    heartbeat = None
+    tailer = None
 
-        database_setup.setup_catalog(docker_client, compose_project, database)
+    if args.pool_url:
+        logging.warning('leasing zone from pool [{}]'.format(args.pool_url))
 
-        irods_setup.setup_irods_catalog_provider(docker_client,
-                                                 compose_project,
-                                                 platform,
-                                                 database,
-                                                 args.odbc_driver)
+        try:
+            leased_zone = pool.lease_zone(args.pool_url, platform, database, timeout=args.pool_timeout)
+
+        except RuntimeError as e:
+            logging.critical(e)
+            exit(1)
+
+        logging.warning('leased zone [{}]'.format(leased_zone['project_name']))
 
-        irods_setup.setup_irods_catalog_consumers(docker_client,
-                                                  compose_project,
-                                                  platform,
-                                                  database)
+        heartbeat = pool.lease_heartbeat(args.pool_url, leased_zone)
+        heartbeat.start()
 
-        # Configure the containers for running iRODS automated tests
-        logging.info('configuring iRODS containers for testing')
-        irods_test_config.configure_irods_testing(docker_client, compose_project)
+        compose_project = compose.cli.command.get_project(leased_zone['project_directory'],
+                                                          project_name=leased_zone['project_name'])
+
+    try:
+        if leased_zone:
+            containers = compose_project.containers()
+        else:
+            start_time = time.time()
+
+            containers = bring_up_zone(docker_client,
+                                       compose_project,
+                                       platform,
+                                       database,
+                                       package_directory=args.package_directory,
+                                       package_version=args.package_version,
+                                       odbc_driver=args.odbc_driver,
+                                       consumer_count=args.consumer_count,
+                                       use_snapshots=args.use_snapshots,
+                                       use_package_cache=args.use_package_cache,
+                                       checkpoints=args.keep_up or args.reuse,
+                                       concurrency=dict(args.concurrency))
+
+            # Zones restored from snapshots or reused are not brought up the same way
+            if not (args.use_snapshots or args.reuse):
+                bring_up_times.record_bring_up(platform, database, args.consumer_count, time.time() - start_time)
 
         # Get the container on which the command is to be executed
-        logging.debug('--target-service-instance [{}]'.format(args.target_service_instance.split()))
-        target_service_name, target_service_instance = args.target_service_instance.split()
+        container = target_container(docker_client, compose_project, args.target_service_instance)
 
-        container = docker_client.containers.get(
-            context.container_name(compose_project.name,
-                                   target_service_name,
-                                   target_service_instance)
-        )
-        logging.debug('got container to run on [{}]'.format(container.name))
-
-        # Serially execute the list of commands provided in the input
-        for command in list(args.commands):
-            ec = execute.execute_command(container,
-                                         command,
-                                         user='irods',
-                                         workdir=context.irods_home(),
-                                         stream_output=True)
-
-            if ec is not 0:
-                rc = ec
-                last_command_to_fail = command
-                logging.warning('command exited with error code [{}] [{}] [{}]'
-                              .format(ec, command, container.name))
+        # A zone from the pool or a reused zone may still hold the reports of earlier tests
+        if leased_zone or args.reuse:
+            test_results.clear_test_reports(container)
 
-                if args.fail_fast:
-                    logging.critical('command failed [{}]'.format(command))
-                    break
+        if args.tail_logs or args.fatal_pattern:
+            tailer = logs.log_tailer(docker_client,
+                                     containers,
+                                     os.path.join(output_directory, 'server_logs.log'),
+                                     fatal_pattern=args.fatal_pattern)
+            tailer.start()
 
-        if rc is not 0:
-            logging.error('last command to fail [{}]'.format(last_command_to_fail))
+        rc, _ = run_commands(container,
+                             args.commands,
+                             fail_fast=args.fail_fast,
+                             abort_event=tailer.fatal if tailer else None)
 
     except Exception as e:
         logging.critical(e)
@@ -216,9 +789,39 @@ if __name__ == "__main__":
         raise
 
     finally:
+        if tailer:
+            tailer.stop()
+
+        if container:
+            try:
+                test_results.collect_results([container], output_directory, platform, database)
+
+            except Exception as e:
+                logging.error('failed to collect test results [{}]'.format(output_directory))
+                logging.error(e)
+
         logging.warning('collecting logs [{}]'.format(output_directory))
-        logs.collect_logs(docker_client, containers, output_directory)
+        logs.collect_logs(docker_client, containers, output_directory, max_bytes=args.max_log_bytes,
+                          max_workers=concurrency_limits(args.consumer_count, dict(args.concurrency))['logs'])
+
+        if leased_zone:
+            heartbeat.stop()
+
+            try:
+                pool.return_zone(args.pool_url, leased_zone['project_name'], recycle=args.recycle_zone)
+
+            except RuntimeError as e:
+                logging.error(e)
+        elif args.keep_up:
+            logging.warning('leaving zone up; run again with --reuse to use it [{}]'.format(compose_project.name))
+        else:
+            with tracing.span('down'):
+                compose_project.down(include_volumes=True, remove_image_type=False)
+
+        tracing.write_reports(output_directory)
+        governor.write_stats(os.path.join(output_directory, 'docker_calls.json'))
 
-        compose_project.down(include_volumes=True, remove_image_type=False)
+    if rerun_tests:
+        test_results.compare_rerun(rerun_tests, output_directory)
 
     exit(rc)
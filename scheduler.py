@@ -0,0 +1,201 @@
+# grown-up modules
+import logging
+import time
+
+# local modules
+import tracing
+
+class task(object):
+    """A named unit of work in a task_graph along with the names of the tasks it depends on."""
+    def __init__(self, name, function, dependencies, pool=None):
+        """Construct a task.
+
+        Arguments:
+        name -- unique name of the task within its graph
+        function -- callable taking no arguments which performs the work
+        dependencies -- names of the tasks which must succeed before this task starts
+        pool -- name of the pool whose limit on running tasks applies to this task (if any)
+        """
+        self.name = name
+        self.function = function
+        self.dependencies = list(dependencies)
+        self.pool = pool
+
+        self.start_time = None
+        self.end_time = None
+
+    def duration(self):
+        """Return the number of seconds the task ran, or 0 if it has not finished."""
+        if self.start_time is None or self.end_time is None:
+            return 0.0
+
+        return self.end_time - self.start_time
+
+
+class task_graph(object):
+    """A directed acyclic graph of tasks which runs each task as soon as its dependencies finish.
+
+    Tasks can only depend on tasks which were already added, so the graph cannot have cycles.
+    The return value of each task is available to later tasks through `results`. Tasks can be
+    placed in named pools to limit how many of a kind run at the same time (see limit).
+    """
+    def __init__(self, name='graph'):
+        """Construct an empty task_graph.
+
+        Arguments:
+        name -- name of the graph used in log messages
+        """
+        self.name = name
+        self.tasks = dict()
+        self.order = list()
+        self.results = dict()
+        self.limits = dict()
+
+    def limit(self, pool, max_running):
+        """Run at most `max_running` tasks of the pool named `pool` at the same time.
+
+        Arguments:
+        pool -- name of the pool
+        max_running -- maximum number of the pool's tasks to run at the same time (None: no limit)
+        """
+        if max_running is not None and max_running < 1:
+            raise ValueError('pool limit must be at least 1 [{0}] [{1}]'.format(pool, self.name))
+
+        self.limits[pool] = max_running
+
+    def add(self, name, function, dependencies=None, pool=None):
+        """Add a task to the graph and return the name of the task.
+
+        Arguments:
+        name -- unique name of the task within the graph
+        function -- callable taking no arguments which performs the work
+        dependencies -- names of tasks already in the graph which must succeed first
+        pool -- name of the pool (see limit) in which the task runs (default: no pool)
+        """
+        if name in self.tasks:
+            raise ValueError('task already in graph [{0}] [{1}]'.format(name, self.name))
+
+        dependencies = dependencies or list()
+        for d in dependencies:
+            if d not in self.tasks:
+                raise ValueError('unknown dependency [{0}] for task [{1}] [{2}]'.format(d, name, self.name))
+
+        self.tasks[name] = task(name, function, dependencies, pool)
+        self.order.append(name)
+
+        return name
+
+    def run_task(self, t):
+        """Run a single task, recording when it started and finished.
+
+        Arguments:
+        t -- the task to run
+        """
+        t.start_time = time.time()
+
+        try:
+            logging.debug('starting task [{0}] [{1}]'.format(t.name, self.name))
+
+            with tracing.span(t.name, 'task', graph=self.name):
+                return t.function()
+
+        finally:
+            t.end_time = time.time()
+            logging.debug('finished task [{0}] [{1}] [{2:.1f}s]'.format(t.name, self.name, t.duration()))
+
+    def run(self, max_workers=None):
+        """Run every task, starting each one as soon as all of its dependencies have succeeded.
+
+        A task whose pool is at its limit waits for one of the pool's tasks to finish, and the
+        waiting tasks of a pool are started in the order in which they were added.
+
+        Tasks which depend (directly or indirectly) on a failed task are skipped. If any task
+        fails, a RuntimeError naming the failed and skipped tasks is raised after every task that
+        could run has finished.
+
+        Returns the dict of task names to the values returned by the tasks.
+
+        Arguments:
+        max_workers -- maximum number of tasks to run at the same time (default: no limit)
+        """
+        import concurrent.futures
+
+        start_time = time.time()
+
+        succeeded = set()
+        failed = dict()
+        skipped = set()
+        waiting = list(self.order)
+        running = dict()
+        pool_usage = dict()
+
+        def pool_is_full(pool):
+            limit = self.limits.get(pool)
+            return pool is not None and limit is not None and pool_usage.get(pool, 0) >= limit
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or max(1, len(self.order))) as executor:
+            while waiting or running:
+                for name in list(waiting):
+                    dependencies = self.tasks[name].dependencies
+
+                    if any(d in failed or d in skipped for d in dependencies):
+                        logging.warning('skipping task because a dependency failed [{0}] [{1}]'
+                                        .format(name, self.name))
+                        skipped.add(name)
+                        waiting.remove(name)
+
+                    elif all(d in succeeded for d in dependencies) and not pool_is_full(self.tasks[name].pool):
+                        pool = self.tasks[name].pool
+                        pool_usage[pool] = pool_usage.get(pool, 0) + 1
+
+                        running[executor.submit(self.run_task, self.tasks[name])] = name
+                        waiting.remove(name)
+
+                if not running:
+                    break
+
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                for f in done:
+                    name = running.pop(f)
+                    pool_usage[self.tasks[name].pool] -= 1
+
+                    try:
+                        self.results[name] = f.result()
+                        succeeded.add(name)
+
+                    except Exception as e:
+                        logging.error('exception raised in task [{0}] [{1}]'.format(name, self.name))
+                        logging.error(e)
+                        failed[name] = e
+
+        logging.info('ran task graph in [{0:.1f}s] [{1}]'.format(time.time() - start_time, self.name))
+        logging.info('critical path [{}]'.format(
+            ' -> '.join('{0} ({1:.1f}s)'.format(t.name, t.duration()) for t in self.critical_path())))
+
+        if failed or skipped:
+            raise RuntimeError('tasks failed [{0}], tasks skipped [{1}] [{2}]'
+                               .format(sorted(failed), sorted(skipped), self.name))
+
+        return self.results
+
+    def critical_path(self):
+        """Return the chain of finished tasks which determined when the last task finished.
+
+        Starting from the task which finished last, each step goes to the dependency which
+        finished last, since that is the one the task was waiting for.
+        """
+        finished = [self.tasks[n] for n in self.order if self.tasks[n].end_time is not None]
+        if not finished:
+            return list()
+
+        path = [max(finished, key=lambda t: t.end_time)]
+
+        while True:
+            dependencies = [self.tasks[d] for d in path[-1].dependencies if self.tasks[d].end_time is not None]
+            if not dependencies:
+                break
+
+            path.append(max(dependencies, key=lambda t: t.end_time))
+
+        return list(reversed(path))
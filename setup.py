@@ -11,6 +11,7 @@ import irods_setup
 
 if __name__ == "__main__":
     import argparse
+    import client_cache
     import logs
 
     parser = argparse.ArgumentParser(description='Setup the iRODS catalog, catalog service provider, and catalog service consumers on a running docker-compose project.')
@@ -36,6 +37,8 @@ if __name__ == "__main__":
                         help='If indicated, skips running the iRODS setup script on the catalog service consumers.')
     parser.add_argument('--odbc-driver-path', metavar='PATH_TO_ODBC_DRIVER_ARCHIVE', dest='odbc_driver', type=str,
                         help='Path to the ODBC driver archive file on the local machine. If not provided, the driver will be downloaded.')
+    parser.add_argument('--async-engine', dest='async_engine', action='store_true',
+                        help='If indicated, run the setup from an asyncio event loop talking to the docker socket instead of from threads.')
     parser.add_argument('--verbose', '-v', dest='verbosity', action='count', default=1,
                         help='Increase the level of output to stdout. CRITICAL and ERROR messages will always be printed.')
 
@@ -43,7 +46,7 @@ if __name__ == "__main__":
 
     logs.configure(args.verbosity)
 
-    docker_client = docker.from_env()
+    docker_client = client_cache.shared_client()
 
     compose_project = compose.cli.command.get_project(
         project_dir=os.path.abspath(args.project_directory),
@@ -77,6 +80,21 @@ if __name__ == "__main__":
         logging.debug('derived database image tag [{}]'.format(database))
 
     try:
+        if args.async_engine:
+            import async_engine
+
+            async_engine.run(async_engine.setup_zone(project_name,
+                                                     platform,
+                                                     database,
+                                                     catalog_service_instance=args.catalog_instance,
+                                                     provider_service_instance=args.irods_csp_instance,
+                                                     consumer_service_instances=args.irods_csc_instances,
+                                                     odbc_driver=args.odbc_driver,
+                                                     setup_catalog_database=args.setup_catalog,
+                                                     setup_provider=args.setup_csp,
+                                                     setup_consumers=args.setup_cscs))
+            exit(0)
+
         if args.setup_catalog:
             database_setup.setup_catalog(docker_client,
                                          compose_project,
@@ -0,0 +1,296 @@
+# grown-up modules
+import compose.cli.command
+import json
+import logging
+import os
+
+# local modules
+import archive
+import context
+import logs
+import run_tests_in_zone
+import test_results
+
+def default_test_list_path():
+    """Return the path inside an iRODS container to the list of tests run by --run_python_suite."""
+    return os.path.join(context.irods_home(), 'scripts', 'core_tests_list.json')
+
+
+def default_test_command():
+    """Return the command to which the name of a single test is appended to run it."""
+    return 'python ./scripts/run_tests.py --xml_output --run_s'
+
+
+def shard_project_name(project_name, shard_index, job_id):
+    """Return a job-unique docker-compose project name for a shard.
+
+    The shard-specific part is prepended so that the platform and database can still be derived
+    from the end of the project name (see context.platform_image_repo_and_tag).
+
+    Arguments:
+    project_name -- docker-compose project name which identifies the type of test being run
+    shard_index -- 0-indexed number of the shard
+    job_id -- string which uniquely identifies the job across the docker host
+    """
+    return '-'.join(['shard{}'.format(shard_index), job_id, project_name])
+
+
+def load_test_list(path):
+    """Return the list of tests in the local JSON file at `path`.
+
+    Arguments:
+    path -- local path to a JSON file containing a list of test names
+    """
+    with open(os.path.abspath(path), 'r') as f:
+        return json.load(f)
+
+
+def discover_test_list(container, test_list_path=None):
+    """Return the list of tests read from the test list file inside `container`.
+
+    Arguments:
+    container -- docker container with iRODS installed
+    test_list_path -- path inside the container to the JSON file containing the list of tests
+    """
+    if not test_list_path:
+        test_list_path = default_test_list_path()
+
+    tests = json.loads(archive.read_file_from_container(container, test_list_path).decode('utf-8'))
+
+    logging.info('discovered [{0}] tests [{1}]'.format(len(tests), container.name))
+
+    return tests
+
+
+def partition(tests, shard_count, durations=None):
+    """Split `tests` into `shard_count` lists which should take about as long as each other to run.
+
+    Without `durations`, tests are dealt round-robin so that neighbouring (often similarly
+    sized) tests end up in different shards. With `durations`, the longest tests are placed
+    first, each in the shard with the least expected work so far; tests which have never been
+    run are expected to take as long as the median known test.
+
+    Arguments:
+    tests -- list of test names
+    shard_count -- number of lists into which the tests are split
+    durations -- dict of test ids to mean durations returned by test_results.indexed_durations
+    """
+    import statistics
+
+    if not durations:
+        return [tests[i::shard_count] for i in range(shard_count)]
+
+    expected = {t: test_results.expected_duration(t, durations) for t in tests}
+
+    known = [d for d in expected.values() if d is not None]
+    default = statistics.median(known) if known else 1.0
+
+    shards = [list() for _ in range(shard_count)]
+    work = [0.0] * shard_count
+
+    for t in sorted(tests, key=lambda t: expected[t] if expected[t] is not None else default, reverse=True):
+        i = work.index(min(work))
+        shards[i].append(t)
+        work[i] += expected[t] if expected[t] is not None else default
+
+    logging.info('expected shard durations [{}]'.format(', '.join('{:.0f}s'.format(w) for w in work)))
+
+    return shards
+
+
+def run_shard(docker_client, compose_project, target_service_instance, tests, test_command, fail_fast=False):
+    """Run each test in `tests` on the target container of a zone and return the exit code.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker-compose project
+    compose_project -- compose.Project in which the iRODS zone is running
+    target_service_instance -- service name and instance number of the container to run on
+    tests -- list of test names to run
+    test_command -- command to which each test name is appended
+    fail_fast -- if True, stop at the first test that fails
+    """
+    container = run_tests_in_zone.target_container(docker_client, compose_project, target_service_instance)
+
+    logging.warning('running [{0}] tests [{1}]'.format(len(tests), container.name))
+
+    rc, _ = run_tests_in_zone.run_commands(container,
+                                           [' '.join([test_command, t]) for t in tests],
+                                           fail_fast=fail_fast)
+
+    return rc
+
+
+def run_sharded(docker_client,
+                project_directory,
+                project_name,
+                platform,
+                database,
+                output_directory,
+                shard_count,
+                target_service_instance='irods-catalog-provider 1',
+                test_list=None,
+                test_command=None,
+                package_directory=None,
+                package_version=None,
+                odbc_driver=None,
+                fail_fast=False,
+                use_snapshots=False,
+                use_package_cache=False,
+                max_log_bytes=None,
+                consumer_count=3,
+                concurrency=None):
+    """Run a test suite spread across `shard_count` identical zones at the same time.
+
+    Each zone is a copy of the docker-compose project at `project_directory` brought up under
+    a job-unique project name. The test list is discovered once, split across the zones that
+    were set up successfully, and the shards are run concurrently. Logs from every zone are
+    collected into `output_directory` and a summary of the shards is written to `shards.json`.
+
+    Returns 0 if every zone came up and every test passed; otherwise, a non-zero exit code.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker-compose projects
+    project_directory -- path to the docker-compose project to replicate
+    project_name -- docker-compose project name from which the shard project names are derived
+    platform -- repo:tag for the docker image of the platform running the iRODS servers
+    database -- repo:tag for the docker image of the database server
+    output_directory -- local directory for the merged output of all the shards
+    shard_count -- number of zones to bring up
+    target_service_instance -- service name and instance number of the container to run on
+    test_list -- list of tests to run (if None, the list is discovered in the first zone)
+    test_command -- command to which each test name is appended
+    package_directory -- path to local directory which contains iRODS packages to be installed
+    package_version -- version of the official iRODS packages to install (default: latest)
+    odbc_driver -- path to the local archive file containing the ODBC driver
+    fail_fast -- if True, each shard stops at its first failing test
+    use_snapshots -- if True, restore each zone from (or save it to) a snapshot
+    use_package_cache -- if True, install packages through the package cache (see package_cache.py)
+    max_log_bytes -- maximum number of bytes of logs to collect from each container (default: no limit)
+    consumer_count -- number of iRODS catalog service consumers to run in each zone
+    concurrency -- dict of phase names to the number of containers worked on at the same time
+                   in each zone (see run_tests_in_zone.concurrency_limits)
+    """
+    import concurrent.futures
+    import uuid
+
+    if not test_command:
+        test_command = default_test_command()
+
+    job_id = uuid.uuid4().hex[:8]
+
+    projects = [compose.cli.command.get_project(project_directory,
+                                                project_name=shard_project_name(project_name, i, job_id))
+                for i in range(shard_count)]
+
+    summary = {p.name: {'up': False, 'tests': [], 'ec': None} for p in projects}
+
+    targets = list()
+
+    rc = 0
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=shard_count) as executor:
+            futures_to_projects = {
+                executor.submit(run_tests_in_zone.bring_up_zone,
+                                docker_client,
+                                p,
+                                platform,
+                                database,
+                                package_directory=package_directory,
+                                package_version=package_version,
+                                odbc_driver=odbc_driver,
+                                consumer_count=consumer_count,
+                                use_snapshots=use_snapshots,
+                                use_package_cache=use_package_cache,
+                                concurrency=concurrency): p for p in projects
+            }
+
+            for f in concurrent.futures.as_completed(futures_to_projects):
+                p = futures_to_projects[f]
+                try:
+                    f.result()
+                    summary[p.name]['up'] = True
+                    logging.info('zone is ready [{}]'.format(p.name))
+
+                except Exception as e:
+                    logging.error('exception raised while bringing up zone [{}]'.format(p.name))
+                    logging.error(e)
+                    rc = 1
+
+        ready = [p for p in projects if summary[p.name]['up']]
+        if not ready:
+            logging.critical('no zones were brought up successfully')
+            return 1
+
+        targets = [run_tests_in_zone.target_container(docker_client, p, target_service_instance) for p in ready]
+
+        if test_list is None:
+            test_list = discover_test_list(targets[0])
+
+        # Tests are balanced by how long they took in earlier runs on the same platform, database and iRODS version
+        durations = test_results.indexed_durations(
+            test_results.index_key(platform, database, test_results.irods_version(targets[0])))
+
+        shards = partition(test_list, len(ready), durations)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(ready)) as executor:
+            futures_to_projects = dict()
+            for p, tests in zip(ready, shards):
+                summary[p.name]['tests'] = tests
+                futures_to_projects[executor.submit(run_shard,
+                                                    docker_client,
+                                                    p,
+                                                    target_service_instance,
+                                                    tests,
+                                                    test_command,
+                                                    fail_fast)] = p
+
+            for f in concurrent.futures.as_completed(futures_to_projects):
+                p = futures_to_projects[f]
+                try:
+                    ec = f.result()
+
+                except Exception as e:
+                    logging.error('exception raised while running shard [{}]'.format(p.name))
+                    logging.error(e)
+                    ec = 1
+
+                summary[p.name]['ec'] = ec
+                if ec != 0:
+                    logging.error('shard failed [ec=[{0}], project=[{1}]]'.format(ec, p.name))
+                    rc = ec
+
+    finally:
+        with open(os.path.join(output_directory, 'shards.json'), 'w') as f:
+            json.dump(summary, f, indent=4)
+
+        if targets:
+            try:
+                test_results.collect_results(targets, output_directory, platform, database)
+
+            except Exception as e:
+                logging.error('failed to collect test results [{}]'.format(output_directory))
+                logging.error(e)
+
+        limits = run_tests_in_zone.concurrency_limits(consumer_count, concurrency)
+
+        def tear_down(p):
+            logs.collect_logs(docker_client, p.containers(), output_directory, max_bytes=max_log_bytes,
+                              max_workers=limits['logs'])
+            p.down(include_volumes=True, remove_image_type=False)
+
+        logging.warning('collecting logs [{}]'.format(output_directory))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=shard_count) as executor:
+            futures_to_projects = {executor.submit(tear_down, p): p for p in projects}
+
+            for f in concurrent.futures.as_completed(futures_to_projects):
+                try:
+                    f.result()
+
+                except Exception as e:
+                    logging.error('exception raised while tearing down zone [{}]'
+                                  .format(futures_to_projects[f].name))
+                    logging.error(e)
+
+    return rc
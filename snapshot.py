@@ -0,0 +1,373 @@
+# grown-up modules
+import hashlib
+import json
+import logging
+import os
+
+# local modules
+import archive
+import client_cache
+import context
+import database_setup
+import install
+import irods_setup
+import irods_test_config
+import readiness
+import tracing
+
+def snapshot_repository():
+    """Return the docker image repository in which zone snapshots are stored."""
+    return 'irods-test-snapshot'
+
+
+def label(name):
+    """Return the fully qualified name of a docker label used to describe snapshot images.
+
+    Arguments:
+    name -- short name of the label (e.g. `key`)
+    """
+    return 'org.irods.test.snapshot.{}'.format(name)
+
+
+def setup_modules():
+    """Return the local modules whose contents determine how a zone is set up."""
+    return ['install.py', 'database_setup.py', 'odbc_setup.py', 'irods_setup.py', 'irods_test_config.py']
+
+
+def snapshot_key(platform,
+                 database,
+                 package_directory=None,
+                 package_version=None,
+                 odbc_driver=None,
+                 consumer_count=3):
+    """Return a key which identifies a fully set up zone, or None if it cannot be identified.
+
+    The key is a digest of the platform and database images, the contents of the iRODS
+    packages (or the official package version), the ODBC driver, the number of consumers, and
+    the local setup modules. A zone set up from the latest official packages has no stable
+    identity, so no key is returned.
+
+    Arguments:
+    platform -- repo:tag for the docker image of the platform running the iRODS servers
+    database -- repo:tag for the docker image of the database server
+    package_directory -- path to local directory which contains iRODS packages to be installed
+    package_version -- version of the official iRODS packages to install
+    odbc_driver -- path to the local archive file containing the ODBC driver
+    consumer_count -- number of iRODS catalog service consumers in the zone
+    """
+    if package_directory:
+        packages = install.get_list_of_package_paths(context.image_repo(platform),
+                                                     package_directory,
+                                                     install.irods_package_names(context.image_repo(database)))
+        packages_digest = [[os.path.basename(p), archive.file_digest(p)] for p in packages]
+    elif package_version:
+        packages_digest = package_version
+    else:
+        logging.info('not using snapshots for latest official packages')
+        return None
+
+    this_directory = os.path.dirname(os.path.abspath(__file__))
+
+    document = {
+        'platform': platform,
+        'database': database,
+        'packages': packages_digest,
+        'odbc_driver': archive.file_digest(odbc_driver) if odbc_driver else None,
+        'consumer_count': consumer_count,
+        'setup': [archive.file_digest(os.path.join(this_directory, m)) for m in setup_modules()]
+    }
+
+    key = hashlib.sha256(json.dumps(document, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+
+    logging.debug('snapshot key [{0}] for [{1}]'.format(key, document))
+
+    return key
+
+
+def list_snapshot_images(docker_client, key=None, tagged_only=True):
+    """Return the docker images which make up snapshots (only those for `key`, if provided).
+
+    An image which was replaced by a later save under the same tag keeps its labels but loses
+    its tag, so only tagged images are returned unless `tagged_only` is False.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker daemon
+    key -- snapshot key as returned by snapshot_key
+    tagged_only -- if False, also return images which are no longer tagged
+    """
+    if key:
+        images = docker_client.images.list(filters={'label': '{0}={1}'.format(label('key'), key)})
+    else:
+        images = docker_client.images.list(filters={'label': label('key')})
+
+    return [i for i in images if i.tags or not tagged_only]
+
+
+def complete_snapshot_images(docker_client, key):
+    """Return the images of the snapshot for `key`, or an empty list if there is no complete one.
+
+    A snapshot is complete when the tagged images for `key` all come from the same save and
+    there are as many of them as the zone had containers. A save which was interrupted (or
+    images left over from two interrupted saves) does not count.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker daemon
+    key -- snapshot key as returned by snapshot_key
+    """
+    images = list_snapshot_images(docker_client, key)
+    if not images:
+        return []
+
+    saves = set(i.labels.get(label('save')) for i in images)
+    sizes = set(i.labels.get(label('size')) for i in images)
+
+    if len(saves) != 1 or None in saves or sizes != {str(len(images))}:
+        logging.warning('ignoring incomplete snapshot [{0}] [images=[{1}], saves=[{2}], sizes=[{3}]]'
+                        .format(key, len(images), len(saves), sorted(str(s) for s in sizes)))
+        return []
+
+    return images
+
+
+def snapshot_lock_path(key):
+    """Return the local path to the lock file which serializes saving the snapshot for `key`.
+
+    Arguments:
+    key -- snapshot key as returned by snapshot_key
+    """
+    return os.path.join(os.path.expanduser('~'), '.cache', 'irods_test', 'snapshots', '{}.lock'.format(key))
+
+
+def catalog_dump_path():
+    """Return the path in the database container where the catalog is dumped for snapshots.
+
+    The official postgres and mysql images load SQL files in /docker-entrypoint-initdb.d when
+    they initialize an empty data directory, which is what a container from a snapshot image has.
+    """
+    return os.path.join('/docker-entrypoint-initdb.d', 'irods-catalog.sql')
+
+
+@tracing.traced()
+def save_zone(docker_client,
+              compose_project,
+              database,
+              key,
+              database_name='ICAT',
+              database_user='irods',
+              database_password='testpassword'):
+    """Commit every container in a fully set up zone as an image labeled with the snapshot key.
+
+    The catalog lives in a volume which is not captured by committing the container, so it is
+    dumped to a SQL script inside the database container before the commit.
+
+    Zones which miss the same snapshot at the same time (e.g. shards or pool zones) take turns
+    saving it, and the zone is not saved if a complete snapshot already exists by the time its
+    turn comes. Each image is labeled with an ID for this save and the number of containers in
+    the zone, so that an interrupted save is not mistaken for a snapshot (see
+    complete_snapshot_images).
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker-compose project
+    compose_project -- compose.Project in which the iRODS zone is set up
+    database -- repo:tag for the docker image of the database server
+    key -- snapshot key as returned by snapshot_key
+    database_name -- name of the iRODS database
+    database_user -- name of the iRODS database user
+    database_password -- password for the iRODS database user
+    """
+    lock_path = snapshot_lock_path(key)
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+
+    with archive.cache_lock(lock_path):
+        if complete_snapshot_images(docker_client, key):
+            logging.info('snapshot already saved [{0}] [{1}]'.format(key, compose_project.name))
+            return
+
+        commit_zone(docker_client, compose_project, database, key,
+                    database_name, database_user, database_password)
+
+
+def commit_zone(docker_client, compose_project, database, key, database_name, database_user, database_password):
+    """Commit every container in the zone as one save of the snapshot for `key` (see save_zone).
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker-compose project
+    compose_project -- compose.Project in which the iRODS zone is set up
+    database -- repo:tag for the docker image of the database server
+    key -- snapshot key as returned by snapshot_key
+    database_name -- name of the iRODS database
+    database_user -- name of the iRODS database user
+    database_password -- password for the iRODS database user
+    """
+    import uuid
+
+    network = irods_test_config.project_network(docker_client, compose_project)
+
+    containers = compose_project.containers()
+    save_id = uuid.uuid4().hex
+
+    for c in containers:
+        container = docker_client.containers.get(c.name)
+
+        if context.is_catalog_database_container(container):
+            strat = database_setup.make_strategy(database, container)
+            ec = strat.dump_catalog(database_name, database_user, database_password, catalog_dump_path())
+            if ec != 0:
+                raise RuntimeError('failed to dump catalog [ec=[{0}], container=[{1}]]'
+                                   .format(ec, container.name))
+
+        inspect = container.client.api.inspect_container(container.name)
+        aliases = inspect['NetworkSettings']['Networks'][network.name]['Aliases'] or []
+
+        labels = {
+            label('key'): key,
+            label('save'): save_id,
+            label('size'): str(len(containers)),
+            label('service'): context.service_name(container.name),
+            label('instance'): str(context.service_instance(container.name)),
+            label('hostname'): inspect['Config']['Hostname'],
+            label('aliases'): ','.join(a for a in aliases if a != inspect['Config']['Hostname'])
+        }
+
+        tag = '-'.join([key, context.service_name(container.name), str(context.service_instance(container.name))])
+
+        logging.warning('saving snapshot [{0}:{1}] [{2}]'.format(snapshot_repository(), tag, container.name))
+
+        container.commit(repository=snapshot_repository(),
+                         tag=tag,
+                         changes=['LABEL {0}={1}'.format(k, json.dumps(v)) for k, v in labels.items()])
+
+
+@tracing.traced()
+def restore_zone(docker_client, compose_project, key, database_image=None):
+    """Create the containers of `compose_project` from the snapshot images for `key`.
+
+    Returns the list of containers in the docker-compose project, or None if there is no
+    snapshot for `key`.
+
+    The containers are labeled as docker-compose would label them so that the rest of the
+    tooling (including compose_project.down) treats them as part of the project. Each container
+    keeps the hostname and network aliases it had when the snapshot was saved because the
+    iRODS configuration refers to the servers by those names.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker-compose project
+    compose_project -- compose.Project (not yet up) in which the zone will be restored
+    key -- snapshot key as returned by snapshot_key
+    database_image -- if provided, repo:tag for the docker image of the database server, which
+                      is waited for before the iRODS servers are started
+    """
+    import concurrent.futures
+
+    images = complete_snapshot_images(docker_client, key)
+    if not images:
+        logging.info('no snapshot found [{}]'.format(key))
+        return None
+
+    logging.warning('restoring zone from snapshot [{0}] [{1}]'.format(key, compose_project.name))
+
+    compose_project.initialize()
+
+    network_name = list(compose_project.services[0].networks.keys())[0]
+    api = docker_client.api
+
+    def image_label(image, name):
+        return image.labels[label(name)]
+
+    # The database is started first so that it can load the catalog while the iRODS
+    # containers are being created.
+    images.sort(key=lambda i: image_label(i, 'service') != context.irods_catalog_database_service())
+
+    for image in images:
+        service = image_label(image, 'service')
+        instance = image_label(image, 'instance')
+
+        aliases = [service, image_label(image, 'hostname')] + [a for a in image_label(image, 'aliases').split(',') if a]
+
+        container = api.create_container(
+            image.id,
+            name=context.container_name(compose_project.name, service, instance),
+            hostname=image_label(image, 'hostname'),
+            labels={
+                'com.docker.compose.project': compose_project.name,
+                'com.docker.compose.service': service,
+                'com.docker.compose.container-number': instance,
+                'com.docker.compose.oneoff': 'False'
+            },
+            host_config=api.create_host_config(network_mode=network_name),
+            networking_config=api.create_networking_config({
+                network_name: api.create_endpoint_config(aliases=sorted(set(aliases)))
+            }))
+
+        api.start(container['Id'])
+
+        client_cache.invalidate(docker_client, context.container_name(compose_project.name, service, instance))
+
+    irods_containers = [docker_client.containers.get(c.name) for c in compose_project.containers(
+        service_names=[context.irods_catalog_provider_service(),
+                       context.irods_catalog_consumer_service()])]
+
+    # /etc/hosts is generated by the docker daemon for each new container
+    for c in irods_containers:
+        irods_test_config.add_alias_to_hosts_file(c, irods_test_config.test_hostname_alias(c))
+
+    if database_image:
+        db_container = docker_client.containers.get(
+            context.irods_catalog_database_container(compose_project.name))
+
+        readiness.wait_for_database(database_setup.make_strategy(database_image, db_container))
+
+    for c in irods_containers:
+        if context.is_irods_catalog_provider_container(c):
+            irods_setup.start_irods_server(c)
+
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        futures_to_containers = {executor.submit(irods_setup.start_irods_server, c): c for c in irods_containers
+                                 if context.is_irods_catalog_consumer_container(c)}
+
+        for f in concurrent.futures.as_completed(futures_to_containers):
+            f.result()
+
+    return compose_project.containers()
+
+
+def remove_snapshot(docker_client, key):
+    """Remove every image which is part of the snapshot for `key`.
+
+    Arguments:
+    docker_client -- docker client for interacting with the docker daemon
+    key -- snapshot key as returned by snapshot_key
+    """
+    for image in list_snapshot_images(docker_client, key, tagged_only=False):
+        logging.warning('removing snapshot image [{}]'.format(image.tags))
+        docker_client.images.remove(image.id, force=True)
+
+
+if __name__ == "__main__":
+    import argparse
+    import logs
+
+    parser = argparse.ArgumentParser(description='List or remove snapshots of fully set up zones.')
+    parser.add_argument('--remove', metavar='SNAPSHOT_KEY', dest='remove', type=str, nargs='+',
+                        help='Snapshot keys to remove. Use "all" to remove every snapshot.')
+    parser.add_argument('--verbose', '-v', dest='verbosity', action='count', default=1,
+                        help='Increase the level of output to stdout. CRITICAL and ERROR messages will always be printed.')
+
+    args = parser.parse_args()
+
+    logs.configure(args.verbosity)
+
+    docker_client = client_cache.shared_client()
+
+    if args.remove:
+        keys = args.remove
+        if 'all' in keys:
+            keys = sorted(set(i.labels[label('key')] for i in list_snapshot_images(docker_client, tagged_only=False)))
+
+        for k in keys:
+            remove_snapshot(docker_client, k)
+
+        exit(0)
+
+    for i in list_snapshot_images(docker_client):
+        print('{0} {1}'.format(i.labels[label('key')], ' '.join(i.tags)))
@@ -0,0 +1,481 @@
+# grown-up modules
+import docker
+import json
+import logging
+import os
+import re
+import time
+
+# local modules
+import archive
+import context
+import execute
+
+def container_reports_path():
+    """Return the directory inside an iRODS container to which run_tests.py --xml_output writes."""
+    return os.path.join(context.irods_home(), 'test-reports')
+
+
+def duration_index_path():
+    """Return the local path to the index of test durations and outcomes kept across runs.
+
+    The IRODS_TEST_DURATION_INDEX environment variable overrides the default.
+    """
+    return os.environ.get('IRODS_TEST_DURATION_INDEX',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'irods_test', 'test_durations.json'))
+
+
+def index_key_separator():
+    """Return the separator between the fields of an index key.
+
+    Image references may contain '/' (e.g. mysql/mysql-server:8.0), but never '|'.
+    """
+    return '|'
+
+
+def index_key(platform, database, irods_version):
+    """Return the key under which the results for a platform, database and iRODS version are indexed.
+
+    Arguments:
+    platform -- repo:tag for the docker image of the platform running the iRODS servers
+    database -- repo:tag for the docker image of the database server
+    irods_version -- version of the iRODS server under test
+    """
+    return index_key_separator().join([platform, database, irods_version])
+
+
+def split_index_key(key):
+    """Return the (platform, database, iRODS version) named by an index key, or None if it is not one.
+
+    Arguments:
+    key -- index key returned by index_key
+    """
+    fields = key.split(index_key_separator())
+    return tuple(fields) if len(fields) == 3 else None
+
+
+def report_test_id(classname, name):
+    """Return the name by which run_tests.py --run_s runs the test case `name` of `classname`.
+
+    run_tests.py loads tests from the irods.test package, so that prefix is left off. When a
+    class or module fixture fails, unittest reports it as a test case named after the fixture
+    and its target, e.g. "setUpClass (irods.test.test_foo.Test_Bar)"; the id of such a case is
+    its target (the class or module), since that is what has to be run again.
+
+    Arguments:
+    classname -- dotted name of the class of the test case as it appears in the test report
+    name -- name of the test method
+    """
+    prefix = 'irods.test.'
+
+    fixture = re.match(r'^(?:setUpClass|tearDownClass|setUpModule|tearDownModule) \((.+)\)$', name)
+    if fixture:
+        classname, name = fixture.group(1), ''
+
+    if classname.startswith(prefix):
+        classname = classname[len(prefix):]
+
+    return '.'.join(n for n in [classname, name] if n)
+
+
+def irods_version(container):
+    """Return the version of the iRODS server installed in `container`, or 'unknown'.
+
+    Arguments:
+    container -- docker container running an iRODS server
+    """
+    try:
+        version_file = archive.read_file_from_container(container, os.path.join(context.irods_home(), 'VERSION.json'))
+        return json.loads(version_file.decode('utf-8'))['irods_version']
+
+    except Exception as e:
+        logging.warning('failed to read iRODS version [{}]'.format(container.name))
+        logging.warning(e)
+
+        return 'unknown'
+
+
+def clear_test_reports(container, reports_path=None):
+    """Remove the test reports left in `container` by earlier runs.
+
+    Arguments:
+    container -- docker container in which the tests are run
+    reports_path -- directory inside the container holding the test reports
+    """
+    ec = execute.execute_command(container, ['rm', '-rf', reports_path or container_reports_path()])
+    if ec != 0:
+        raise RuntimeError('failed to remove test reports [ec=[{0}], container=[{1}]]'.format(ec, container.name))
+
+
+def collect_test_reports(container, output_directory, reports_path=None):
+    """Copy the XML test reports out of `container` and return their local paths.
+
+    The reports are saved under `output_directory`/test-reports/<container name>.
+
+    Arguments:
+    container -- docker container in which the tests were run
+    output_directory -- local directory in which the reports are saved
+    reports_path -- directory inside the container holding the test reports
+    """
+    import io
+    import tarfile
+
+    if not reports_path:
+        reports_path = container_reports_path()
+
+    try:
+        bits, _ = container.get_archive(reports_path)
+
+    except docker.errors.NotFound:
+        logging.warning('no test reports found [{0}] [{1}]'.format(reports_path, container.name))
+        return list()
+
+    directory = os.path.join(output_directory, 'test-reports', container.name)
+    os.makedirs(directory, exist_ok=True)
+
+    paths = list()
+
+    with tarfile.open(fileobj=io.BytesIO(b''.join(bits))) as tf:
+        for member in tf:
+            if not member.isfile() or not member.name.endswith('.xml'):
+                continue
+
+            path = os.path.join(directory, os.path.basename(member.name))
+            with open(path, 'wb') as f:
+                f.write(tf.extractfile(member).read())
+
+            paths.append(path)
+
+    logging.info('collected [{0}] test reports [{1}]'.format(len(paths), container.name))
+
+    return paths
+
+
+def parse_report(path):
+    """Return a dict for each test case in the JUnit XML report at `path`.
+
+    Each dict holds the id (see report_test_id), the duration in seconds, and the outcome of the
+    test: 'passed', 'failure', 'error' or 'skipped'.
+
+    Arguments:
+    path -- local path to the JUnit XML report
+    """
+    import xml.etree.ElementTree as ET
+
+    cases = list()
+
+    for case in ET.parse(path).getroot().iter('testcase'):
+        outcome = 'passed'
+        message = None
+
+        for tag in ['error', 'failure', 'skipped']:
+            element = case.find(tag)
+            if element is not None:
+                outcome = tag
+                message = element.get('message')
+                break
+
+        cases.append({
+            'id': report_test_id(case.get('classname', ''), case.get('name', '')),
+            'time': float(case.get('time') or 0),
+            'outcome': outcome,
+            'message': message
+        })
+
+    return cases
+
+
+def failed_tests(path):
+    """Return the ids of the test cases which failed or raised an error in the JUnit XML report at `path`.
+
+    Arguments:
+    path -- local path to the JUnit XML report
+    """
+    failed = list()
+
+    for case in parse_report(path):
+        if case['outcome'] in ('failure', 'error') and case['id'] not in failed:
+            failed.append(case['id'])
+
+    return failed
+
+
+def compare_rerun(previous_failures, output_directory):
+    """Report which of the `previous_failures` failed again in the tests run for this job.
+
+    The outcomes are read from `output_directory`/test_results.xml (see collect_results), and
+    the comparison is logged and written to `output_directory`/rerun.json. Tests which failed
+    again reproduced; tests which passed are flaky; tests without a result did not run.
+
+    Returns a dict with the lists of 'reproduced', 'flaky' and 'not_run' tests. A previous
+    failure which names a whole class or module (see report_test_id) takes the outcome of the tests
+    in it: failed if any of them failed, passed if they all passed.
+
+    Arguments:
+    previous_failures -- ids of the tests which failed in the earlier job
+    output_directory -- local directory holding the results of this job
+    """
+    outcomes = dict()
+
+    report_path = os.path.join(output_directory, 'test_results.xml')
+    if os.path.exists(report_path):
+        for case in parse_report(report_path):
+            # A test which fails in any of its runs counts as failed
+            if outcomes.get(case['id']) not in ('failure', 'error'):
+                outcomes[case['id']] = case['outcome']
+
+    comparison = {'reproduced': list(), 'flaky': list(), 'not_run': list()}
+
+    for t in previous_failures:
+        outcome = outcomes.get(t)
+
+        if outcome is None:
+            contained = [o for i, o in outcomes.items() if i.startswith(t + '.')]
+            if any(o in ('failure', 'error') for o in contained):
+                outcome = 'failure'
+            elif contained and all(o in ('passed', 'skipped') for o in contained):
+                outcome = 'passed'
+
+        if outcome in ('failure', 'error'):
+            comparison['reproduced'].append(t)
+        elif outcome == 'passed':
+            comparison['flaky'].append(t)
+        else:
+            comparison['not_run'].append(t)
+
+    with open(os.path.join(output_directory, 'rerun.json'), 'w') as f:
+        json.dump(comparison, f, indent=4)
+
+    for t in comparison['reproduced']:
+        logging.error('failure reproduced [{}]'.format(t))
+
+    for t in comparison['flaky']:
+        logging.warning('flaky test passed on rerun [{}]'.format(t))
+
+    for t in comparison['not_run']:
+        logging.error('no result for rerun test [{}]'.format(t))
+
+    logging.warning('rerun of failed tests [reproduced=[{0}], flaky=[{1}], not_run=[{2}]]'
+                    .format(len(comparison['reproduced']), len(comparison['flaky']), len(comparison['not_run'])))
+
+    return comparison
+
+
+def merge_reports(reports, output_path, name='irods_test'):
+    """Write the test suites of several JUnit XML reports into one report and return its totals.
+
+    Each test suite is tagged with the container in which it ran (as its hostname).
+
+    Arguments:
+    reports -- list of (container name, local path to a JUnit XML report) tuples
+    output_path -- local path to the merged report
+    name -- name of the merged set of test suites
+    """
+    import xml.etree.ElementTree as ET
+
+    merged = ET.Element('testsuites', name=name)
+    totals = {'tests': 0, 'failures': 0, 'errors': 0, 'skipped': 0, 'time': 0.0}
+
+    for container_name, path in reports:
+        try:
+            root = ET.parse(path).getroot()
+
+        except ET.ParseError as e:
+            logging.error('failed to parse test report [{}]'.format(path))
+            logging.error(e)
+            continue
+
+        for suite in ([root] if root.tag == 'testsuite' else root.findall('testsuite')):
+            suite.set('hostname', container_name)
+            merged.append(suite)
+
+            for case in suite.iter('testcase'):
+                totals['tests'] += 1
+                totals['time'] += float(case.get('time') or 0)
+
+                for tag, total in [('failure', 'failures'), ('error', 'errors'), ('skipped', 'skipped')]:
+                    if case.find(tag) is not None:
+                        totals[total] += 1
+
+    for k, v in totals.items():
+        merged.set(k, '{:.3f}'.format(v) if k == 'time' else str(v))
+
+    ET.ElementTree(merged).write(output_path, encoding='utf-8', xml_declaration=True)
+
+    return totals
+
+
+def load_index(index_path=None):
+    """Return the duration index as a dict of index keys to dicts of test ids to their records.
+
+    Arguments:
+    index_path -- local path to the duration index (default: duration_index_path())
+    """
+    try:
+        with open(index_path or duration_index_path(), 'r') as f:
+            return json.load(f)
+
+    except (OSError, ValueError):
+        return dict()
+
+
+def record_results(cases, key, index_path=None):
+    """Add the durations and outcomes of `cases` to the duration index under `key`.
+
+    For each test, the index keeps the number of runs, the mean and maximum durations, the
+    number of runs which did not pass, and the duration and outcome of the latest run. Jobs
+    running at the same time take turns updating the index.
+
+    Arguments:
+    cases -- list of test case dicts returned by parse_report
+    key -- index key returned by index_key
+    index_path -- local path to the duration index (default: duration_index_path())
+    """
+    if not index_path:
+        index_path = duration_index_path()
+
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+
+    with archive.cache_lock(index_path + '.lock'):
+        index = load_index(index_path)
+        tests = index.setdefault(key, dict())
+
+        for case in cases:
+            if case['outcome'] == 'skipped':
+                continue
+
+            record = tests.setdefault(case['id'], {'runs': 0, 'mean': 0.0, 'max': 0.0, 'failures': 0})
+
+            record['runs'] += 1
+            record['mean'] += (case['time'] - record['mean']) / record['runs']
+            record['max'] = max(record['max'], case['time'])
+            record['failures'] += 0 if case['outcome'] == 'passed' else 1
+            record['last'] = case['time']
+            record['outcome'] = case['outcome']
+            record['updated'] = int(time.time())
+
+        partial = '{0}.{1}.tmp'.format(index_path, os.getpid())
+        with open(partial, 'w') as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+
+        os.replace(partial, index_path)
+
+
+def indexed_durations(key, index_path=None):
+    """Return a dict of test ids to their mean durations in seconds for index key `key`.
+
+    Arguments:
+    key -- index key returned by index_key
+    index_path -- local path to the duration index (default: duration_index_path())
+    """
+    return {test: record['mean'] for test, record in load_index(index_path).get(key, dict()).items()}
+
+
+def expected_duration(test, durations):
+    """Return the expected number of seconds to run `test`, or None if it has never been run.
+
+    `test` may name a single test case or a module or class of them (e.g. test_ils), in which
+    case the durations of every test case in it are added up.
+
+    Arguments:
+    test -- name of the test as passed to run_tests.py --run_s
+    durations -- dict returned by indexed_durations
+    """
+    matches = [d for t, d in durations.items() if t == test or t.startswith(test + '.')]
+
+    return sum(matches) if matches else None
+
+
+def collect_results(containers,
+                    output_directory,
+                    platform,
+                    database,
+                    reports_path=None,
+                    index_path=None):
+    """Collect the test reports from `containers`, merge them, and record them in the duration index.
+
+    The merged report is written to `output_directory`/test_results.xml. Returns the totals of
+    the merged report, or None if no reports were found.
+
+    Arguments:
+    containers -- docker containers in which the tests were run
+    output_directory -- local directory in which the reports are saved
+    platform -- repo:tag for the docker image of the platform running the iRODS servers
+    database -- repo:tag for the docker image of the database server
+    reports_path -- directory inside the containers holding the test reports
+    index_path -- local path to the duration index (default: duration_index_path())
+    """
+    reports = list()
+
+    for c in containers:
+        try:
+            reports.extend((c.name, path) for path in collect_test_reports(c, output_directory, reports_path))
+
+        except Exception as e:
+            logging.error('failed to collect test reports [{}]'.format(c.name))
+            logging.error(e)
+
+    if not reports:
+        return None
+
+    totals = merge_reports(reports, os.path.join(output_directory, 'test_results.xml'))
+
+    logging.warning('test results [tests=[{0}], failures=[{1}], errors=[{2}], skipped=[{3}], time=[{4:.1f}s]]'
+                    .format(totals['tests'], totals['failures'], totals['errors'], totals['skipped'], totals['time']))
+
+    key = index_key(platform, database, irods_version(containers[0]))
+
+    cases = list()
+    for _, path in reports:
+        try:
+            cases.extend(parse_report(path))
+
+        except Exception as e:
+            logging.error('failed to parse test report [{}]'.format(path))
+            logging.error(e)
+
+    record_results(cases, key, index_path)
+
+    logging.info('recorded [{0}] test durations [{1}]'.format(len(cases), key))
+
+    return totals
+
+
+if __name__ == "__main__":
+    import argparse
+    import logs
+
+    parser = argparse.ArgumentParser(description='List the slowest tests recorded in the test duration index.')
+    parser.add_argument('--os-platform-image', '-p', metavar='OS_PLATFORM_IMAGE_REPO_AND_TAG', dest='platform', type=str,
+                        help='Only list tests run on this repo:tag of the OS platform image.')
+    parser.add_argument('--database-image', '-d', metavar='DATABASE_IMAGE_REPO_AND_TAG', dest='database', type=str,
+                        help='Only list tests run against this repo:tag of the database image.')
+    parser.add_argument('--irods-version', metavar='VERSION', dest='irods_version', type=str,
+                        help='Only list tests run against this version of iRODS.')
+    parser.add_argument('--count', '-n', metavar='COUNT', dest='count', type=int, default=20,
+                        help='Number of tests to list for each platform, database and iRODS version. (Default: %(default)s)')
+    parser.add_argument('--index', metavar='PATH', dest='index_path', type=str, default=duration_index_path(),
+                        help='Path to the test duration index. (Default: %(default)s)')
+    parser.add_argument('--verbose', '-v', dest='verbosity', action='count', default=1,
+                        help='Increase the level of output to stdout. CRITICAL and ERROR messages will always be printed.')
+
+    args = parser.parse_args()
+
+    logs.configure(args.verbosity)
+
+    for key, tests in sorted(load_index(args.index_path).items()):
+        fields = split_index_key(key)
+        if not fields:
+            logging.debug('skipping unrecognized index key [{}]'.format(key))
+            continue
+
+        platform, database, version = fields
+
+        if any(wanted and wanted != actual for wanted, actual in
+               [(args.platform, platform), (args.database, database), (args.irods_version, version)]):
+            continue
+
+        print(key)
+
+        for test, record in sorted(tests.items(), key=lambda t: t[1]['mean'], reverse=True)[:args.count]:
+            print('  {0:>9.1f}s  {1:>4} runs  {2:>4} failed  {3}'.format(record['mean'], record['runs'], record['failures'], test))
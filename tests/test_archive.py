@@ -0,0 +1,115 @@
+# grown-up modules
+import io
+import os
+import tarfile
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+# local modules
+import archive
+import governor
+
+class governed_container(object):
+    """Container whose put_archive waits for a slot, as it does through client_cache.caching_client."""
+    def __init__(self, name, call_governor):
+        self.name = name
+        self.received = 0
+        self.put_archive = call_governor.governed('archive', self.receive)
+
+    def receive(self, path, data):
+        for chunk in data:
+            self.received += len(chunk)
+
+        return True
+
+
+class test_put_archive_in_containers(unittest.TestCase):
+    def setUp(self):
+        self.call_governor = governor.shared_governor()
+        self.call_governor.configure({'archive': 4})
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.member = os.path.join(self.directory.name, 'package')
+        with open(self.member, 'wb') as f:
+            f.write(os.urandom(256 * 1024))
+
+    def tearDown(self):
+        self.call_governor.configure(governor.default_limits())
+        self.directory.cleanup()
+
+    def put_archive(self, containers):
+        errors = list()
+
+        def put():
+            try:
+                # Small chunks and queues make the uploads depend on each other early
+                archive.put_archive_in_containers(containers, [self.member], chunk_size=1024)
+            except Exception as e:
+                errors.append(e)
+
+        t = threading.Thread(target=put, daemon=True)
+        t.start()
+        t.join(timeout=30)
+
+        self.assertFalse(t.is_alive(), 'streaming the archive into [{}] containers hung'.format(len(containers)))
+        self.assertEqual(errors, [])
+
+    def test_more_containers_than_archive_slots(self):
+        containers = [governed_container('c{}'.format(i), self.call_governor) for i in range(10)]
+
+        self.put_archive(containers)
+
+        for c in containers:
+            self.assertGreater(c.received, 256 * 1024)
+
+    def test_group_takes_one_slot(self):
+        self.put_archive([governed_container('c{}'.format(i), self.call_governor) for i in range(6)])
+
+        self.assertEqual(self.call_governor.stats()['archive']['calls'], 1)
+
+
+class test_write_cached_archive(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_directory = os.path.join(self.directory.name, 'cache')
+
+        self.member = os.path.join(self.directory.name, 'package')
+        with open(self.member, 'wb') as f:
+            f.write(os.urandom(64 * 1024))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self):
+        fileobj = io.BytesIO()
+        archive.write_cached_archive(fileobj, [self.member], 'gz', cache_directory=self.cache_directory)
+        return fileobj.getvalue()
+
+    def test_archive_is_reused(self):
+        written = self.write()
+
+        with unittest.mock.patch('archive.write_archive') as write_archive:
+            self.assertEqual(self.write(), written)
+            write_archive.assert_not_called()
+
+        with tarfile.open(fileobj=io.BytesIO(written), mode='r:gz') as tf:
+            self.assertEqual(tf.getnames(), [self.member.lstrip('/')])
+
+    def test_least_recently_used_archive_is_evicted(self):
+        self.write()
+        oldest = archive.cached_archive_path([self.member], 'gz', False, self.cache_directory)
+        os.utime(oldest, (0, 0))
+
+        newest = archive.cached_archive_path([self.member], 'xz', False, self.cache_directory)
+        archive.write_cached_archive(io.BytesIO(), [self.member], 'xz', cache_directory=self.cache_directory)
+
+        archive.evict_archives(self.cache_directory, os.path.getsize(newest), min_age=0)
+
+        self.assertFalse(os.path.exists(oldest))
+        self.assertTrue(os.path.exists(newest))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+# grown-up modules
+import tempfile
+import threading
+import unittest
+
+# local modules
+import benchmark
+import fake_docker
+import governor
+
+class test_bring_up_once(unittest.TestCase):
+    def test_install_packages_on_more_containers_than_archive_slots(self):
+        consumer_count = governor.default_limits()['archive'] + 1
+        outcome = dict()
+
+        with tempfile.TemporaryDirectory() as package_directory:
+            # Larger than the chunks the fan-out queues hold, so uploads which cannot run block the rest
+            benchmark.make_packages(package_directory, 'ubuntu:18.04', 'postgres:10.12', 4 * 1024 * 1024)
+
+            def bring_up():
+                outcome['result'] = benchmark.bring_up_once(consumer_count,
+                                                            'ubuntu:18.04',
+                                                            'postgres:10.12',
+                                                            package_directory=package_directory,
+                                                            latencies={'api': 0, 'exec': 0, 'up': 0, 'down': 0},
+                                                            responses=fake_docker.default_responses(0, 0))
+
+            thread = threading.Thread(target=bring_up, daemon=True)
+            thread.start()
+            thread.join(60)
+
+        self.assertFalse(thread.is_alive(), 'bringing up the zone did not finish')
+
+        result = outcome['result']
+        self.assertGreater(result['execs'], 0)
+        self.assertGreater(governor.shared_governor().stats()['archive']['calls'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
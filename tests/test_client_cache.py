@@ -0,0 +1,35 @@
+# grown-up modules
+import unittest
+
+# local modules
+import client_cache
+import fake_docker
+import governor
+
+class test_caching_client(unittest.TestCase):
+    def setUp(self):
+        self.docker_client = fake_docker.fake_client(latencies={'api': 0, 'exec': 0})
+        self.docker_client.containers.add('zone_irods-catalog-provider_1', 'ubuntu:18.04')
+
+        self.cache = client_cache.caching_client(self.docker_client, governor.call_governor())
+
+    def test_reload_is_not_answered_from_cache(self):
+        container = self.cache.containers.get('zone_irods-catalog-provider_1')
+        self.assertEqual(self.cache.inspect(container.name)['State']['Status'], 'running')
+
+        # Stopped behind the cache's back, with no docker event to say so
+        self.docker_client.containers.get(container.name).status = 'exited'
+
+        container.reload()
+
+        self.assertEqual(self.cache.inspect(container.name)['State']['Status'], 'exited')
+
+    def test_fetch_locks_are_released(self):
+        self.cache.containers.get('zone_irods-catalog-provider_1')
+        self.cache.inspect('zone_irods-catalog-provider_1')
+
+        self.assertEqual(self.cache.fetch_locks, dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+# grown-up modules
+import unittest
+
+# local modules
+import irods_setup
+
+class test_unattended_configuration(unittest.TestCase):
+    def test_follows_template_without_control_plane(self):
+        template = {
+            'catalog_provider_hosts': ['localhost'],
+            'catalog_service_role': 'provider',
+            'schema_name': 'server_config',
+            'schema_version': 'v5',
+            'zone_name': 'tempZone',
+            'zone_port': 1247
+        }
+
+        configuration = (irods_setup.setup_input_builder()
+            .service_account(catalog_service_role='consumer')
+            .server_options(catalog_service_provider_host='provider.example', server_hostname='consumer.example')
+            .build_unattended_configuration(template)
+        )
+
+        server_config = configuration['server_config']
+        self.assertEqual(server_config['schema_version'], 'v5')
+        self.assertEqual(server_config['catalog_service_role'], 'consumer')
+        self.assertEqual(server_config['catalog_provider_hosts'], ['provider.example'])
+        self.assertNotIn('server_control_plane_port', server_config)
+        self.assertNotIn('irods_server_control_plane_port', configuration['service_account_environment'])
+        self.assertEqual(configuration['hosts_config']['schema_version'], 'v5')
+
+        # The template itself is left as it was
+        self.assertEqual(template['catalog_service_role'], 'provider')
+
+    def test_provider_database_plugin(self):
+        template = {'plugin_configuration': {'database': {}}, 'schema_version': 'v3', 'server_control_plane_port': 1248}
+
+        configuration = (irods_setup.setup_input_builder()
+            .service_account(catalog_service_role='provider')
+            .database_connection(odbc_driver='PostgreSQL ANSI', database_server_hostname='db.example')
+            .build_unattended_configuration(template)
+        )
+
+        database = configuration['server_config']['plugin_configuration']['database']['postgres']
+        self.assertEqual(database['db_host'], 'db.example')
+        self.assertEqual(database['db_odbc_driver'], 'PostgreSQL ANSI')
+        self.assertEqual(configuration['service_account_environment']['irods_server_control_plane_port'], 1248)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+# grown-up modules
+import os
+import tempfile
+import unittest
+
+# local modules
+import fake_docker
+import logs
+
+class test_collect_log_files(unittest.TestCase):
+    def collect(self, read_exit_code):
+        responses = [
+            fake_docker.canned_response(r'^find ', output=b'1 10 /logs/a.log\n2 10 /logs/b.log\n'),
+            fake_docker.canned_response(r'tail -c .* /logs/a\.log', exit_code=read_exit_code),
+            fake_docker.canned_response(r'tail -c', output=b'0123456789')
+        ]
+        docker_client = fake_docker.fake_client(latencies={'api': 0, 'exec': 0}, responses=responses)
+        container = docker_client.containers.add('zone_irods-catalog-provider_1', 'ubuntu:18.04')
+
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+
+        output_directory = temporary_directory.name
+        return output_directory, lambda: logs.collect_log_files(container, output_directory, '/logs', incremental=True)
+
+    def test_read_failure_is_raised_after_the_other_files(self):
+        output_directory, collect = self.collect(read_exit_code=1)
+
+        with self.assertRaisesRegex(RuntimeError, 'failed to copy log files'):
+            collect()
+
+        # The file which was read is still copied, and the one which failed is tried again next time
+        self.assertTrue(os.path.exists(os.path.join(output_directory, 'b.log.gz')))
+        with open(os.path.join(output_directory, '.offsets.json'), 'r') as f:
+            self.assertNotIn('/logs/a.log', f.read())
+
+    def test_files_are_copied(self):
+        _, collect = self.collect(read_exit_code=0)
+
+        self.assertEqual(collect(), 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# grown-up modules
+import http.server
+import threading
+import time
+import unittest
+import unittest.mock
+
+# local modules
+import pool
+
+class test_zone_pool(unittest.TestCase):
+    def setUp(self):
+        self.combination = ('ubuntu:18.04', 'postgres:10.12')
+        self.zone_pool = pool.zone_pool(None, [self.combination], 0, lease_duration=0)
+        self.torn_down = list()
+        self.zone_pool.tear_down = lambda c, n: self.torn_down.append(n)
+
+    def test_expired_lease_is_reclaimed(self):
+        self.zone_pool.ready[self.combination].append('pool-zone')
+        zone = self.zone_pool.lease(*self.combination, timeout=0)
+
+        self.assertEqual(self.zone_pool.reclaim_expired_leases(), [zone['project_name']])
+        self.assertEqual(self.zone_pool.leased, dict())
+        self.assertRaises(KeyError, self.zone_pool.renew, zone['project_name'])
+
+    def test_renewed_lease_is_kept(self):
+        self.zone_pool.lease_duration = 600
+        self.zone_pool.ready[self.combination].append('pool-zone')
+        zone = self.zone_pool.lease(*self.combination, timeout=0)
+
+        self.zone_pool.renew(zone['project_name'])
+
+        self.assertEqual(self.zone_pool.reclaim_expired_leases(), list())
+        self.assertIn(zone['project_name'], self.zone_pool.leased)
+
+    def test_zone_pending_at_stop_is_torn_down(self):
+        brought_up = threading.Event()
+        proceed = threading.Event()
+
+        def bring_up_zone(*args, **kwargs):
+            brought_up.set()
+            proceed.wait()
+
+        self.zone_pool.project = lambda c, n: None
+        self.zone_pool.pending[self.combination] += 1
+
+        with unittest.mock.patch('run_tests_in_zone.bring_up_zone', bring_up_zone), \
+             unittest.mock.patch('reset.save_baseline'):
+            thread = threading.Thread(target=self.zone_pool.bring_up, args=(self.combination, 'pool-zone'))
+            thread.start()
+            brought_up.wait()
+
+            stop = threading.Thread(target=self.zone_pool.stop)
+            stop.start()
+
+            while not self.zone_pool.stopping:
+                time.sleep(0.01)
+
+            proceed.set()
+            thread.join(10)
+            stop.join(10)
+
+        self.assertFalse(stop.is_alive())
+        self.assertEqual(self.torn_down, ['pool-zone'])
+        self.assertEqual(self.zone_pool.ready[self.combination], list())
+
+    def test_no_ready_zone_is_a_clear_error(self):
+        server = http.server.ThreadingHTTPServer(('localhost', 0), pool.pool_request_handler)
+        server.zone_pool = self.zone_pool
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        try:
+            with self.assertRaisesRegex(RuntimeError, 'no zone became ready in time'):
+                pool.lease_zone('http://localhost:{}'.format(server.server_address[1]), *self.combination, timeout=0)
+
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+# grown-up modules
+import unittest
+
+# local modules
+import client_cache
+import fake_docker
+import governor
+import run_tests_in_zone
+
+class test_bring_up_zone(unittest.TestCase):
+    def bring_up(self, docker_client, compose_project):
+        return run_tests_in_zone.bring_up_zone(docker_client,
+                                               compose_project,
+                                               'ubuntu:18.04',
+                                               'postgres:10.12',
+                                               consumer_count=2,
+                                               checkpoints=True)
+
+    def test_reuse_stopped_zone(self):
+        fake_client = fake_docker.fake_client(latencies={'api': 0, 'exec': 0, 'up': 0, 'down': 0},
+                                              responses=fake_docker.default_responses(0, 0))
+        docker_client = client_cache.caching_client(fake_client, governor.call_governor())
+        compose_project = fake_docker.fake_compose_project(fake_client, 'reuse-ubuntu-1804-postgres-1012')
+
+        self.bring_up(docker_client, compose_project)
+        created = fake_client.calls['containers.create']
+
+        for c in compose_project.containers():
+            docker_client.containers.get(c.name).stop()
+
+        containers = self.bring_up(docker_client, compose_project)
+
+        # The stopped containers are started again rather than brought up by docker-compose
+        self.assertEqual(fake_client.calls['containers.create'], created)
+        self.assertEqual(len(containers), 4)
+        self.assertTrue(all(c.status == 'running' for c in compose_project.containers(stopped=True)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+# grown-up modules
+import unittest
+
+# local modules
+import fake_docker
+import snapshot
+
+def save(client, key, save_id, services):
+    """Add images for `services` to `client` as save_zone would commit them."""
+    for service in services:
+        client.images.add('{0}:{1}-{2}-1'.format(snapshot.snapshot_repository(), key, service), labels={
+            snapshot.label('key'): key,
+            snapshot.label('save'): save_id,
+            snapshot.label('size'): str(len(services)),
+            snapshot.label('service'): service,
+            snapshot.label('instance'): '1'
+        })
+
+
+class test_complete_snapshot_images(unittest.TestCase):
+    services = ['catalog', 'irods-catalog-provider', 'irods-catalog-consumer']
+
+    def setUp(self):
+        self.client = fake_docker.fake_client(latencies={'api': 0.0})
+
+    def test_complete(self):
+        save(self.client, 'k', 'a', self.services)
+
+        self.assertEqual(len(snapshot.complete_snapshot_images(self.client, 'k')), 3)
+
+    def test_no_snapshot(self):
+        save(self.client, 'other', 'a', self.services)
+
+        self.assertEqual(snapshot.complete_snapshot_images(self.client, 'k'), [])
+
+    def test_superseded_images_are_ignored(self):
+        save(self.client, 'k', 'a', self.services)
+        save(self.client, 'k', 'b', self.services)
+
+        images = snapshot.complete_snapshot_images(self.client, 'k')
+
+        self.assertEqual(len(images), 3)
+        self.assertEqual(set(i.labels[snapshot.label('save')] for i in images), {'b'})
+        self.assertEqual(len(snapshot.list_snapshot_images(self.client, 'k', tagged_only=False)), 6)
+
+    def test_interrupted_save(self):
+        save(self.client, 'k', 'a', self.services)
+        self.client.images.images.popitem()
+
+        self.assertEqual(snapshot.complete_snapshot_images(self.client, 'k'), [])
+
+    def test_images_from_two_interrupted_saves(self):
+        save(self.client, 'k', 'a', self.services)
+        save(self.client, 'k', 'b', self.services[:1])
+
+        self.assertEqual(snapshot.complete_snapshot_images(self.client, 'k'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
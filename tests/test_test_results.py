@@ -0,0 +1,54 @@
+# grown-up modules
+import unittest
+
+# local modules
+import test_results
+
+class test_index_key(unittest.TestCase):
+    def test_image_repos_with_slashes(self):
+        key = test_results.index_key('irods/ubuntu:18.04', 'mysql/mysql-server:8.0', '4.2.11')
+
+        self.assertEqual(test_results.split_index_key(key), ('irods/ubuntu:18.04', 'mysql/mysql-server:8.0', '4.2.11'))
+
+    def test_unrecognized_key(self):
+        self.assertIsNone(test_results.split_index_key('ubuntu:18.04/postgres:10.12'))
+
+
+class test_report_test_id(unittest.TestCase):
+    def test_test_method(self):
+        self.assertEqual(test_results.report_test_id('irods.test.test_ils.Test_Ils', 'test_ils_l'), 'test_ils.Test_Ils.test_ils_l')
+
+    def test_failed_class_fixture(self):
+        for classname in ['unittest.suite._ErrorHolder', 'irods.test.test_ils.Test_Ils', '']:
+            self.assertEqual(test_results.report_test_id(classname, 'setUpClass (irods.test.test_ils.Test_Ils)'),
+                             'test_ils.Test_Ils')
+
+    def test_failed_module_fixture(self):
+        self.assertEqual(test_results.report_test_id('', 'setUpModule (irods.test.test_ils)'), 'test_ils')
+
+
+class test_compare_rerun(unittest.TestCase):
+    def test_class_takes_outcome_of_its_tests(self):
+        import os
+        import tempfile
+
+        report = """<testsuites><testsuite>
+<testcase classname="irods.test.test_ils.Test_Ils" name="test_a" time="1"/>
+<testcase classname="irods.test.test_ils.Test_Ils" name="test_b" time="1"><failure message="boom"/></testcase>
+<testcase classname="irods.test.test_iput.Test_Iput" name="test_a" time="1"/>
+</testsuite></testsuites>"""
+
+        with tempfile.TemporaryDirectory() as output_directory:
+            with open(os.path.join(output_directory, 'test_results.xml'), 'w') as f:
+                f.write(report)
+
+            comparison = test_results.compare_rerun(['test_ils.Test_Ils', 'test_iput.Test_Iput', 'test_imv.Test_Imv'],
+                                                    output_directory)
+
+        self.assertEqual(comparison, {'reproduced': ['test_ils.Test_Ils'],
+                                      'flaky': ['test_iput.Test_Iput'],
+                                      'not_run': ['test_imv.Test_Imv']})
+
+
+if __name__ == '__main__':
+    unittest.main()
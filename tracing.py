@@ -0,0 +1,238 @@
+# grown-up modules
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+class span_record(object):
+    """A named interval of time spent in one thread."""
+    def __init__(self, name, category, thread_id, args):
+        """Construct a span_record.
+
+        Arguments:
+        name -- what was being done
+        category -- kind of span: 'group' (contains other work), 'task', 'phase' or 'command'
+        thread_id -- small integer identifying the thread in which the span ran
+        args -- dict of extra information shown with the span
+        """
+        self.name = name
+        self.category = category
+        self.thread_id = thread_id
+        self.args = args
+        self.start_time = time.time()
+        self.end_time = None
+        self.has_children = False
+
+    def duration(self):
+        """Return the number of seconds the span lasted, or 0 if it has not ended."""
+        if self.end_time is None:
+            return 0.0
+
+        return self.end_time - self.start_time
+
+
+class recorder(object):
+    """Collects the spans of a run from every thread."""
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.spans = list()
+        self.thread_ids = dict()
+        self.local = threading.local()
+
+    def thread_id(self):
+        """Return a small integer for the current thread, in order of first use."""
+        ident = threading.get_ident()
+
+        with self.lock:
+            if ident not in self.thread_ids:
+                self.thread_ids[ident] = len(self.thread_ids) + 1
+
+            return self.thread_ids[ident]
+
+    def stack(self):
+        """Return the spans which are open in the current thread, innermost last."""
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = list()
+
+        return self.local.stack
+
+
+# Spans of the run in this process (see enable)
+default_recorder = recorder()
+
+
+def enable():
+    """Start recording spans in this process."""
+    default_recorder.enabled = True
+
+
+def reset():
+    """Forget every span recorded so far (e.g. between runs of a benchmark)."""
+    with default_recorder.lock:
+        default_recorder.spans = list()
+
+
+@contextlib.contextmanager
+def span(name, category='phase', **args):
+    """Record the time spent in the body of the `with` statement as a span.
+
+    Nothing is recorded (and almost no time is spent) unless enable was called.
+
+    Arguments:
+    name -- what is being done
+    category -- kind of span: 'group' (contains other work), 'task', 'phase' or 'command'
+    args -- extra information shown with the span (e.g. container=...)
+    """
+    if not default_recorder.enabled:
+        yield
+        return
+
+    s = span_record(name, category, default_recorder.thread_id(), {k: str(v) for k, v in args.items()})
+
+    # Commands are the details of a step rather than steps of their own
+    stack = default_recorder.stack()
+    if stack and category != 'command':
+        stack[-1].has_children = True
+
+    stack.append(s)
+
+    try:
+        yield s
+
+    finally:
+        s.end_time = time.time()
+        stack.pop()
+
+        with default_recorder.lock:
+            default_recorder.spans.append(s)
+
+
+def traced(category='phase'):
+    """Decorate a function so that each call to it is recorded as a span named after it.
+
+    Arguments:
+    category -- kind of span recorded for each call
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(function.__name__, category):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def spans():
+    """Return a copy of the spans which have ended so far, in order of their start times."""
+    with default_recorder.lock:
+        return sorted(default_recorder.spans, key=lambda s: s.start_time)
+
+
+def critical_path(recorded_spans):
+    """Return the chain of spans which determined when the run ended.
+
+    Only the innermost spans which are not commands are considered, since those are the steps
+    of the run. Starting from the span which ended last, each step goes back to the span which
+    ended last before the current one started, since that is the one it was waiting for.
+
+    Arguments:
+    recorded_spans -- list of span_records
+    """
+    steps = [s for s in recorded_spans
+             if s.category not in ('group', 'command') and not s.has_children and s.end_time is not None]
+
+    if not steps:
+        return list()
+
+    path = [max(steps, key=lambda s: s.end_time)]
+
+    while True:
+        before = [s for s in steps if s.end_time <= path[-1].start_time and s.start_time < path[-1].start_time]
+        if not before:
+            break
+
+        path.append(max(before, key=lambda s: s.end_time))
+
+    return list(reversed(path))
+
+
+def write_trace(path):
+    """Write the recorded spans to `path` in the Chrome trace event format.
+
+    The file can be opened with chrome://tracing or https://ui.perfetto.dev.
+
+    Arguments:
+    path -- local path to the JSON file to write
+    """
+    recorded_spans = spans()
+    origin = recorded_spans[0].start_time if recorded_spans else 0
+
+    events = [{
+        'name': s.name,
+        'cat': s.category,
+        'ph': 'X',
+        'ts': int((s.start_time - origin) * 1e6),
+        'dur': int(s.duration() * 1e6),
+        'pid': os.getpid(),
+        'tid': s.thread_id,
+        'args': s.args
+    } for s in recorded_spans]
+
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def summary(command_count=10):
+    """Return a short text summary of the critical path and the slowest commands.
+
+    Arguments:
+    command_count -- number of the slowest commands to list
+    """
+    recorded_spans = spans()
+    if not recorded_spans:
+        return 'no spans recorded\n'
+
+    origin = recorded_spans[0].start_time
+    total = max(s.end_time for s in recorded_spans) - origin
+
+    lines = ['total [{:.1f}s]'.format(total), '', 'critical path:']
+
+    for s in critical_path(recorded_spans):
+        lines.append('  {0:>8.1f}s  {1:>5.1f}%  +{2:.1f}s  {3}'.format(
+            s.duration(), 100 * s.duration() / total if total else 0, s.start_time - origin, s.name))
+
+    commands = sorted([s for s in recorded_spans if s.category == 'command'], key=lambda s: s.duration(), reverse=True)
+
+    if commands:
+        lines.extend(['', 'slowest commands:'])
+
+        for s in commands[:command_count]:
+            lines.append('  {0:>8.1f}s  [{1}] {2}'.format(s.duration(), s.args.get('container'), s.args.get('command')))
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_reports(output_directory):
+    """Write trace.json and trace_summary.txt for the run to `output_directory`.
+
+    Arguments:
+    output_directory -- local directory in which the files are written
+    """
+    try:
+        write_trace(os.path.join(output_directory, 'trace.json'))
+
+        text = summary()
+        with open(os.path.join(output_directory, 'trace_summary.txt'), 'w') as f:
+            f.write(text)
+
+        logging.info('trace summary:\n{}'.format(text))
+
+    except Exception as e:
+        logging.error('failed to write trace [{}]'.format(output_directory))
+        logging.error(e)